@@ -4,17 +4,35 @@ from math import sqrt
 import socket
 import subprocess
 import os
-import signal
 import random
 import statistics
+import argparse
 from time import sleep
+from typing import Dict, List
+
+from pcap import LiveCapture
+
+parser = argparse.ArgumentParser(description="Benchmark communication cost of issuance and showing.")
+parser.add_argument(
+    "--keep-pcap",
+    help="Also write the captures to pcap files (to benchmark_communication/).",
+    action="store_true"
+)
+parser.add_argument(
+    "-i",
+    "--interface",
+    help="Interface to capture on.",
+    default="eth0",
+    type=str
+)
+args = parser.parse_args()
 
 # Create directories for storing pcap files (if it doesn't alredy exist)
 curr_dir = os.path.abspath(os.path.dirname(__file__))
 
 capture_path = os.path.join(curr_dir, 'benchmark_communication')
 
-if not os.path.exists(capture_path):
+if args.keep_pcap and not os.path.exists(capture_path):
 
     os.makedirs(capture_path)
 
@@ -40,120 +58,77 @@ avg_packet_size_showing_overall = []
 avg_packet_size_showing_incoming = []
 avg_packet_size_showing_outgoing = []
 
-for i in range(100):
-
-    # Pt. 1: benchmark number of packets & avg packet size for issuance protocol
-
-    # Remove credential if existent
-    if os.path.exists("anon.cred"):
-        os.remove("anon.cred")
 
-    # NOTE we're assuming here the server has already been setup using the available
-    #       subscriptions from the documentation (restaurant, bar, sushi)
-    #       and the client has run 'get_pk'
-    #       already so as to obtain the issuer's public key
+def capture_traffic(cmd: List[str], pcap_filename: str) -> Dict[str, Dict[str, float]]:
+    """ Run `cmd` while capturing, return the statistics of the traffic per direction """
 
-    overall_issuance_capture_path = os.path.join(
-        capture_path, f'traffic_run{i}_issuance.pcap')
+    pcap_path = None
 
-    incoming_issuance_capture_path = os.path.join(
-        capture_path, f'traffic_run{i}_issuance_incoming.pcap')
+    if args.keep_pcap:
 
-    outgoing_issuance_capture_path = os.path.join(
-        capture_path, f'traffic_run{i}_issuance_outgoing.pcap')
+        pcap_path = os.path.join(capture_path, pcap_filename)
 
-    print(overall_issuance_capture_path)
+        print(pcap_path)
 
-    # Start recording using tcpdump
-    # subprocess.Popen
-    p1 = subprocess.Popen(
-        ['tshark', '-i', 'eth0', '-w', overall_issuance_capture_path],  preexec_fn=os.setsid, close_fds=True)
+    # Start recording; statistics for incoming (ip.src != own_ip) and outgoing (ip.src == own_ip)
+    # packets are computed while the packets come in
+    capture = LiveCapture(ip_address, args.interface, pcap_path).start()
 
     sleep(5)
 
-    # Send registration request
-    subprocess.Popen(
-        ['python3', 'client.py', 'register', '-u', 'your_name', '-S', 'restaurant', '-S', 'bar'], close_fds=True
-    ).wait()
+    subprocess.Popen(cmd, close_fds=True).wait()
 
     sleep(15)
 
     # Stop the recording
-    os.killpg(os.getpgid(p1.pid), signal.SIGTERM)
+    return capture.stop()
 
-    # Write the ingoing- and outgoing-only files (so statistics can be computed for those separately)
-    status_in = subprocess.call(
-        ["tshark", "-r", overall_issuance_capture_path, "-w", incoming_issuance_capture_path, "-Y", f"!(ip.src == {ip_address})"])
 
-    status_out = subprocess.call(
-        ["tshark", "-r", overall_issuance_capture_path, "-w", outgoing_issuance_capture_path, "-Y", f"ip.src == {ip_address}"])
-
-    # Calculate number of packets & avg packet size for overall capture
-    '''
-    try:
-        
-        num_packets_issuance_overall_elem = subprocess.check_output(
-        ['capinfos', '-c', overall_issuance_capture_path])
-
-    except:
-
-        ["pcapfix", "-d", overall_issuance_capture_path]
+for i in range(100):
 
-        num_packets_issuance_overall_elem = subprocess.check_output(
-        ['capinfos', '-c', overall_issuance_capture_path])
+    # Pt. 1: benchmark number of packets & avg packet size for issuance protocol
 
-    '''
+    # Remove credential if existent
+    if os.path.exists("anon.cred"):
+        os.remove("anon.cred")
 
-   #  num_packets_issuance_overall.append(int(num_packets_issuance_overall_elem))
+    # NOTE we're assuming here the server has already been setup using the available
+    #       subscriptions from the documentation (restaurant, bar, sushi)
+    #       and the client has run 'get_pk'
+    #       already so as to obtain the issuer's public key
 
-    '''
-    avg_packet_size_issuance_overall_elem = subprocess.check_output(
-        ['capinfos', '-z', overall_issuance_capture_path])
-    avg_packet_size_issuance_overall.append(
-        int(avg_packet_size_issuance_overall_elem))
+    # Send registration request
+    issuance = capture_traffic(
+        ['python3', 'client.py', 'register', '-u', 'your_name', '-S', 'restaurant', '-S', 'bar'],
+        f'traffic_run{i}_issuance.pcap')
 
-    '''
+    num_packets_issuance_overall.append(issuance['overall']['number_of_packets'])
+    avg_packet_size_issuance_overall.append(issuance['overall']['avg_packet_size'])
 
-    # Calculate number of packets & avg packet size for incoming only capture
-    num_packets_issuance_incoming_output = subprocess.check_output(
-        ['capinfos', '-c', incoming_issuance_capture_path])
-    
-    num_packets_issuance_incoming_output_list = num_packets_issuance_incoming_output.split()
-    num_packets_issuance_incoming_elem = int((num_packets_issuance_incoming_output_list[len(num_packets_issuance_incoming_output_list) - 1]).decode('utf-8'))
+    # Number of packets & avg packet size for incoming packets
+    num_packets_issuance_incoming_elem = issuance['incoming']['number_of_packets']
 
     print(f'[Issuance] Num packets incoming: {num_packets_issuance_incoming_elem}')
 
     num_packets_issuance_incoming.append(
         num_packets_issuance_incoming_elem)
 
-    avg_packet_size_issuance_incoming_output = subprocess.check_output(
-        ['capinfos', '-z', incoming_issuance_capture_path])
-
-    avg_packet_size_issuance_incoming_output_list = avg_packet_size_issuance_incoming_output.split()
-    avg_packet_size_issuance_incoming_elem = float((avg_packet_size_issuance_incoming_output_list[len(avg_packet_size_issuance_incoming_output_list) - 2]).decode('utf-8'))
+    avg_packet_size_issuance_incoming_elem = issuance['incoming']['avg_packet_size']
 
     print(f'[Issuance] Avg packet size incoming: {avg_packet_size_issuance_incoming_elem}')
 
     avg_packet_size_issuance_incoming.append(
         avg_packet_size_issuance_incoming_elem)
 
-    # Calculate number of packets & avg packet size for outgoing only capture
-    num_packets_issuance_outgoing_output = subprocess.check_output(
-        ['capinfos', '-c', outgoing_issuance_capture_path])
-
-    num_packets_issuance_outgoing_output_list = num_packets_issuance_outgoing_output.split()
-    num_packets_issuance_outgoing_elem = int((num_packets_issuance_outgoing_output_list[len(num_packets_issuance_outgoing_output_list) - 1]).decode('utf-8'))
+    # Number of packets & avg packet size for outgoing packets
+    num_packets_issuance_outgoing_elem = issuance['outgoing']['number_of_packets']
 
     print(f'[Issuance] Num packets outgoing: {num_packets_issuance_outgoing_elem}')
 
     num_packets_issuance_outgoing.append(
         num_packets_issuance_outgoing_elem)
 
-    avg_packet_size_issuance_outgoing_output = subprocess.check_output(
-        ['capinfos', '-z', outgoing_issuance_capture_path])
-
-    avg_packet_size_issuance_outgoing_output_list = avg_packet_size_issuance_outgoing_output.split()
-    avg_packet_size_issuance_outgoing_elem = float((avg_packet_size_issuance_outgoing_output_list[len(avg_packet_size_issuance_outgoing_output_list) - 2]).decode('utf-8'))
+    avg_packet_size_issuance_outgoing_elem = issuance['outgoing']['avg_packet_size']
 
     print(f'[Issuance] Avg packet size outgoing: {avg_packet_size_issuance_outgoing_elem}')
 
@@ -162,97 +137,44 @@ for i in range(100):
 
     # --------------------------------------------------------------------------------
 
-    # Pt. 2: benchmark number of packets & avg packet size for issuance protocol
-
-    overall_showing_capture_path = os.path.join(
-        capture_path, f'traffic_run{i}_showing.pcap')
-
-    incoming_showing_capture_path = os.path.join(
-        capture_path, f'traffic_run{i}_showing_incoming.pcap')
-
-    outgoing_showing_capture_path = os.path.join(
-        capture_path, f'traffic_run{i}_showing_outgoing.pcap')
+    # Pt. 2: benchmark number of packets & avg packet size for showing protocol
 
     # Calculate a random location to query POIs for
     lat = round(random.uniform(46.5, 46.57),2)
     lon = round(random.uniform(6.55, 6.65),2)
 
-    # Start recording using tcpdump
-    # subprocess.Popen
-    p3 = subprocess.Popen(
-        ['tshark', '-i', 'eth0', '-w', overall_showing_capture_path],  preexec_fn=os.setsid, close_fds=True)
-
-    sleep(5)
-
     # Send a location query
-    p4 = subprocess.Popen(
-        ['python3', 'client.py', 'loc', str(lat), str(lon), '-T', 'restaurant', '-T', 'bar'], close_fds=True
-    ).wait()
+    showing = capture_traffic(
+        ['python3', 'client.py', 'loc', str(lat), str(lon), '-T', 'restaurant', '-T', 'bar'],
+        f'traffic_run{i}_showing.pcap')
 
-    sleep(15)
-
-    # Stop the recording
-    os.killpg(os.getpgid(p3.pid), signal.SIGTERM)
-
-    # Write the ingoing- and outgoing-only files (so statistics can be computed for those separately)
-    status_in = subprocess.call(
-        ["tshark", "-r", overall_showing_capture_path, "-w", incoming_showing_capture_path, "-Y", f"!(ip.src == {ip_address})"])
-
-    status_out = subprocess.call(
-        ["tshark", "-r", overall_showing_capture_path, "-w", outgoing_showing_capture_path, "-Y", f"ip.src == {ip_address}"])
-
-    # Calculate number of packets & avg packet size for overall capture
-    '''
-    num_packets_showing_overall_elem = subprocess.check_output(
-        ['capinfos', '-c', overall_showing_capture_path])
-    num_packets_showing_overall.append(int(num_packets_showing_overall_elem))
+    num_packets_showing_overall.append(showing['overall']['number_of_packets'])
+    avg_packet_size_showing_overall.append(showing['overall']['avg_packet_size'])
 
-    avg_packet_size_showing_overall_elem = subprocess.check_output(
-        ['capinfos', '-z', overall_showing_capture_path])
-    avg_packet_size_showing_overall.append(
-        int(avg_packet_size_showing_overall_elem))
-    '''
-
-    # Calculate number of packets & avg packet size for incoming only capture
-    num_packets_showing_incoming_output = subprocess.check_output(
-        ['capinfos', '-c', incoming_showing_capture_path])
-
-    num_packets_showing_incoming_output_list = num_packets_showing_incoming_output.split()
-    num_packets_showing_incoming_elem = int((num_packets_showing_incoming_output_list[len(num_packets_showing_incoming_output_list) - 1]).decode('utf-8'))
+    # Number of packets & avg packet size for incoming packets
+    num_packets_showing_incoming_elem = showing['incoming']['number_of_packets']
 
     print(f'[Showing] Num packets incoming: {num_packets_showing_incoming_elem}')
 
     num_packets_showing_incoming.append(
         num_packets_showing_incoming_elem)
 
-    avg_packet_size_showing_incoming_output = subprocess.check_output(
-        ['capinfos', '-z', incoming_showing_capture_path])
-
-    avg_packet_size_showing_incoming_output_list = avg_packet_size_showing_incoming_output.split()
-    avg_packet_size_showing_incoming_elem = float((avg_packet_size_showing_incoming_output_list[len(avg_packet_size_showing_incoming_output_list) - 2]).decode('utf-8'))
+    avg_packet_size_showing_incoming_elem = showing['incoming']['avg_packet_size']
 
     print(f'[Showing] Avg packet size incoming: {avg_packet_size_showing_incoming_elem}')
 
     avg_packet_size_showing_incoming.append(
         avg_packet_size_showing_incoming_elem)
 
-    # Calculate number of packets & avg packet size for outgoing only capture
-    num_packets_showing_outgoing_output = subprocess.check_output(
-        ['capinfos', '-c', outgoing_showing_capture_path])
-
-    num_packets_showing_outgoing_output_list = num_packets_showing_outgoing_output.split()
-    num_packets_showing_outgoing_elem = int((num_packets_showing_outgoing_output_list[len(num_packets_showing_outgoing_output_list) - 1]).decode('utf-8'))
+    # Number of packets & avg packet size for outgoing packets
+    num_packets_showing_outgoing_elem = showing['outgoing']['number_of_packets']
 
     print(f'[Showing] Num packets outgoing: {num_packets_showing_outgoing_elem}')
 
     num_packets_showing_outgoing.append(
         num_packets_showing_outgoing_elem)
 
-    avg_packet_size_showing_outgoing_output = subprocess.check_output(
-        ['capinfos', '-z', outgoing_showing_capture_path])
-
-    avg_packet_size_showing_outgoing_output_list = avg_packet_size_showing_outgoing_output.split()
-    avg_packet_size_showing_outgoing_elem = float((avg_packet_size_showing_outgoing_output_list[len(avg_packet_size_showing_outgoing_output_list) - 2]).decode('utf-8'))
+    avg_packet_size_showing_outgoing_elem = showing['outgoing']['avg_packet_size']
 
     print(f'[Showing] Avg packet size outgoing: {avg_packet_size_showing_outgoing_elem}')
 
@@ -262,8 +184,8 @@ for i in range(100):
     # ------------------------------------------------------------------------------------------------------
 
 # Num Packets, Packet Size ISSUANCE OVERALL
-# print(f'[Issuance Overall Num Packets] Mean (100 runs): {statistics.mean(num_packets_issuance_overall)}, SE: {statistics.stdev(num_packets_issuance_overall)/sqrt(100)}')
-# print(f'[Issuance Overall Avg Packet Size] Mean (100 runs): {statistics.mean(avg_packet_size_issuance_overall)}, SE: {statistics.stdev(avg_packet_size_issuance_overall)/sqrt(100)}')
+print(f'[Issuance Overall Num Packets] Mean (100 runs): {statistics.mean(num_packets_issuance_overall)}, SE: {statistics.stdev(num_packets_issuance_overall)/sqrt(100)}')
+print(f'[Issuance Overall Avg Packet Size] Mean (100 runs): {statistics.mean(avg_packet_size_issuance_overall)}, SE: {statistics.stdev(avg_packet_size_issuance_overall)/sqrt(100)}')
 
 # Num Packets, Packet Size ISSUANCE INCOMING
 print(f'[Issuance Incoming Num Packets] Mean (100 runs): {statistics.mean(num_packets_issuance_incoming)}, SE: {statistics.stdev(num_packets_issuance_incoming)/sqrt(100)}')
@@ -274,8 +196,8 @@ print(f'[Issuance Outgoing Num Packets] Mean (100 runs): {statistics.mean(num_pa
 print(f'[Issuance Outgoing Avg Packet Size] Mean (100 runs): {statistics.mean(avg_packet_size_issuance_outgoing)}, SE: {statistics.stdev(avg_packet_size_issuance_outgoing)/sqrt(100)}')
 
 # Num Packets, Packet Size SHOWING OVERALL
-# print(f'[Showing Overall Num Packets] Mean (100 runs): {statistics.mean(num_packets_showing_overall)}, SE: {statistics.stdev(num_packets_showing_overall)/sqrt(100)}')
-# print(f'[Showing Overall Avg Packet Size] Mean (100 runs): {statistics.mean(avg_packet_size_showing_overall)}, SE: {statistics.stdev(avg_packet_size_showing_overall)/sqrt(100)}')
+print(f'[Showing Overall Num Packets] Mean (100 runs): {statistics.mean(num_packets_showing_overall)}, SE: {statistics.stdev(num_packets_showing_overall)/sqrt(100)}')
+print(f'[Showing Overall Avg Packet Size] Mean (100 runs): {statistics.mean(avg_packet_size_showing_overall)}, SE: {statistics.stdev(avg_packet_size_showing_overall)/sqrt(100)}')
 
 # Num Packets, Packet Size SHOWING INCOMING
 print(f'[Showing Incoming Num Packets] Mean (100 runs): {statistics.mean(num_packets_showing_incoming)}, SE: {statistics.stdev(num_packets_showing_incoming)/sqrt(100)}')
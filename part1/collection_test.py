@@ -0,0 +1,181 @@
+import pytest
+
+import os
+
+import socket
+
+import threading
+
+import time
+
+from collection import (FlowCapture, ResultsWriter, completed_tasks, local_ports,
+                        make_manifest, query_command, read_manifest)
+
+""" Test the attribution of packets to concurrent queries in collection.py """
+
+HOST_IP = '172.18.0.3'
+
+
+def test_local_ports_of_own_process() -> None:
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+
+        s.bind(('127.0.0.1', 0))
+        s.listen()
+
+        port = s.getsockname()[1]
+
+        assert local_ports({'me': os.getpid()}).get(port) == 'me'
+
+
+def test_flow_capture_attributes_packets_to_workers() -> None:
+
+    capture = FlowCapture(HOST_IP, {})
+
+    # pretend the Tor instance of worker 0 uses port 40000 and the one of worker 1 port 40001
+    capture.port_owners = {40000: 0, 40001: 1}
+    capture.last_refresh = time.monotonic() + 3600
+
+    capture.begin(0)
+    capture.begin(1)
+
+    capture.add_line(f'1.0\t100\t{HOST_IP}\t40000\t443\n')
+    capture.add_line(f'2.0\t300\t1.2.3.4\t443\t40000\n')
+    capture.add_line(f'1.5\t500\t1.2.3.4\t9001\t40001\n')
+    # unknown port, non-TCP
+    capture.add_line(f'1.7\t700\t1.2.3.4\t9001\t50000\n')
+    capture.add_line(f'1.8\t60\t\t\t\n')
+
+    statistics_0 = capture.end(0).statistics()
+    statistics_1 = capture.end(1).statistics()
+
+    assert statistics_0['overall']['number_of_packets'] == 2
+    assert statistics_0['outgoing']['data_size'] == 100
+    assert statistics_0['incoming']['data_size'] == 300
+
+    assert statistics_1['overall']['number_of_packets'] == 1
+    assert statistics_1['incoming']['data_size'] == 500
+
+
+def test_flow_capture_resolves_late_ports(monkeypatch) -> None:
+
+    capture = FlowCapture(HOST_IP, {})
+
+    # the port of worker 0 is not in /proc/net/tcp yet when its first packet arrives
+    tables = [{}, {40002: 0}]
+
+    monkeypatch.setattr('collection.local_ports', lambda pids: tables.pop(0))
+
+    capture.begin(0)
+
+    capture.add_line(f'1.0\t100\t{HOST_IP}\t40002\t443\n')
+
+    # within the refresh interval, the port is not looked up again
+    capture.add_line(f'1.1\t100\t{HOST_IP}\t40002\t443\n')
+
+    capture.last_refresh -= FlowCapture.REFRESH_INTERVAL + 1
+
+    capture.add_line(f'1.2\t300\t{HOST_IP}\t40002\t443\n')
+    capture.add_line(f'1.3\t500\t{HOST_IP}\t40002\t443\n')
+
+    statistics = capture.end(0).statistics()
+
+    assert statistics['overall']['number_of_packets'] == 2
+    assert statistics['outgoing']['data_size'] == 800
+
+
+def test_flow_capture_waits_for_late_packets() -> None:
+
+    capture = FlowCapture(HOST_IP, {}, flush_timeout=10.0)
+
+    capture.port_owners = {40000: 0}
+    capture.last_refresh = time.monotonic() + 3600
+
+    capture.begin(0)
+
+    def print_late() -> None:
+
+        time.sleep(0.2)
+
+        capture.add_line(f'1.0\t100\t{HOST_IP}\t40000\t443\n')
+        # a packet of another flow, after the end of the query
+        capture.add_line(f'2.5\t60\t\t\t\n')
+
+    capture.reader = threading.Thread(target=print_late)
+    capture.reader.start()
+
+    start = time.monotonic()
+
+    statistics = capture.end(0, until=2.0).statistics()
+
+    # the late packet is part of the trace, and end() returns as soon as the capture is past the query
+    assert statistics['overall']['number_of_packets'] == 1
+    assert time.monotonic() - start < 5.0
+
+    capture.reader.join()
+
+
+def test_flow_capture_stops_waiting_without_traffic() -> None:
+
+    capture = FlowCapture(HOST_IP, {}, flush_timeout=0.1)
+
+    capture.begin(0)
+
+    capture.reader = threading.Thread(target=time.sleep, args=(1.0,))
+    capture.reader.start()
+
+    start = time.monotonic()
+
+    assert capture.end(0, until=2.0).statistics()['overall']['number_of_packets'] == 0
+    assert time.monotonic() - start < 0.9
+
+    capture.reader.join()
+
+
+def test_query_command() -> None:
+
+    assert query_command(7) == ['python3', 'client.py', 'grid', '7', '-T', 'restaurant', '-t']
+
+    assert 'socks5h://localhost:9061' in query_command(7, 'socks5h://localhost:9061')
+
+    # cell 24 is the one of the test location 46.52345, 6.57890
+    command = query_command(24, by_location=True)
+
+    assert command[2] == 'loc'
+    assert float(command[3]) == pytest.approx(46.5245)
+    assert float(command[4]) == pytest.approx(6.575)
+
+
+def test_manifest(tmp_path) -> None:
+
+    assert make_manifest(3, 4, 2) == [(3, 0), (3, 1), (4, 0), (4, 1)]
+
+    path = tmp_path / 'manifest.jsonl'
+
+    path.write_text('{"cell": 5, "run": 0}\n\n{"cell": 5, "run": 7}\n')
+
+    assert read_manifest(str(path)) == [(5, 0), (5, 7)]
+
+
+def test_results_are_resumable(tmp_path) -> None:
+
+    path = str(tmp_path / 'results.jsonl')
+
+    assert completed_tasks(path) == set()
+
+    with ResultsWriter(path) as results:
+
+        results.write({'cell': 1, 'run': 0, 'overall_number_of_packets': 10})
+        results.write({'cell': 1, 'run': 1, 'overall_number_of_packets': 12})
+
+    # simulate a crash in the middle of writing a record
+    with open(path, 'a') as f:
+        f.write('{"cell": 1, "run": 2, "overa')
+
+    assert completed_tasks(path) == {(1, 0), (1, 1)}
+
+    with ResultsWriter(path) as results:
+
+        results.write({'cell': 1, 'run': 2, 'overall_number_of_packets': 11})
+
+    assert completed_tasks(path) == {(1, 0), (1, 1), (1, 2)}
@@ -6,7 +6,7 @@ import hashlib
 
 from typing import List, Tuple, Dict
 
-from credential import generate_key, sign, verify
+from credential import generate_key, sign, sign_exponent, sign_many, verify
 
 from keys import PublicKey, SecretKey
 
@@ -128,3 +128,41 @@ def test_verify() -> None:
     verification_res = verify(pk, signature, attribute_values)
 
     assert verification_res == True
+
+
+def test_sign_many() -> None:
+
+    available_subscriptions: List[str] = ['restaurants', 'bars',
+                                          'dojos', 'cinemas', 'zendos', 'gyms']
+
+    username: str = 'zoé'
+
+    attributes: List[str] = available_subscriptions + [username]
+
+    pk, issuer_sk = generate_key(attributes)
+
+    username_hashed = int(hashlib.sha256(username.encode('utf-8')).hexdigest(), 16)
+
+    attribute_values_list = [
+        [1, 1, 1, 0, 0, 1, username_hashed, 42],
+        [0, 0, 0, 0, 0, 0, username_hashed, 43],
+        [1, 0, 1, 0, 1, 0, username_hashed, 44]]
+
+    signatures: List[Signature] = sign_many(issuer_sk, attribute_values_list)
+
+    assert len(signatures) == len(attribute_values_list)
+
+    for signature, attribute_values in zip(signatures, attribute_values_list):
+
+        # h^(x + sum(m_i * y_i)) is the product h^x * h^(m_1*y_1) * ... * h^(m_L*y_L)
+        assert signature[1] == signature[0] ** sign_exponent(issuer_sk, attribute_values)
+
+        assert verify(pk, signature, attribute_values) == True
+
+    # every signature has its own random base h
+    for i, signature in enumerate(signatures):
+        assert all(signature[0] != other[0] for other in signatures[i + 1:])
+
+    assert sign(issuer_sk, attribute_values_list[0])[0] != signatures[0][0]
+
+    assert verify(pk, signatures[0], attribute_values_list[1]) == False
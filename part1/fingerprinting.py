@@ -1,14 +1,67 @@
 import numpy as np
 
-from sklearn.model_selection import train_test_split
+import joblib
+from joblib import Parallel, delayed
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import StratifiedKFold
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
-import pandas as pd
+from sklearn.model_selection import KFold, StratifiedKFold
+import argparse
+import itertools
+import json
+import math
+import os
 import sys
 import statistics
+import time
 
-def classify(train_features, train_labels, test_features, test_labels):
+from dataset import (DIRECTIONS, FEATURE_NAMES, FEATURES_DTYPE, LABEL, LABELS_DTYPE, STATISTICS,
+                     add_kfp_features, derive_features, load_dataset, read_records)
+from features import KFP_FEATURE_NAMES, OUTGOING, PacketSequences, extract_batch
+from hamming import HammingIndex
+from metrics import accuracy, confusion, report
+from pcap import TraceAccumulator
+
+MODEL_VERSION = 1
+
+# Number of earlier traces a model keeps to train the trees of later updates on
+RESERVOIR_SIZE = 10000
+
+# Label of the traces of unmonitored queries in the open world
+UNMONITORED = -1
+
+# Candidates of the hyperparameter search (see search_parameters)
+PARAMETER_GRID = {
+    'n_estimators': [25, 50, 100, 200],
+    'max_depth': [None, 10, 20],
+    'max_features': ['sqrt', 0.5],
+}
+
+
+def cpu_budget(n_jobs=None):
+    """Number of cores to use: all of them for None or -1, at most n_jobs otherwise"""
+
+    cores = os.cpu_count() or 1
+
+    if n_jobs is None or n_jobs < 0:
+        return cores
+
+    return max(1, min(n_jobs, cores))
+
+
+def split_budget(n_jobs, folds):
+    """Split a CPU budget into (folds evaluated in parallel, cores per forest)
+
+    Folds are cheaper to parallelize than trees (no shared state at all), so every
+    fold gets a core first; the forests use the cores that are left over.
+    """
+
+    cores = cpu_budget(n_jobs)
+
+    fold_jobs = min(folds, cores)
+
+    return fold_jobs, max(1, cores // fold_jobs)
+
+
+def classify(train_features, train_labels, test_features, n_jobs=None, **params):
     """Function to perform classification, using a 
     Random Forest. 
 
@@ -18,7 +71,8 @@ def classify(train_features, train_labels, test_features, test_labels):
         train_features (numpy array): list of features used to train the classifier
         train_labels (numpy array): list of labels used to train the classifier
         test_features (numpy array): list of features used to test the classifier
-        test_labels (numpy array): list of labels (ground truth) of the test dataset
+        n_jobs (int): number of cores used to train the forest (None: one)
+        params: further parameters of the RandomForestClassifier
 
     Returns:
         predictions: list of labels predicted by the classifier for test_features
@@ -27,80 +81,735 @@ def classify(train_features, train_labels, test_features, test_labels):
     """
 
     # Initialize a random forest classifier. Change parameters if desired.
-    clf = RandomForestClassifier()
+    clf = RandomForestClassifier(n_jobs=n_jobs, **params)
     # Train the classifier using the training features and labels.
     clf.fit(train_features, train_labels)
     # Use the classifier to make predictions on the test features.
     predictions = clf.predict(test_features)
 
-    # Compute performance metrics
-    confusion_matrix_ = confusion_matrix(test_labels,predictions)
-    classification_report_ = classification_report(test_labels,predictions)
-    accuracy_score_ = accuracy_score(test_labels, predictions)
-
-    # print(accuracy_score(test_labels, predictions))
+    return predictions
 
-    metrics = (confusion_matrix_, classification_report_, accuracy_score_)
 
-    return predictions, metrics
+def evaluate_fold(features, labels, train_index, test_index, all_labels, n_jobs=None):
+    """Train and test the classifier on one fold, return the confusion matrix of the fold"""
 
-def find_percentage_agreement(s1, s2):
-    assert len(s1)==len(s2), "Lists must have the same shape"
-    nb_agreements = 0  # initialize counter to 0
-    for idx, value in enumerate(s1):
-        if s2[idx] == value:
-            nb_agreements += 1
+    X_train, X_test = features[train_index], features[test_index]
+    y_train, y_test = labels[train_index], labels[test_index]
 
-    percentage_agreement = nb_agreements/len(s1)
+    predictions = classify(X_train, y_train, X_test, n_jobs)
 
-    return percentage_agreement
+    return confusion(y_test, predictions, all_labels)
 
 
-def perform_crossval(features, labels, folds=10):
+def perform_crossval(features, labels, folds=10, n_jobs=None):
     """Function to perform cross-validation.
     Args:
         features (list): list of features
         labels (list): list of labels
         folds (int): number of fold for cross-validation (default=10)
+        n_jobs (int): CPU budget (default: all cores), shared between folds
+            evaluated in parallel and the forests of the folds
     Returns:
-        You can modify this as you like.
+        numpy array: the confusion matrix pooled over all folds (rows: true
+            labels, columns: predicted labels, both in sorted order)
 
     This function splits the data into training and test sets. It feeds
-    the sets into the classify() function for each fold. 
-
-    You need to use the data returned by classify() over all folds 
-    to evaluate the performance.         
+    the sets into the classify() function for each fold. The predictions
+    of all folds are pooled into one confusion matrix, from which accuracy,
+    precision and recall are derived (see metrics.py).
     """
 
     kf = StratifiedKFold(n_splits=folds)
-    labels = np.array(labels)
-    features = np.array(features)
-    accuracies = []
+    # no copies: a memory-mapped float32 matrix is used by the forests as it is
+    labels = np.asarray(labels)
+    features = np.asarray(features)
+    all_labels = np.unique(labels)
+
+    splits = list(kf.split(features, labels))
+
+    fold_jobs, forest_jobs = split_budget(n_jobs, folds)
+
+    # joblib hands large arrays to the worker processes as memory maps instead of copies
+    results = Parallel(n_jobs=fold_jobs)(
+        delayed(evaluate_fold)(features, labels, train_index, test_index, all_labels, forest_jobs)
+        for train_index, test_index in splits)
+
+    for fold, matrix in enumerate(results):
+        print(f'Fold {fold}: accuracy {accuracy(matrix)}')
+
+    pooled = np.sum(results, axis=0)
+
+    print(report(pooled, all_labels))
+
+    print(f'Mean accuracy: {statistics.mean(accuracy(matrix) for matrix in results)}')
+
+    return pooled
+
+
+def candidate_grid(grid=PARAMETER_GRID):
+    """All combinations of the parameter values in grid, as keyword arguments"""
+
+    names = sorted(grid)
+
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def time_candidate(features, labels, train_index, test_index, all_labels, params, columns=None):
+    """Train and test one candidate on one fold (with one core)
+
+    Args:
+        columns (list): if set, only these feature columns are used
+    Returns:
+        (confusion matrix, training seconds, prediction seconds per trace)
+    """
+
+    X_train, X_test = features[train_index], features[test_index]
+
+    if columns is not None:
+        X_train, X_test = X_train[:, columns], X_test[:, columns]
+    y_train, y_test = labels[train_index], labels[test_index]
+
+    clf = RandomForestClassifier(n_jobs=1, **params)
+
+    start = time.perf_counter()
+    clf.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = clf.predict(X_test)
+    predict_seconds = (time.perf_counter() - start) / len(X_test)
+
+    return confusion(y_test, predictions, all_labels), fit_seconds, predict_seconds
+
+
+def rank(result, target):
+    """Sort key of search results: candidates reaching the target by speed, the others by accuracy"""
+
+    if result['accuracy'] >= target:
+        return (0, result['predict_seconds'], result['fit_seconds'])
+
+    return (1, -result['accuracy'], result['predict_seconds'])
+
+
+def search_parameters(features, labels, target, grid=PARAMETER_GRID, folds=10, halving=False,
+                      eta=3, n_jobs=None):
+    """Search the forest parameters for the fastest model that reaches the target accuracy
+
+    The fold splits are computed once and shared by all candidates, and the
+    (memory-mapped) features are handed to the workers once per round; every
+    (candidate, fold) pair is an independent job.
+
+    With halving (successive halving), all candidates are first evaluated on
+    one fold only; after every round the best 1/eta of them (see rank) are
+    evaluated on eta times as many folds, until all folds are used.
+
+    Args:
+        features (numpy array): one row per trace
+        labels (numpy array): the cell of each trace
+        target (float): accuracy the model has to reach
+        grid (dict): parameter name -> candidate values
+        folds (int): number of cross-validation folds
+        halving (bool): use successive halving instead of a full grid search
+        eta (int): reduction factor of successive halving
+        n_jobs (int): CPU budget (default: all cores)
+    Returns:
+        list: one dict per candidate (params, folds, accuracy, fit_seconds,
+            predict_seconds), the best first
+    """
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+    all_labels = np.unique(labels)
+
+    splits = list(StratifiedKFold(n_splits=folds).split(features, labels))
+
+    candidates = candidate_grid(grid)
+
+    num_folds = 1 if halving else folds
+
+    results = {}
+
+    with Parallel(n_jobs=cpu_budget(n_jobs)) as parallel:
+
+        while True:
+
+            jobs = [(i, fold) for i in range(len(candidates)) for fold in range(num_folds)]
+
+            timings = parallel(
+                delayed(time_candidate)(features, labels, *splits[fold], all_labels, candidates[i])
+                for i, fold in jobs)
+
+            round_results = []
+
+            for i in range(len(candidates)):
+
+                runs = [timing for (j, _), timing in zip(jobs, timings) if j == i]
+
+                result = {
+                    'params': candidates[i],
+                    'folds': num_folds,
+                    'accuracy': accuracy(np.sum([matrix for matrix, _, _ in runs], axis=0)),
+                    'fit_seconds': statistics.mean(fit for _, fit, _ in runs),
+                    'predict_seconds': statistics.mean(predict for _, _, predict in runs),
+                }
+
+                results[json.dumps(candidates[i], sort_keys=True)] = result
+
+                round_results.append(result)
+
+            if num_folds == folds or len(candidates) == 1:
+                break
+
+            round_results.sort(key=lambda result: rank(result, target))
+
+            candidates = [result['params'] for result in round_results[:math.ceil(len(candidates) / eta)]]
+
+            num_folds = min(num_folds * eta, folds)
+
+    # candidates that made it to later rounds were evaluated on more folds
+    return sorted(results.values(), key=lambda result: (-result['folds'], rank(result, target)))
+
+
+class FingerprintingModel:
+
+    'Class for a trained classifier together with the features and labels it was trained on'
+
+    def __init__(self, classifier, feature_names, num_traces=0, reservoir=None, reservoir_size=RESERVOIR_SIZE):
+        """
+        Args:
+            classifier (RandomForestClassifier): the fitted classifier
+            feature_names (list): names of the feature columns the classifier expects
+            num_traces (int): number of traces the classifier was trained on so far
+            reservoir (tuple): (features, labels) of a uniform sample of these traces
+            reservoir_size (int): maximum number of traces in the reservoir
+        """
+
+        self.classifier = classifier
+
+        self.feature_names = list(feature_names)
+
+        self.num_traces = num_traces
+
+        if reservoir is None:
+            reservoir = (np.empty((0, len(self.feature_names)), dtype=FEATURES_DTYPE),
+                         np.empty(0, dtype=LABELS_DTYPE))
+
+        self.reservoir = reservoir
+
+        self.reservoir_size = reservoir_size
+
+    @property
+    def labels(self):
+        """The label map: column i of predict_proba is the probability of labels[i]"""
+
+        return self.classifier.classes_
+
+    @classmethod
+    def train(cls, features, labels, feature_names, n_jobs=None, **params):
+        """Fit a random forest on all the given traces
+
+        Args:
+            features (numpy array): one row per trace
+            labels (numpy array): the cell of each trace
+            feature_names (list): names of the feature columns
+            n_jobs (int): number of cores used for training (None: all)
+            params: further parameters of the RandomForestClassifier
+        """
+
+        classifier = RandomForestClassifier(n_jobs=cpu_budget(n_jobs), **params)
+
+        classifier.fit(features, labels)
+
+        model = cls(classifier, feature_names)
+
+        model.remember(features, labels)
+
+        return model
+
+    def remember(self, features, labels, rng=None):
+        """Count traces as trained on, keeping a uniform sample of all of them in the reservoir
+
+        Reservoir sampling (algorithm R): the n-th trace replaces a random trace
+        of the full reservoir with probability reservoir_size / n.
+        """
+
+        rng = np.random.default_rng() if rng is None else rng
+
+        features = np.asarray(features, dtype=FEATURES_DTYPE)
+        labels = np.asarray(labels, dtype=LABELS_DTYPE)
+
+        kept_features, kept_labels = self.reservoir
+
+        free = max(0, self.reservoir_size - len(kept_labels))
+
+        kept_features = np.concatenate([kept_features, features[:free]])
+        kept_labels = np.concatenate([kept_labels, labels[:free]])
+
+        if len(labels) > free:
+
+            # position (0-based) of each of the other traces among all traces trained on
+            positions = self.num_traces + free + np.arange(len(labels) - free)
+
+            slots = rng.integers(0, positions + 1)
+
+            # in order, so a later trace wins a slot drawn twice
+            for i in np.flatnonzero(slots < self.reservoir_size):
+
+                kept_features[slots[i]] = features[free + i]
+                kept_labels[slots[i]] = labels[free + i]
+
+        self.reservoir = (kept_features, kept_labels)
+
+        self.num_traces += len(labels)
+
+    def update(self, features, labels, trees=20, max_trees=None):
+        """Train additional trees on the new traces and the reservoir (warm start)
+
+        The existing trees are kept as they are, so the cost only depends on the
+        number of new traces, the size of the reservoir and the number of trees.
+        The new traces must be of known cells.
+
+        Trained on the new traces only, the new trees would vote for the cells of
+        the latest batch. They are therefore also trained on the reservoir, a
+        uniform sample of all earlier traces, weighted to stand in for all of
+        them: the new trees see (an estimate of) the full history. Cells that
+        are neither in the batch nor in the reservoir are still unknown to the
+        new trees; their votes for these cells are 0.
+
+        Args:
+            features (numpy array): the new traces, one row per trace
+            labels (numpy array): the cell of each new trace
+            trees (int): number of trees to add
+            max_trees (int): if set, drop the oldest trees beyond this number
+        """
+
+        features = np.asarray(features, dtype=FEATURES_DTYPE)
+        labels = np.asarray(labels)
+
+        unknown = np.setdiff1d(labels, self.labels)
+
+        if len(unknown):
+            raise ValueError(f'Cells {unknown.tolist()} are unknown to the model, retrain it from scratch')
+
+        kept_features, kept_labels = self.reservoir
+
+        # every trace of the reservoir stands in for num_traces / len(reservoir) earlier traces
+        kept_weight = self.num_traces / len(kept_labels) if len(kept_labels) else 0.0
+
+        # Every tree has to know all cells, so that the votes of old and new trees line up.
+        # Cells without any trace get one sample of weight 0, which never influences a split.
+        missing = np.setdiff1d(self.labels, np.concatenate([labels, kept_labels]))
+
+        train_features = np.concatenate([features, kept_features,
+                                         np.zeros((len(missing), len(self.feature_names)), dtype=FEATURES_DTYPE)])
+
+        train_labels = np.concatenate([labels, kept_labels, missing]).astype(self.labels.dtype)
+
+        sample_weight = np.concatenate([np.ones(len(labels)), np.full(len(kept_labels), kept_weight),
+                                        np.zeros(len(missing))])
+
+        self.classifier.set_params(warm_start=True,
+                                   n_estimators=len(self.classifier.estimators_) + trees)
+
+        self.classifier.fit(train_features, train_labels, sample_weight=sample_weight)
+
+        if max_trees is not None and len(self.classifier.estimators_) > max_trees:
+
+            self.classifier.estimators_ = self.classifier.estimators_[-max_trees:]
+
+            self.classifier.set_params(n_estimators=max_trees)
+
+        self.remember(features, labels)
+
+    def save(self, path):
+        """Write the model to the directory path (model.joblib, reservoir.npz and model.json)"""
+
+        os.makedirs(path, exist_ok=True)
+
+        joblib.dump(self.classifier, os.path.join(path, 'model.joblib'), compress=3)
+
+        np.savez(os.path.join(path, 'reservoir.npz'), features=self.reservoir[0], labels=self.reservoir[1])
+
+        schema = {
+            'version': MODEL_VERSION,
+            'feature_names': self.feature_names,
+            'labels': [int(label) for label in self.labels],
+            'num_traces': self.num_traces,
+        }
+
+        # the schema is written last, so a model with a schema is complete
+        with open(os.path.join(path, 'model.json'), 'w') as f:
+            json.dump(schema, f, indent=2)
 
-    for train_index, test_index in kf.split(features, labels):
-        X_train, X_test = features[train_index], features[test_index]
-        y_train, y_test = labels[train_index], labels[test_index]
-        predictions, metrics = classify(X_train, y_train, X_test, y_test)
-        # TODO do sth with metrics
-        accuracy = find_percentage_agreement(predictions.tolist(), y_test.tolist())
-        print(accuracy)
-        accuracies.append(accuracy)
+    @classmethod
+    def load(cls, path, n_jobs=None):
+        """Read a model written by save
 
-    print(f'Mean accuracy: {statistics.mean(accuracies)}')
+        Args:
+            path (str): the model directory
+            n_jobs (int): number of cores used for predictions (None: all)
+        """
 
-    ###############################################
-    # TODO: Write code to evaluate the performance of your classifier
-    ###############################################
+        with open(os.path.join(path, 'model.json')) as f:
+            schema = json.load(f)
 
+        if schema.get('version') != MODEL_VERSION:
+            raise ValueError(f'Unsupported model version {schema.get("version")} in {path}')
 
-def load_data():
+        classifier = joblib.load(os.path.join(path, 'model.joblib'))
+
+        if [int(label) for label in classifier.classes_] != schema['labels']:
+            raise ValueError(f'Model in {path} does not match its label map')
+
+        classifier.n_jobs = cpu_budget(n_jobs)
+
+        reservoir = None
+
+        # models saved without a reservoir start with an empty one
+        if os.path.exists(os.path.join(path, 'reservoir.npz')):
+
+            with np.load(os.path.join(path, 'reservoir.npz')) as arrays:
+                reservoir = (arrays['features'], arrays['labels'])
+
+        return cls(classifier, schema['feature_names'], schema.get('num_traces', 0), reservoir)
+
+    def select(self, features, feature_names):
+        """The columns of features (named feature_names) that the model expects, in its order"""
+
+        return select_features(features, feature_names, self.feature_names)
+
+    def predict(self, features, batch_size=4096):
+        """Predict the cells of traces, batch_size traces at a time
+
+        Args:
+            features (numpy array): one row per trace, columns in the order of feature_names
+        Returns:
+            numpy array: the predicted cell of every trace
+        """
+
+        features = np.asarray(features, dtype=np.float32)
+
+        if not len(features):
+            return np.empty(0, dtype=self.labels.dtype)
+
+        return np.concatenate([self.classifier.predict(features[start:start + batch_size])
+                               for start in range(0, len(features), batch_size)])
+
+    def record_features(self, records):
+        """Feature matrix (in the order of feature_names) of records as written by experiment.py"""
+
+        records = [derive_features(dict(record)) for record in records]
+
+        add_kfp_features(records)
+
+        return np.array([[float(record[name]) for name in self.feature_names] for record in records],
+                        dtype=np.float32).reshape(len(records), len(self.feature_names))
+
+    def predict_records(self, records, batch_size=4096):
+        """Predict the cells of records as written by experiment.py (e.g. of live captures)"""
+
+        return self.predict(self.record_features(records), batch_size)
+
+
+class OpenWorldClassifier:
+
+    'Class for open-world classification as in k-fingerprinting: k-NN on the leaf vectors of a random forest'
+
+    def __init__(self, k=3, n_jobs=None, **params):
+        """
+        Args:
+            k (int): number of neighbours that vote
+            n_jobs (int): number of cores used by the forest (None: all)
+            params: further parameters of the RandomForestClassifier
+        """
+
+        self.k = k
+
+        self.forest = RandomForestClassifier(n_jobs=cpu_budget(n_jobs), **params)
+
+        self.index = None
+
+        self.labels = None
+
+    def fit(self, features, labels):
+        """Train the forest on monitored and unmonitored (label UNMONITORED) traces and index their leaf vectors"""
+
+        self.forest.fit(features, labels)
+
+        self.index = HammingIndex(self.forest.apply(features))
+
+        self.labels = np.asarray(labels)
+
+        return self
+
+    def vote(self, features):
+        """Majority label of the k nearest reference traces, and the fraction of them that agree
+
+        Returns:
+            (labels, confidences), one per trace
+        """
+
+        neighbours, _ = self.index.query(self.forest.apply(features), self.k)
+
+        neighbour_labels = self.labels[neighbours]
+
+        # votes[i, j]: number of neighbours of trace i with the label of neighbour j
+        votes = (neighbour_labels[:, :, None] == neighbour_labels[:, None, :]).sum(axis=2)
+
+        best = votes.argmax(axis=1)
+
+        rows = np.arange(len(neighbours))
+
+        return neighbour_labels[rows, best], votes[rows, best] / neighbours.shape[1]
+
+    def predict(self, features, threshold=1.0):
+        """Cell of every trace, UNMONITORED unless at least threshold of the neighbours agree on a cell
+
+        threshold=1.0 (all k neighbours agree) is the rule of k-fingerprinting.
+        """
+
+        labels, confidences = self.vote(features)
+
+        return np.where((confidences >= threshold) & (labels != UNMONITORED), labels, UNMONITORED)
+
+
+def evaluate_open_world(features, labels, unmonitored, folds=10, k=3, n_jobs=None):
+    """Cross-validate open-world classification
+
+    The monitored traces (the grid cells) and the unmonitored traces are split
+    into folds separately; every fold trains on both. A monitored trace counts
+    as a true positive if it is classified as its cell, an unmonitored trace as
+    a false positive if it is classified as any cell.
+
+    Args:
+        features (numpy array): the monitored traces
+        labels (numpy array): the cell of each monitored trace
+        unmonitored (numpy array): the unmonitored traces (same features)
+        folds (int): number of folds
+        k (int): number of neighbours that vote
+        n_jobs (int): number of cores used by the forests (default: all)
+    Returns:
+        dict: confidence threshold -> (true positive rate, false positive rate)
+    """
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+    unmonitored = np.asarray(unmonitored)
+
+    thresholds = np.arange(1, k + 1) / k
+
+    true_positives = np.zeros(len(thresholds))
+    false_positives = np.zeros(len(thresholds))
+
+    monitored_splits = StratifiedKFold(n_splits=folds).split(features, labels)
+    unmonitored_splits = KFold(n_splits=folds, shuffle=True, random_state=0).split(unmonitored)
+
+    for (train, test), (unmonitored_train, unmonitored_test) in zip(monitored_splits, unmonitored_splits):
+
+        classifier = OpenWorldClassifier(k, n_jobs).fit(
+            np.concatenate([features[train], unmonitored[unmonitored_train]]),
+            np.concatenate([labels[train], np.full(len(unmonitored_train), UNMONITORED, dtype=labels.dtype)]))
+
+        # the neighbours are looked up once for all thresholds
+        votes, confidences = classifier.vote(np.concatenate([features[test], unmonitored[unmonitored_test]]))
+
+        monitored = np.arange(len(votes)) < len(test)
+
+        for i, threshold in enumerate(thresholds):
+
+            predictions = np.where((confidences >= threshold) & (votes != UNMONITORED), votes, UNMONITORED)
+
+            true_positives[i] += np.sum(predictions[monitored] == labels[test])
+            false_positives[i] += np.sum(predictions[~monitored] != UNMONITORED)
+
+    return {threshold: (tp / len(labels), fp / len(unmonitored))
+            for threshold, tp, fp in zip(thresholds, true_positives, false_positives)}
+
+
+def select_features(features, feature_names, wanted):
+    """The columns of features (named feature_names) named wanted, in that order"""
+
+    if list(feature_names) == list(wanted):
+        return features
+
+    missing = set(wanted) - set(feature_names)
+
+    if missing:
+        raise ValueError(f'Features missing: {sorted(missing)}')
+
+    columns = [list(feature_names).index(name) for name in wanted]
+
+    return features[:, columns]
+
+
+def feature_groups(feature_names):
+    """Groups of features for the ablation: per direction, per statistic and the k-fingerprinting features
+
+    Returns:
+        dict: group name -> feature names (groups without any of the features are left out)
+    """
+
+    groups = {}
+
+    for direction in DIRECTIONS:
+        groups[direction] = [name for name in feature_names if name.startswith(f'{direction}_')]
+
+    for statistic in STATISTICS:
+        groups[statistic] = [name for name in feature_names if name.endswith(f'_{statistic}')]
+
+    groups['kfp'] = [name for name in feature_names if name in KFP_FEATURE_NAMES]
+
+    return {group: names for group, names in groups.items() if names}
+
+
+def extraction_costs(records):
+    """Seconds per trace to compute the statistics-based and the k-fingerprinting features of records
+
+    Both are timed on the packet sequences of the records (experiment.py
+    --sequences): the statistics by accumulating every packet as during a
+    capture (pcap.TraceAccumulator) and deriving the features from them. Reading
+    the packets from the capture costs the same for both and is not included.
+    Without packet sequences, nothing is measured (an empty dict).
+    """
+
+    with_sequences = [record for record in records if 'timestamps' in record]
+
+    if not with_sequences:
+        return {}
+
+    start = time.perf_counter()
+    for record in with_sequences:
+        accumulator = TraceAccumulator()
+        for timestamp, size, direction in zip(record['timestamps'], record['sizes'], record['directions']):
+            accumulator.add(timestamp, size, direction == OUTGOING)
+        statistics = accumulator.statistics()
+        derive_features({f'{direction}_{key}': value
+                         for direction in DIRECTIONS for key, value in statistics[direction].items()})
+    costs = {'statistics': (time.perf_counter() - start) / len(with_sequences)}
+
+    start = time.perf_counter()
+    extract_batch(PacketSequences.from_records(with_sequences))
+    costs['kfp'] = (time.perf_counter() - start) / len(with_sequences)
+
+    return costs
+
+
+def ablation(features, labels, feature_names, folds=5, n_jobs=None, extraction=None):
+    """Cross-validate the classifier on subsets of the features
+
+    For every group of feature_groups, the classifier is trained on the group
+    only and on all features but the group. All (subset, fold) pairs run in
+    parallel, on the same fold splits.
+
+    Args:
+        features (numpy array): one row per trace
+        labels (numpy array): the cell of each trace
+        feature_names (list): names of the feature columns
+        folds (int): number of cross-validation folds
+        n_jobs (int): CPU budget (default: all cores)
+        extraction (dict): seconds per trace of the 'statistics' and 'kfp'
+            features (see extraction_costs), if known
+    Returns:
+        list: one dict per subset (subset, num_features, accuracy, predict_seconds,
+            extraction_seconds), the most accurate first
+    """
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+    all_labels = np.unique(labels)
+    feature_names = list(feature_names)
+
+    subsets = {'all': feature_names}
+
+    for group, names in feature_groups(feature_names).items():
+
+        subsets[f'only {group}'] = names
+
+        rest = [name for name in feature_names if name not in names]
+
+        if rest:
+            subsets[f'without {group}'] = rest
+
+    splits = list(StratifiedKFold(n_splits=folds).split(features, labels))
+
+    jobs = [(subset, fold) for subset in subsets for fold in range(folds)]
+
+    timings = Parallel(n_jobs=cpu_budget(n_jobs))(
+        delayed(time_candidate)(features, labels, *splits[fold], all_labels, {},
+                                [feature_names.index(name) for name in subsets[subset]])
+        for subset, fold in jobs)
+
+    results = []
+
+    for subset, names in subsets.items():
+
+        runs = [timing for (name, _), timing in zip(jobs, timings) if name == subset]
+
+        result = {
+            'subset': subset,
+            'num_features': len(names),
+            'accuracy': accuracy(np.sum([matrix for matrix, _, _ in runs], axis=0)),
+            'predict_seconds': statistics.mean(predict for _, _, predict in runs),
+            'extraction_seconds': None,
+        }
+
+        if extraction is not None:
+
+            kinds = {'kfp' if name in KFP_FEATURE_NAMES else 'statistics' for name in names}
+
+            if kinds <= set(extraction):
+                result['extraction_seconds'] = sum(extraction[kind] for kind in kinds)
+
+        results.append(result)
+
+    return sorted(results, key=lambda result: -result['accuracy'])
+
+
+def benchmark_prediction(model, features, batch_sizes=(1, 64, 4096), duration=2.0):
+    """Measure the prediction throughput of a model
+
+    Every batch size is run repeatedly for about duration seconds.
+
+    Returns:
+        dict: batch size -> traces per second
+    """
+
+    throughput = {}
+
+    for batch_size in batch_sizes:
+
+        batch = np.ascontiguousarray(features[:batch_size], dtype=np.float32)
+
+        # warm up (thread pools, caches)
+        model.predict(batch, batch_size)
+
+        traces = 0
+
+        start = time.perf_counter()
+
+        while time.perf_counter() - start < duration:
+
+            model.predict(batch, batch_size)
+
+            traces += len(batch)
+
+        throughput[batch_size] = traces / (time.perf_counter() - start)
+
+    return throughput
+
+
+def load_data(path='./dataset', mmap=True):
     """Function to load data that will be used for classification.
 
     Args:
-        You can provide the args you want.
+        path (str): dataset directory, as written by dataset.py
+            (e.g. `python3 dataset.py results.jsonl -o dataset`), or a
+            pickled DataFrame as written by data_prep.ipynb (.pkl)
+        mmap (bool): memory-map the dataset instead of reading it into memory
     Returns:
-        features (list): the list of features you extract from every trace
-        labels (list): the list of identifiers for each trace
+        features (numpy array): the features extracted from every trace
+            (contiguous float32, the dtype the forest works with, so it is never copied)
+        labels (numpy array): the identifier of each trace (int32)
 
     An example: Assume you have traces (trace1...traceN) for cells with IDs in the
     range 1-N.  
@@ -120,18 +829,19 @@ def load_data():
     feature extraction on your own.
     """
 
-    ###############################################
-    # TODO: Complete this function.
-    ###############################################
+    if path.endswith('.pkl'):
+
+        import pandas as pd
 
-    df = pd.read_pickle('./data_2604.pkl')
+        df = pd.read_pickle(path)
 
-    labels_only_df = df['cell']
+        # straight from the DataFrame's columns into one contiguous array, no Python lists in between
+        features = np.ascontiguousarray(df[FEATURE_NAMES].to_numpy(dtype=FEATURES_DTYPE))
+        labels = df[LABEL].to_numpy(dtype=LABELS_DTYPE)
 
-    features_only_df = df.drop('cell', axis = 1)
+        return features, labels
 
-    features = features_only_df.values.tolist()
-    labels = labels_only_df.values.tolist()
+    features, labels, feature_names = load_dataset(path, mmap)
 
     return features, labels
 
@@ -145,8 +855,162 @@ def main():
     Read about random forests: https://towardsdatascience.com/understanding-random-forest-58381e0602d2
     """
 
-    features, labels = load_data()
-    perform_crossval(features, labels, folds=10)
+    parser = argparse.ArgumentParser(description="Cell fingerprinting with a random forest.")
+    parser.add_argument(
+        "command",
+        help="crossval: evaluate with cross-validation; train: fit on the whole dataset and save the model; "
+             "update: add trees trained on the traces of --records (or the dataset) to a saved model; "
+             "predict: classify the traces of --records (or the dataset) with a saved model; "
+             "benchmark: measure the prediction throughput of a saved model; "
+             "search: find the fastest forest parameters that reach --target accuracy; "
+             "openworld: evaluate open-world classification against the --unmonitored traces; "
+             "ablation: cross-validate with subsets of the features (extraction costs are timed on the packet sequences of --records if given).",
+        nargs="?",
+        default="crossval",
+        choices=["crossval", "train", "update", "predict", "benchmark", "search", "openworld", "ablation"]
+    )
+    parser.add_argument(
+        "--dataset",
+        help="Dataset directory (see dataset.py).",
+        default="./dataset",
+        type=str
+    )
+    parser.add_argument(
+        "--folds",
+        help="Number of cross-validation folds.",
+        default=10,
+        type=int
+    )
+    parser.add_argument(
+        "-j",
+        "--n-jobs",
+        help="Number of cores to use (default: all).",
+        type=int
+    )
+    parser.add_argument(
+        "--model",
+        help="Model directory to write (train) or read (predict, benchmark).",
+        default="./model",
+        type=str
+    )
+    parser.add_argument(
+        "--records",
+        help="Results file with the traces to classify (predict), to train on (update) or to time the feature "
+             "extraction on (ablation), e.g. from experiment.py.",
+        type=str
+    )
+    parser.add_argument(
+        "--trees",
+        help="Number of trees to add (update).",
+        default=20,
+        type=int
+    )
+    parser.add_argument(
+        "--max-trees",
+        help="Drop the oldest trees beyond this number (update).",
+        type=int
+    )
+    parser.add_argument(
+        "--unmonitored",
+        help="Dataset directory with traces of unmonitored queries (openworld).",
+        type=str
+    )
+    parser.add_argument(
+        "-k",
+        help="Number of neighbours that vote (openworld).",
+        default=3,
+        type=int
+    )
+    parser.add_argument(
+        "--target",
+        help="Accuracy the search has to reach.",
+        default=0.9,
+        type=float
+    )
+    parser.add_argument(
+        "--halving",
+        help="Search with successive halving instead of evaluating every candidate on all folds.",
+        action="store_true"
+    )
+    args = parser.parse_args()
+
+    if args.command == "crossval":
+        features, labels = load_data(args.dataset)
+        perform_crossval(features, labels, folds=args.folds, n_jobs=args.n_jobs)
+
+    elif args.command == "train":
+        features, labels, feature_names = load_dataset(args.dataset)
+        FingerprintingModel.train(features, labels, feature_names, args.n_jobs).save(args.model)
+        print(f'Trained on {len(labels)} traces, model written to {args.model}')
+
+    elif args.command == "update":
+        model = FingerprintingModel.load(args.model, args.n_jobs)
+
+        if args.records:
+            records = read_records(args.records)
+            features = model.record_features(records)
+            labels = np.array([int(record['cell']) for record in records])
+
+        else:
+            features, labels, feature_names = load_dataset(args.dataset)
+            features = model.select(features, feature_names)
+
+        model.update(features, labels, args.trees, args.max_trees)
+        model.save(args.model)
+        print(f'Added {args.trees} trees trained on {len(labels)} new traces '
+              f'({model.num_traces} in total), model written to {args.model}')
+
+    elif args.command == "predict":
+        model = FingerprintingModel.load(args.model, args.n_jobs)
+
+        if args.records:
+            records = read_records(args.records)
+            for record, prediction in zip(records, model.predict_records(records)):
+                print(f'cell {record.get("cell")}, run {record.get("run")}: predicted {prediction}')
+
+        else:
+            features, labels, feature_names = load_dataset(args.dataset)
+            predictions = model.predict(model.select(features, feature_names))
+            print(f'Accuracy: {np.mean(predictions == labels)}')
+
+    elif args.command == "openworld":
+        if not args.unmonitored:
+            parser.error("openworld requires --unmonitored")
+        features, labels, feature_names = load_dataset(args.dataset)
+        unmonitored, _, unmonitored_names = load_dataset(args.unmonitored)
+        unmonitored = select_features(unmonitored, unmonitored_names, feature_names)
+        rates = evaluate_open_world(features, labels, unmonitored, args.folds, args.k, args.n_jobs)
+        for threshold, (tpr, fpr) in rates.items():
+            print(f'{threshold:.2f} of {args.k} neighbours agree: TPR {tpr:.3f}, FPR {fpr:.3f}')
+
+    elif args.command == "ablation":
+        features, labels, feature_names = load_dataset(args.dataset)
+        extraction = extraction_costs(read_records(args.records)) if args.records else None
+        for result in ablation(features, labels, feature_names, args.folds, args.n_jobs, extraction):
+            extraction_cost = result['extraction_seconds']
+            extraction_cost = 'n/a' if extraction_cost is None else f'{1e6 * extraction_cost:.1f} us/trace'
+            print(f'{result["subset"]} ({result["num_features"]} features): accuracy {result["accuracy"]:.3f}, '
+                  f'predict {1e6 * result["predict_seconds"]:.1f} us/trace, extraction {extraction_cost}')
+
+    elif args.command == "search":
+        features, labels = load_data(args.dataset)
+        results = search_parameters(features, labels, args.target, folds=args.folds,
+                                    halving=args.halving, n_jobs=args.n_jobs)
+        for result in results:
+            print(f'{result["params"]}: accuracy {result["accuracy"]:.3f} on {result["folds"]} folds, '
+                  f'fit {result["fit_seconds"]:.2f} s, predict {1e6 * result["predict_seconds"]:.1f} us/trace')
+        reached = [result for result in results if result['accuracy'] >= args.target]
+        if reached:
+            print(f'Fastest candidate reaching {args.target}: {reached[0]["params"]}')
+        else:
+            print(f'No candidate reaches {args.target}')
+
+    else:
+        model = FingerprintingModel.load(args.model, args.n_jobs)
+        features, labels, feature_names = load_dataset(args.dataset)
+        features = model.select(features, feature_names)
+        for batch_size, throughput in benchmark_prediction(model, features).items():
+            print(f'batch size {batch_size}: {throughput:.0f} traces/s')
 
 
 if __name__ == "__main__":
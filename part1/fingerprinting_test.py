@@ -0,0 +1,463 @@
+import pytest
+
+import json
+
+import os
+
+import numpy as np
+
+from joblib import parallel_backend
+from sklearn.ensemble import RandomForestClassifier
+
+from dataset import FEATURE_NAMES, LABEL, STATISTICS, write_dataset
+from features import KFP_FEATURE_NAMES
+from fingerprinting import (MODEL_VERSION, UNMONITORED, FingerprintingModel, OpenWorldClassifier,
+                            ablation, benchmark_prediction, cpu_budget, evaluate_open_world, extraction_costs, feature_groups,
+                            load_data, perform_crossval, rank, search_parameters, select_features, split_budget)
+
+""" Test the classifier, model persistence and evaluations in fingerprinting.py """
+
+
+def clusters(cells, per_cell=30, dimension=5, seed=0, first_cell=1):
+    """ Well separated traces: every cell is a tight cluster around its own center """
+
+    rng = np.random.default_rng(seed)
+
+    centers = rng.normal(0, 10, size=(cells, dimension))
+
+    labels = np.repeat(np.arange(first_cell, first_cell + cells), per_cell).astype(np.int32)
+
+    features = centers[labels - first_cell] + rng.normal(0, 0.5, size=(len(labels), dimension))
+
+    return features.astype(np.float32), labels
+
+
+def train(features, labels, trees=10):
+
+    names = [f'f{i}' for i in range(features.shape[1])]
+
+    return FingerprintingModel.train(features, labels, names, n_jobs=1, n_estimators=trees, random_state=0)
+
+
+def test_cpu_budget(monkeypatch) -> None:
+
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+
+    assert cpu_budget() == 8
+    assert cpu_budget(-1) == 8
+    assert cpu_budget(3) == 3
+    assert cpu_budget(100) == 8
+    assert cpu_budget(0) == 1
+
+    # every fold gets a core first, the forests share what is left
+    assert split_budget(None, 10) == (8, 1)
+    assert split_budget(None, 3) == (3, 2)
+    assert split_budget(None, 1) == (1, 8)
+    assert split_budget(1, 10) == (1, 1)
+
+    monkeypatch.setattr(os, 'cpu_count', lambda: None)
+
+    assert cpu_budget() == 1
+    assert split_budget(None, 10) == (1, 1)
+
+
+def test_perform_crossval(monkeypatch) -> None:
+
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+
+    jobs = []
+
+    class RecordingForest(RandomForestClassifier):
+
+        def fit(self, X, y, sample_weight=None):
+
+            jobs.append(self.n_jobs)
+
+            return super().fit(X, y, sample_weight)
+
+    monkeypatch.setattr('fingerprinting.RandomForestClassifier', RecordingForest)
+
+    features, labels = clusters(3, per_cell=12)
+
+    # threads instead of processes, so that the folds see the recording forest
+    with parallel_backend('threading'):
+        pooled = perform_crossval(features, labels, folds=2)
+
+    # both folds at once, the 4 cores split between their forests
+    assert jobs == [2, 2]
+
+    # every trace is tested exactly once, and the clusters are told apart
+    assert pooled.shape == (3, 3)
+    assert pooled.sum(axis=1).tolist() == [12, 12, 12]
+    assert np.array_equal(pooled, np.diag([12, 12, 12]))
+
+    sequential = perform_crossval(features, labels, folds=3, n_jobs=1)
+
+    assert jobs[2:] == [1, 1, 1]
+    assert np.array_equal(sequential, pooled)
+
+
+def test_model_roundtrip(tmp_path) -> None:
+
+    features, labels = clusters(4)
+
+    model = train(features, labels)
+
+    path = str(tmp_path / 'model')
+
+    model.save(path)
+
+    with open(os.path.join(path, 'model.json')) as f:
+        schema = json.load(f)
+
+    assert schema['version'] == MODEL_VERSION
+    assert schema['labels'] == [1, 2, 3, 4]
+    assert schema['num_traces'] == len(labels)
+
+    loaded = FingerprintingModel.load(path, n_jobs=1)
+
+    assert loaded.feature_names == model.feature_names
+    assert loaded.num_traces == len(labels)
+    assert loaded.labels.tolist() == [1, 2, 3, 4]
+    assert np.array_equal(loaded.predict(features, batch_size=7), model.predict(features))
+    assert np.array_equal(loaded.reservoir[1], model.reservoir[1])
+
+    assert len(loaded.predict(features[:0])) == 0
+
+    # a model that does not match its schema is refused
+    with open(os.path.join(path, 'model.json'), 'w') as f:
+        json.dump(dict(schema, labels=[1, 2, 3, 5]), f)
+
+    with pytest.raises(ValueError, match='label map'):
+        FingerprintingModel.load(path)
+
+    with open(os.path.join(path, 'model.json'), 'w') as f:
+        json.dump(dict(schema, version=MODEL_VERSION + 1), f)
+
+    with pytest.raises(ValueError, match='version'):
+        FingerprintingModel.load(path)
+
+
+def test_batched_prediction(monkeypatch) -> None:
+
+    features, labels = clusters(4)
+
+    model = train(features, labels)
+
+    expected = model.classifier.predict(features)
+
+    for batch_size in (1, 7, len(features), 10 * len(features)):
+        assert np.array_equal(model.predict(features, batch_size), expected)
+
+    # other dtypes are converted to the float32 the forest works with
+    assert np.array_equal(model.predict(features.astype(np.float64)), expected)
+
+    assert model.predict(features[:0]).dtype == model.labels.dtype
+
+    batches = []
+
+    predict = model.classifier.predict
+
+    monkeypatch.setattr(model.classifier, 'predict', lambda batch: batches.append(len(batch)) or predict(batch))
+
+    model.predict(features, batch_size=50)
+
+    assert batches == [50, 50, 20]
+
+
+def test_benchmark_prediction() -> None:
+
+    features, labels = clusters(4)
+
+    model = train(features, labels)
+
+    throughput = benchmark_prediction(model, features, batch_sizes=(1, 16), duration=0.05)
+
+    assert list(throughput) == [1, 16]
+    assert all(traces_per_second > 0 for traces_per_second in throughput.values())
+
+
+def test_update_adds_trees() -> None:
+
+    features, labels = clusters(4)
+
+    model = train(features, labels)
+
+    new_features, new_labels = clusters(4, per_cell=5, seed=1)
+
+    # warm start: the old trees are kept
+    old_trees = list(model.classifier.estimators_)
+
+    model.update(new_features, new_labels, trees=5)
+
+    assert len(model.classifier.estimators_) == 15
+    assert model.classifier.estimators_[:10] == old_trees
+    assert model.num_traces == len(labels) + len(new_labels)
+
+    # new traces of some cells only: every tree still knows all cells
+    only_cell_2 = new_labels == 2
+
+    model.update(new_features[only_cell_2], new_labels[only_cell_2], trees=5)
+
+    assert model.labels.tolist() == [1, 2, 3, 4]
+    assert model.classifier.predict_proba(features).shape == (len(features), 4)
+
+    with pytest.raises(ValueError, match='unknown'):
+        model.update(new_features[:2], np.array([1, 99]))
+
+
+def test_update_keeps_other_cells() -> None:
+
+    features, labels = clusters(8, per_cell=40)
+
+    # of every cell: 20 traces to train on, 10 for the update and 10 to test on
+    position = np.arange(len(labels)) % 40
+
+    train_rows, update_rows, test_rows = position < 20, (position >= 20) & (position < 30), position >= 30
+
+    model = train(features[train_rows], labels[train_rows])
+
+    # many new trees, trained on a batch of two cells only
+    batch = update_rows & (labels <= 2)
+
+    model.update(features[batch], labels[batch], trees=90)
+
+    others = test_rows & (labels > 2)
+
+    assert np.mean(model.predict(features[others]) == labels[others]) > 0.9
+
+    assert model.num_traces == np.sum(train_rows) + np.sum(batch)
+
+
+def test_reservoir_is_bounded() -> None:
+
+    model = FingerprintingModel(None, ['a'], reservoir_size=10)
+
+    model.remember(np.arange(100).reshape(100, 1), np.arange(100), np.random.default_rng(0))
+
+    features, labels = model.reservoir
+
+    assert model.num_traces == 100
+    assert len(labels) == 10
+    assert len(set(labels.tolist())) == 10
+    assert features[:, 0].tolist() == labels.tolist()
+
+    # the first traces stay only with probability 10 / 100 each
+    assert labels.tolist() != list(range(10))
+
+
+def test_update_max_trees() -> None:
+
+    features, labels = clusters(4)
+
+    model = train(features, labels)
+
+    old_trees = list(model.classifier.estimators_)
+
+    model.update(features, labels, trees=10, max_trees=12)
+
+    # the oldest trees are dropped
+    assert len(model.classifier.estimators_) == 12
+    assert model.classifier.n_estimators == 12
+    assert model.classifier.estimators_[:2] == old_trees[-2:]
+
+    # ... and updating keeps working after that
+    model.update(features, labels, trees=3)
+
+    assert len(model.classifier.estimators_) == 15
+
+
+def test_rank() -> None:
+
+    fast = {'accuracy': 0.91, 'predict_seconds': 1.0, 'fit_seconds': 5.0}
+    slow = {'accuracy': 0.99, 'predict_seconds': 2.0, 'fit_seconds': 1.0}
+    close = {'accuracy': 0.89, 'predict_seconds': 0.1, 'fit_seconds': 0.1}
+    poor = {'accuracy': 0.5, 'predict_seconds': 0.1, 'fit_seconds': 0.1}
+
+    # candidates reaching the target by speed, then the others by accuracy
+    assert sorted([poor, slow, close, fast], key=lambda result: rank(result, 0.9)) == [fast, slow, close, poor]
+
+
+def test_search_parameters_halving() -> None:
+
+    features, labels = clusters(3, per_cell=12)
+
+    grid = {'n_estimators': [2, 4], 'max_depth': [1, None]}
+
+    results = search_parameters(features, labels, target=2.0, grid=grid, folds=3,
+                                halving=True, eta=2, n_jobs=1)
+
+    # 4 candidates on 1 fold, the best 2 on 2 folds, the best one on all 3
+    assert len(results) == 4
+    assert [result['folds'] for result in results] == [3, 2, 1, 1]
+
+    # the candidates evaluated on more folds are the ones that ranked best on fewer
+    assert results[0]['params'] != results[1]['params']
+    assert {json.dumps(result['params'], sort_keys=True) for result in results} == {
+        json.dumps(params, sort_keys=True) for params in
+        [{'max_depth': 1, 'n_estimators': 2}, {'max_depth': 1, 'n_estimators': 4},
+         {'max_depth': None, 'n_estimators': 2}, {'max_depth': None, 'n_estimators': 4}]}
+
+    full = search_parameters(features, labels, target=2.0, grid=grid, folds=3, n_jobs=1)
+
+    assert [result['folds'] for result in full] == [3] * 4
+    assert [result['accuracy'] for result in full] == sorted((result['accuracy'] for result in full), reverse=True)
+
+
+def test_open_world_thresholds(monkeypatch) -> None:
+
+    classifier = OpenWorldClassifier(k=3)
+
+    monkeypatch.setattr(classifier, 'vote', lambda features: (
+        np.array([1, 2, UNMONITORED, 4]), np.array([1.0, 2 / 3, 1.0, 1 / 3])))
+
+    features = np.zeros((4, 2))
+
+    assert classifier.predict(features).tolist() == [1, UNMONITORED, UNMONITORED, UNMONITORED]
+    assert classifier.predict(features, threshold=0.5).tolist() == [1, 2, UNMONITORED, UNMONITORED]
+    assert classifier.predict(features, threshold=0.0).tolist() == [1, 2, UNMONITORED, 4]
+
+
+def test_evaluate_open_world() -> None:
+
+    features, labels = clusters(3)
+
+    # unmonitored queries in clusters of their own
+    unmonitored, _ = clusters(5, per_cell=12, seed=1)
+
+    rates = evaluate_open_world(features, labels, unmonitored, folds=3, k=3, n_jobs=1)
+
+    thresholds = sorted(rates)
+
+    assert thresholds == pytest.approx([1 / 3, 2 / 3, 1])
+
+    true_positive_rates = [rates[threshold][0] for threshold in thresholds]
+    false_positive_rates = [rates[threshold][1] for threshold in thresholds]
+
+    # requiring more neighbours to agree never adds positives
+    assert true_positive_rates == sorted(true_positive_rates, reverse=True)
+    assert false_positive_rates == sorted(false_positive_rates, reverse=True)
+
+    assert true_positive_rates[-1] > 0.8
+    assert false_positive_rates[-1] < 0.2
+
+
+def test_select_features() -> None:
+
+    features = np.arange(12).reshape(4, 3)
+
+    assert select_features(features, ['a', 'b', 'c'], ['a', 'b', 'c']) is features
+
+    assert select_features(features, ['a', 'b', 'c'], ['c', 'a']).tolist() == features[:, [2, 0]].tolist()
+
+    with pytest.raises(ValueError, match='d'):
+        select_features(features, ['a', 'b', 'c'], ['a', 'd'])
+
+
+def test_feature_groups() -> None:
+
+    groups = feature_groups(FEATURE_NAMES)
+
+    assert groups['overall'] == [f'overall_{statistic}' for statistic in STATISTICS]
+    assert groups['outgoing'] == [f'outgoing_{statistic}' for statistic in STATISTICS] + ['outgoing_packets_fraction']
+    assert groups['number_of_packets'] == ['overall_number_of_packets', 'incoming_number_of_packets',
+                                           'outgoing_number_of_packets']
+
+    # groups without features are left out
+    assert 'kfp' not in groups
+
+    assert feature_groups(FEATURE_NAMES + KFP_FEATURE_NAMES)['kfp'] == KFP_FEATURE_NAMES
+
+
+def test_ablation() -> None:
+
+    feature_names = ['overall_number_of_packets', 'incoming_number_of_packets'] + KFP_FEATURE_NAMES[:2]
+
+    features, labels = clusters(3, per_cell=10, dimension=len(feature_names))
+
+    results = ablation(features, labels, feature_names, folds=2, n_jobs=1,
+                       extraction={'statistics': 1.0, 'kfp': 2.0})
+
+    subsets = {result['subset']: result for result in results}
+
+    assert set(subsets) == {'all', 'only overall', 'without overall', 'only incoming', 'without incoming',
+                            'only number_of_packets', 'without number_of_packets', 'only kfp', 'without kfp'}
+
+    assert subsets['all']['num_features'] == 4
+    assert subsets['without overall']['num_features'] == 3
+    assert subsets['only number_of_packets']['num_features'] == 2
+
+    # the extraction cost of a subset is the cost of the kinds of features it uses
+    assert subsets['all']['extraction_seconds'] == 3.0
+    assert subsets['only kfp']['extraction_seconds'] == 2.0
+    assert subsets['without kfp']['extraction_seconds'] == 1.0
+
+    assert [result['accuracy'] for result in results] == sorted((result['accuracy'] for result in results),
+                                                                reverse=True)
+
+
+def test_extraction_costs() -> None:
+
+    records = [{'cell': 1, 'overall_number_of_packets': 3}]
+
+    # the statistics are not measured without the packets they are accumulated from
+    assert extraction_costs(records) == {}
+
+    records.append({'cell': 2, 'timestamps': [0.0, 0.1, 0.3], 'sizes': [100, 1500, 60], 'directions': [1, -1, 1]})
+
+    costs = extraction_costs(records)
+
+    assert set(costs) == {'statistics', 'kfp'}
+    assert costs['statistics'] > 0
+    assert costs['kfp'] > 0
+
+
+def test_load_data(tmp_path) -> None:
+
+    rng = np.random.default_rng(0)
+
+    features = rng.normal(size=(6, len(FEATURE_NAMES)))
+
+    labels = np.array([1, 1, 2, 2, 3, 3], dtype=np.int64)
+
+    path = str(tmp_path / 'dataset')
+
+    write_dataset(path, features, labels)
+
+    for mmap in (True, False):
+
+        loaded_features, loaded_labels = load_data(path, mmap)
+
+        # memory-mapped straight from the files, in the layout the forest uses without copying
+        assert isinstance(loaded_features, np.memmap) == mmap
+        assert loaded_features.dtype == np.float32
+        assert loaded_features.flags['C_CONTIGUOUS']
+        assert loaded_labels.dtype == np.int32
+        assert np.array_equal(loaded_features, features.astype(np.float32))
+        assert loaded_labels.tolist() == labels.tolist()
+
+
+def test_load_data_from_dataframe(tmp_path) -> None:
+
+    pd = pytest.importorskip('pandas')
+
+    rng = np.random.default_rng(0)
+
+    features = rng.normal(size=(4, len(FEATURE_NAMES)))
+
+    # the columns in another order, plus a column that is not a feature
+    df = pd.DataFrame(features, columns=FEATURE_NAMES)[FEATURE_NAMES[::-1]]
+    df[LABEL] = [1, 2, 3, 4]
+    df['run'] = 0
+
+    path = str(tmp_path / 'dataset.pkl')
+
+    df.to_pickle(path)
+
+    loaded_features, loaded_labels = load_data(path)
+
+    assert loaded_features.dtype == np.float32
+    assert loaded_features.flags['C_CONTIGUOUS']
+    assert loaded_labels.dtype == np.int32
+    assert np.array_equal(loaded_features, features.astype(np.float32))
+    assert loaded_labels.tolist() == [1, 2, 3, 4]
@@ -0,0 +1,163 @@
+"""
+Spatial grid over the map of the PoIs.
+
+A `Grid` splits a latitude/longitude bounding box into rows x columns equally
+sized cells. Cells are numbered from 1, latitude first:
+
+    cell_id = 1 + row + rows * column
+
+so the default grid (10 x 10 cells over the PoI area) yields the cell ids
+1, ..., 100 of the `/poi-grid` queries. Converting a location to its cell is
+O(1), and `cell_ids` converts many locations at once with NumPy.
+
+For finer, hierarchical lookups, `quadkey` names the cells of a quadtree over
+the same bounding box: every level splits a cell into 4, so the key of a cell
+is a prefix of the keys of all cells inside it.
+"""
+
+from typing import List, Optional, Tuple
+
+# Returned by cell_ids for locations outside of the grid
+OUTSIDE = 0
+
+Bounds = Tuple[float, float, float, float]
+
+
+class Grid:
+
+    'Class for a regular grid of cells over a latitude/longitude bounding box'
+
+    def __init__(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float,
+                 rows: int = 10, columns: int = 10):
+        """
+        Args:
+            lat_min, lat_max, lon_min, lon_max: bounding box of the grid
+            rows: number of cells along the latitude
+            columns: number of cells along the longitude
+        """
+
+        if not (lat_min < lat_max and lon_min < lon_max and rows > 0 and columns > 0):
+            raise ValueError('Invalid grid')
+
+        self.lat_min: float = lat_min
+        self.lat_max: float = lat_max
+        self.lon_min: float = lon_min
+        self.lon_max: float = lon_max
+
+        self.rows: int = rows
+        self.columns: int = columns
+
+        self.lat_step: float = (lat_max - lat_min) / rows
+        self.lon_step: float = (lon_max - lon_min) / columns
+
+    @property
+    def num_cells(self) -> int:
+
+        return self.rows * self.columns
+
+    def contains(self, lat: float, lon: float) -> bool:
+
+        return self.lat_min <= lat <= self.lat_max and self.lon_min <= lon <= self.lon_max
+
+    def cell_id(self, lat: float, lon: float) -> Optional[int]:
+        """ The cell containing a location, None if it is outside of the grid """
+
+        if not self.contains(lat, lon):
+            return None
+
+        # the upper bounds belong to the last row/column
+        row = min(int((lat - self.lat_min) / self.lat_step), self.rows - 1)
+        column = min(int((lon - self.lon_min) / self.lon_step), self.columns - 1)
+
+        return 1 + row + self.rows * column
+
+    def cell_ids(self, lats, lons):
+        """ Cells of many locations at once (NumPy arrays), OUTSIDE for locations outside of the grid """
+
+        import numpy as np
+
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+
+        rows = np.minimum(((lats - self.lat_min) / self.lat_step).astype(np.int64), self.rows - 1)
+        columns = np.minimum(((lons - self.lon_min) / self.lon_step).astype(np.int64), self.columns - 1)
+
+        inside = (lats >= self.lat_min) & (lats <= self.lat_max) & (lons >= self.lon_min) & (lons <= self.lon_max)
+
+        return np.where(inside, 1 + rows + self.rows * columns, OUTSIDE)
+
+    def cell_bounds(self, cell_id: int) -> Bounds:
+        """ (lat_min, lat_max, lon_min, lon_max) of a cell """
+
+        if not 1 <= cell_id <= self.num_cells:
+            raise ValueError(f'No cell {cell_id} in a grid of {self.num_cells} cells')
+
+        column, row = divmod(cell_id - 1, self.rows)
+
+        lat = self.lat_min + row * self.lat_step
+        lon = self.lon_min + column * self.lon_step
+
+        return lat, lat + self.lat_step, lon, lon + self.lon_step
+
+    def center(self, cell_id: int) -> Tuple[float, float]:
+        """ (lat, lon) of the center of a cell, e.g. to query a cell by location """
+
+        lat_min, lat_max, lon_min, lon_max = self.cell_bounds(cell_id)
+
+        return (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+
+    def quadkey(self, lat: float, lon: float, level: int) -> Optional[str]:
+        """ Key of the quadtree cell of the given level (number of digits) containing a location
+
+        Digit d of the key says which quarter of the level d - 1 cell the location
+        is in: 0 and 1 are the lower latitudes, 0 and 2 the lower longitudes.
+        """
+
+        if not self.contains(lat, lon):
+            return None
+
+        # position in the bounding box, in [0, 1]
+        y = (lat - self.lat_min) / (self.lat_max - self.lat_min)
+        x = (lon - self.lon_min) / (self.lon_max - self.lon_min)
+
+        cells = 1 << level
+
+        row = min(int(y * cells), cells - 1)
+        column = min(int(x * cells), cells - 1)
+
+        digits: List[str] = []
+
+        for bit in reversed(range(level)):
+            digits.append(str(((row >> bit) & 1) * 2 + ((column >> bit) & 1)))
+
+        return ''.join(digits)
+
+    def quadkey_bounds(self, key: str) -> Bounds:
+        """ (lat_min, lat_max, lon_min, lon_max) of a quadtree cell """
+
+        lat_min, lat_max, lon_min, lon_max = self.lat_min, self.lat_max, self.lon_min, self.lon_max
+
+        for digit in key:
+
+            quarter = int(digit)
+
+            if not 0 <= quarter <= 3:
+                raise ValueError(f'Invalid quadkey {key}')
+
+            lat_mid, lon_mid = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+
+            if quarter & 2:
+                lat_min = lat_mid
+            else:
+                lat_max = lat_mid
+
+            if quarter & 1:
+                lon_min = lon_mid
+            else:
+                lon_max = lon_mid
+
+        return lat_min, lat_max, lon_min, lon_max
+
+
+# PoIs are within coordinates (46.5, 6.55) and (46.57, 6.65), mapped to a 10 x 10 grid
+DEFAULT_GRID = Grid(46.5, 46.57, 6.55, 6.65, 10, 10)
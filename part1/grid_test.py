@@ -0,0 +1,67 @@
+import pytest
+
+from grid import DEFAULT_GRID, OUTSIDE, Grid
+
+""" Test the spatial grid in grid.py """
+
+
+def test_cell_ids_of_default_grid() -> None:
+
+    assert DEFAULT_GRID.num_cells == 100
+
+    # corners
+    assert DEFAULT_GRID.cell_id(46.5, 6.55) == 1
+    assert DEFAULT_GRID.cell_id(46.57, 6.55) == 10
+    assert DEFAULT_GRID.cell_id(46.5, 6.65) == 91
+    assert DEFAULT_GRID.cell_id(46.57, 6.65) == 100
+
+    assert DEFAULT_GRID.cell_id(46.52345, 6.57890) == 4 + 10 * 2
+    assert DEFAULT_GRID.cell_id(46.49, 6.6) is None
+
+
+def test_cells_round_trip() -> None:
+
+    grid = Grid(-10.0, 10.0, 100.0, 140.0, rows=7, columns=13)
+
+    for cell_id in range(1, grid.num_cells + 1):
+
+        lat_min, lat_max, lon_min, lon_max = grid.cell_bounds(cell_id)
+
+        assert lat_min < lat_max and lon_min < lon_max
+        assert grid.cell_id(*grid.center(cell_id)) == cell_id
+
+    with pytest.raises(ValueError):
+        grid.cell_bounds(grid.num_cells + 1)
+
+
+def test_batch_conversion() -> None:
+
+    np = pytest.importorskip('numpy')
+
+    lats = np.array([46.5, 46.57, 46.52345, 46.49, 46.55])
+    lons = np.array([6.55, 6.65, 6.57890, 6.6, 6.70])
+
+    expected = [DEFAULT_GRID.cell_id(lat, lon) or OUTSIDE for lat, lon in zip(lats, lons)]
+
+    assert DEFAULT_GRID.cell_ids(lats, lons).tolist() == expected
+
+
+def test_quadkeys() -> None:
+
+    grid = Grid(0.0, 1.0, 0.0, 1.0)
+
+    assert grid.quadkey(0.1, 0.1, 1) == '0'
+    assert grid.quadkey(0.1, 0.9, 1) == '1'
+    assert grid.quadkey(0.9, 0.1, 1) == '2'
+    assert grid.quadkey(0.9, 0.9, 2) == '33'
+    assert grid.quadkey(2.0, 0.5, 3) is None
+
+    key = grid.quadkey(0.3, 0.7, 5)
+
+    # the keys of coarser levels are prefixes
+    assert grid.quadkey(0.3, 0.7, 3) == key[:3]
+
+    lat_min, lat_max, lon_min, lon_max = grid.quadkey_bounds(key)
+
+    assert lat_min <= 0.3 < lat_max and lon_min <= 0.7 < lon_max
+    assert lat_max - lat_min == pytest.approx(1 / 32)
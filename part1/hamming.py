@@ -0,0 +1,224 @@
+"""
+Nearest neighbours in Hamming distance, for k-fingerprinting leaf vectors.
+
+k-fingerprinting describes a trace by the leaves it ends up in, one per tree
+of the random forest; two traces are similar if they share many leaves, i.e.
+if the Hamming distance of their leaf vectors is small.
+
+Comparing a query with every reference trace does not scale to hundreds of
+thousands of traces, so the index uses locality sensitive hashing by bit
+sampling: every band hashes a few randomly chosen trees, and only traces
+that agree with the query on all trees of at least one band are compared
+exactly. Each band is a sorted array of hashes, so a lookup is a binary search
+plus the size of the matching bucket. The lookups of a whole batch of queries
+are done with one vectorized binary search per band.
+
+Queries that find fewer than k candidates probe the buckets of single trees
+instead. A reference vector outside of all of these buckets shares no entry
+with the query, i.e. is at the largest possible distance, so such queries
+still get their exact neighbours without being compared with every vector.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class _Bands:
+
+    'Class for the sorted band hashes of a set of reference vectors'
+
+    def __init__(self, vectors: np.ndarray, columns: np.ndarray, multipliers: np.ndarray):
+        """
+        Args:
+            vectors: reference vectors, one per row
+            columns: the columns hashed together by every band (bands x rows)
+            multipliers: one odd multiplier per row of a band
+        """
+
+        self.columns: np.ndarray = columns
+
+        self.multipliers: np.ndarray = multipliers
+
+        keys = self.keys(vectors)
+
+        self.orders: np.ndarray = np.argsort(keys, axis=0, kind='stable').T
+
+        self.sorted_keys: np.ndarray = np.take_along_axis(keys, self.orders.T, axis=0).T
+
+    def keys(self, vectors: np.ndarray) -> np.ndarray:
+        """ Hash of every band of every vector (vectors x bands) """
+
+        banded = vectors[:, self.columns].astype(np.uint64)
+
+        # wraps around modulo 2^64
+        return (banded * self.multipliers).sum(axis=2, dtype=np.uint64)
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ (query, reference vector) pairs that share at least one band, given the keys of the queries
+
+        Returns:
+            query and reference indices of every pair, without duplicates, sorted by query
+        """
+
+        num_vectors = self.orders.shape[1]
+
+        queries = []
+
+        references = []
+
+        for band in range(len(self.columns)):
+
+            starts = np.searchsorted(self.sorted_keys[band], keys[:, band], side='left')
+
+            sizes = np.searchsorted(self.sorted_keys[band], keys[:, band], side='right') - starts
+
+            # the ranges starts[i]:starts[i] + sizes[i] of all queries, concatenated
+            offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+            queries.append(np.repeat(np.arange(len(keys)), sizes))
+
+            references.append(self.orders[band, np.repeat(starts, sizes) + offsets])
+
+        pairs = np.unique(np.concatenate(queries) * num_vectors + np.concatenate(references))
+
+        return pairs // num_vectors, pairs % num_vectors
+
+
+class HammingIndex:
+
+    'Class for finding the nearest neighbours of integer vectors in Hamming distance'
+
+    def __init__(self, vectors: np.ndarray, bands: Optional[int] = None, rows_per_band: int = 4, seed: int = 0):
+        """
+        Args:
+            vectors: reference vectors, one per row (e.g. leaf indices of every tree)
+            bands: number of bands (default: one per rows_per_band columns)
+            rows_per_band: number of columns hashed together; more rows make the
+                buckets smaller but miss neighbours that are further away
+            seed: seed of the random choice of the columns of every band
+        """
+
+        self.vectors: np.ndarray = np.ascontiguousarray(vectors)
+
+        dimension = self.vectors.shape[1]
+
+        rows_per_band = min(rows_per_band, dimension)
+
+        if bands is None:
+            bands = max(1, dimension // rows_per_band)
+
+        rng = np.random.default_rng(seed)
+
+        columns = np.array([rng.choice(dimension, size=rows_per_band, replace=False) for _ in range(bands)])
+
+        # odd multipliers, so every column changes the hash
+        multipliers = rng.integers(1, 2 ** 63, size=rows_per_band, dtype=np.uint64) | np.uint64(1)
+
+        self.bands: _Bands = _Bands(self.vectors, columns, multipliers)
+
+        # buckets of single columns, built on the first query that needs them
+        self.single_columns: Optional[_Bands] = None
+
+    def __len__(self) -> int:
+
+        return len(self.vectors)
+
+    def keys(self, vectors: np.ndarray) -> np.ndarray:
+        """ Hash of every band of every vector (vectors x bands) """
+
+        return self.bands.keys(vectors)
+
+    def candidates(self, keys: np.ndarray) -> np.ndarray:
+        """ Reference vectors that share at least one band with a query (given its band keys) """
+
+        return self.bands.lookup(keys[None, :])[1]
+
+    def _single_column_pairs(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ (query, reference vector) pairs that agree on at least one column """
+
+        if self.single_columns is None:
+
+            dimension = self.vectors.shape[1]
+
+            self.single_columns = _Bands(self.vectors, np.arange(dimension)[:, None], np.ones(1, dtype=np.uint64))
+
+        return self.single_columns.lookup(self.single_columns.keys(queries))
+
+    def _query_batch(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+
+        dimension = self.vectors.shape[1]
+
+        query_ids, references = self.bands.lookup(self.keys(queries))
+
+        short = np.flatnonzero(np.bincount(query_ids, minlength=len(queries)) < k)
+
+        if len(short):
+
+            keep = ~np.isin(query_ids, short)
+
+            short_ids, short_references = self._single_column_pairs(queries[short])
+
+            query_ids = np.concatenate([query_ids[keep], short[short_ids]])
+
+            references = np.concatenate([references[keep], short_references])
+
+        distances = (self.vectors[references] != queries[query_ids]).sum(axis=1)
+
+        order = np.lexsort((references, distances, query_ids))
+
+        query_ids, references, distances = query_ids[order], references[order], distances[order]
+
+        # rank of every pair among the pairs of its query, closest first
+        counts = np.bincount(query_ids, minlength=len(queries))
+
+        ranks = np.arange(len(query_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        selected = ranks < k
+
+        indices = np.zeros((len(queries), k), dtype=np.int64)
+
+        neighbour_distances = np.full((len(queries), k), dimension, dtype=np.int64)
+
+        indices[query_ids[selected], ranks[selected]] = references[selected]
+
+        neighbour_distances[query_ids[selected], ranks[selected]] = distances[selected]
+
+        # all other vectors share no column with these queries: any of them is at distance `dimension`
+        for i in np.flatnonzero(counts < k):
+
+            found = indices[i, :counts[i]]
+
+            others = np.setdiff1d(np.arange(min(len(self), counts[i] + k)), found)
+
+            indices[i, counts[i]:] = others[:k - counts[i]]
+
+        return indices, neighbour_distances
+
+    def query(self, queries: np.ndarray, k: int = 1, batch_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        """ The (approximately) k nearest reference vectors of every query
+
+        Args:
+            queries: one vector per row
+            k: number of neighbours
+            batch_size: number of queries looked up at once (bounds the memory
+                used for the candidates)
+        Returns:
+            indices and Hamming distances of the neighbours (queries x k), closest first
+        """
+
+        queries = np.asarray(queries)
+
+        k = min(k, len(self))
+
+        indices = np.zeros((len(queries), k), dtype=np.int64)
+
+        distances = np.zeros((len(queries), k), dtype=np.int64)
+
+        for start in range(0, len(queries), batch_size):
+
+            batch = queries[start:start + batch_size]
+
+            indices[start:start + len(batch)], distances[start:start + len(batch)] = self._query_batch(batch, k)
+
+        return indices, distances
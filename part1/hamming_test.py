@@ -0,0 +1,93 @@
+import pytest
+
+import numpy as np
+
+from hamming import HammingIndex
+
+""" Test the Hamming distance index in hamming.py """
+
+
+def test_finds_perturbed_vectors() -> None:
+
+    rng = np.random.default_rng(0)
+
+    vectors = rng.integers(0, 50, size=(2000, 100))
+
+    index = HammingIndex(vectors, rows_per_band=4)
+
+    # copies of some reference vectors with 10 of 100 entries changed
+    targets = rng.choice(len(vectors), size=20, replace=False)
+
+    queries = vectors[targets].copy()
+    queries[:, :10] = rng.integers(50, 100, size=(20, 10))
+
+    indices, distances = index.query(queries, k=3)
+
+    assert indices.shape == distances.shape == (20, 3)
+
+    assert indices[:, 0].tolist() == targets.tolist()
+    assert distances[:, 0].tolist() == [10] * 20
+
+    # distances are exact and sorted
+    assert np.array_equal(distances, (vectors[indices] != queries[:, None, :]).sum(axis=2))
+    assert np.all(np.diff(distances, axis=1) >= 0)
+
+
+def test_lookup_only_compares_buckets() -> None:
+
+    rng = np.random.default_rng(1)
+
+    vectors = rng.integers(0, 1000, size=(5000, 40))
+
+    index = HammingIndex(vectors, rows_per_band=4)
+
+    candidates = index.candidates(index.keys(vectors[:1])[0])
+
+    assert 0 in candidates
+    assert len(candidates) < len(vectors) / 100
+
+
+def test_few_candidates_fall_back_to_all_vectors() -> None:
+
+    vectors = np.array([[1, 2, 3, 4], [1, 2, 3, 5], [9, 9, 9, 9]])
+
+    index = HammingIndex(vectors, rows_per_band=4)
+
+    indices, distances = index.query(np.array([[7, 7, 7, 7]]), k=5)
+
+    assert indices.shape == (1, 3)
+    assert distances[0].tolist() == [4, 4, 4]
+
+
+def test_few_candidates_probe_single_columns() -> None:
+
+    vectors = np.array([[1, 2, 3, 4], [1, 2, 3, 5], [9, 9, 9, 9]])
+
+    index = HammingIndex(vectors, rows_per_band=4)
+
+    # no band matches, but the last vector agrees on the first column
+    indices, distances = index.query(np.array([[9, 7, 7, 7]]), k=3)
+
+    assert indices[0].tolist() == [2, 0, 1]
+    assert distances[0].tolist() == [3, 4, 4]
+
+
+def test_batched_lookups_are_exact_for_short_queries() -> None:
+
+    rng = np.random.default_rng(2)
+
+    vectors = rng.integers(0, 4, size=(300, 8))
+
+    queries = rng.integers(0, 4, size=(23, 8))
+
+    # a single band of all columns: (almost) every query falls back to single columns, which is exact
+    index = HammingIndex(vectors, rows_per_band=8)
+
+    indices, distances = index.query(queries, k=5, batch_size=5)
+
+    brute_force = (vectors[None, :, :] != queries[:, None, :]).sum(axis=2)
+
+    assert np.array_equal(distances, np.sort(brute_force, axis=1)[:, :5])
+    assert np.array_equal(distances, np.take_along_axis(brute_force, indices, axis=1))
+
+    assert np.array_equal(index.query(queries, k=5)[1], distances)
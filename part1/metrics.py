@@ -0,0 +1,72 @@
+"""
+Classification metrics from a confusion matrix.
+
+Cross-validation accumulates one confusion matrix over all folds (each fold
+only contributes a k x k matrix of counts); accuracy, precision and recall are
+then derived from the pooled matrix with a few NumPy operations.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+
+def confusion(true_labels: np.ndarray, predicted_labels: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """ Confusion matrix: entry (i, j) counts the traces of labels[i] predicted as labels[j]
+
+    Args:
+        labels: all labels, sorted
+    """
+
+    true_index = np.searchsorted(labels, true_labels)
+
+    predicted_index = np.searchsorted(labels, predicted_labels)
+
+    k = len(labels)
+
+    return np.bincount(true_index * k + predicted_index, minlength=k * k).reshape(k, k)
+
+
+def accuracy(matrix: np.ndarray) -> float:
+
+    total = matrix.sum()
+
+    return float(np.trace(matrix) / total) if total else 0.0
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def precision_recall(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Per-label precision, recall and F1 score (0 where undefined) """
+
+    correct = np.diag(matrix).astype(np.float64)
+
+    precision = _ratio(correct, matrix.sum(axis=0))
+
+    recall = _ratio(correct, matrix.sum(axis=1))
+
+    return precision, recall, _ratio(2 * precision * recall, precision + recall)
+
+
+def report(matrix: np.ndarray, labels: np.ndarray) -> str:
+    """ Per-label and averaged precision, recall and F1 score, like sklearn's classification_report """
+
+    precision, recall, f1 = precision_recall(matrix)
+
+    support = matrix.sum(axis=1)
+
+    lines = [f'{"label":>8} {"precision":>9} {"recall":>9} {"f1-score":>9} {"support":>9}']
+
+    for row in zip(labels, precision, recall, f1, support):
+        lines.append('{:>8} {:9.3f} {:9.3f} {:9.3f} {:9d}'.format(*row))
+
+    lines.append('')
+
+    lines.append(f'{"macro":>8} {precision.mean():9.3f} {recall.mean():9.3f} {f1.mean():9.3f} {support.sum():9d}')
+
+    lines.append(f'{"accuracy":>8} {"":>9} {"":>9} {accuracy(matrix):9.3f} {support.sum():9d}')
+
+    return '\n'.join(lines)
@@ -0,0 +1,43 @@
+import pytest
+
+import numpy as np
+
+from metrics import accuracy, confusion, precision_recall, report
+
+""" Test the confusion matrix metrics in metrics.py """
+
+
+def test_pooled_confusion_matrix() -> None:
+
+    labels = np.array([3, 5, 9])
+
+    fold_1 = confusion(np.array([3, 3, 5]), np.array([3, 5, 5]), labels)
+    fold_2 = confusion(np.array([9, 9, 5]), np.array([9, 3, 5]), labels)
+
+    pooled = fold_1 + fold_2
+
+    assert pooled.tolist() == [[1, 1, 0], [0, 2, 0], [1, 0, 1]]
+
+    assert accuracy(pooled) == pytest.approx(4 / 6)
+
+    precision, recall, f1 = precision_recall(pooled)
+
+    assert precision.tolist() == pytest.approx([1 / 2, 2 / 3, 1])
+    assert recall.tolist() == pytest.approx([1 / 2, 1, 1 / 2])
+    assert f1[1] == pytest.approx(0.8)
+
+
+def test_undefined_metrics_are_zero() -> None:
+
+    labels = np.array([1, 2])
+
+    matrix = confusion(np.array([1, 1]), np.array([1, 1]), labels)
+
+    precision, recall, _ = precision_recall(matrix)
+
+    assert precision.tolist() == [1.0, 0.0]
+    assert recall.tolist() == [1.0, 0.0]
+
+    assert accuracy(np.zeros((2, 2), dtype=np.int64)) == 0.0
+
+    assert 'accuracy' in report(matrix, labels)
@@ -0,0 +1,266 @@
+"""
+Spatial index over the PoIs, for radius and k nearest neighbour queries.
+
+The PoIs are hashed into buckets of a fine latitude/longitude grid (about
+BUCKET_METRES wide). A radius query only looks at the buckets overlapping the
+bounding box of the circle, so its cost depends on the number of PoIs near
+the location rather than on the size of the map; a k nearest neighbour query
+runs radius queries of doubling radius until k PoIs are found.
+
+Everything is partitioned by PoI type: every type has its own buckets, and
+every grid cell has a sorted posting list of PoI ids per type. Filtering by the
+subscriptions disclosed in a request thus only touches the partitions of
+these types (a union of their posting lists) instead of scanning all PoIs.
+
+The index is built once when the server starts. PoIs need coordinates and a
+type; databases without `lat`/`lon` columns (such as the original
+fingerprint.db) place every PoI at the center of its grid cell, and PoIs
+without a `poi_type` column match every type: they are returned to every
+request that discloses at least one subscription, so with the original
+fingerprint.db type filtering only tells apart requests with and without
+subscriptions.
+"""
+
+import heapq
+
+import math
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from grid import DEFAULT_GRID, Grid
+
+from poi_store import connect_readonly
+
+EARTH_RADIUS_METRES = 6371008.8
+
+METRES_PER_DEGREE = EARTH_RADIUS_METRES * math.pi / 180
+
+BUCKET_METRES = 100.0
+
+# largest radius and number of neighbours a query may ask for
+MAX_RADIUS_METRES = 20000.0
+
+MAX_NEAREST = 100
+
+
+class PoIEntry(NamedTuple):
+
+    poi_id: int
+    lat: float
+    lon: float
+    poi_type: Optional[str]
+    grid_id: Optional[int] = None
+
+
+def distance_metres(lat_1: float, lon_1: float, lat_2: float, lon_2: float) -> float:
+    """ Great-circle distance (haversine) """
+
+    phi_1, phi_2 = math.radians(lat_1), math.radians(lat_2)
+
+    a = math.sin((phi_2 - phi_1) / 2) ** 2 + \
+        math.cos(phi_1) * math.cos(phi_2) * math.sin(math.radians(lon_2 - lon_1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_METRES * math.asin(min(1.0, math.sqrt(a)))
+
+
+class PoIIndex:
+
+    'Class for answering radius and nearest neighbour queries over PoIs'
+
+    def __init__(self, entries: Iterable[PoIEntry], bucket_metres: float = BUCKET_METRES):
+
+        self.entries: List[PoIEntry] = list(entries)
+
+        reference_lat = 0.0
+
+        if self.entries:
+            reference_lat = sum(entry.lat for entry in self.entries) / len(self.entries)
+
+        # buckets are about bucket_metres wide around the PoIs
+        self.lat_step: float = bucket_metres / METRES_PER_DEGREE
+
+        self.lon_step: float = bucket_metres / (METRES_PER_DEGREE * max(math.cos(math.radians(reference_lat)), 1e-6))
+
+        # type -> bucket -> PoIs
+        self.buckets: Dict[Optional[str], Dict[Tuple[int, int], List[PoIEntry]]] = {}
+
+        # grid cell -> type -> sorted PoI ids
+        self.postings: Dict[int, Dict[Optional[str], List[int]]] = {}
+
+        for entry in self.entries:
+
+            self.buckets.setdefault(entry.poi_type, {}).setdefault(
+                self.bucket(entry.lat, entry.lon), []).append(entry)
+
+            if entry.grid_id is not None:
+                self.postings.setdefault(entry.grid_id, {}).setdefault(entry.poi_type, []).append(entry.poi_id)
+
+        for cell in self.postings.values():
+
+            for poi_ids in cell.values():
+                poi_ids.sort()
+
+    def __len__(self) -> int:
+
+        return len(self.entries)
+
+    @property
+    def types(self) -> List[str]:
+        """ The PoI types of the index (untyped PoIs aside) """
+
+        return sorted(poi_type for poi_type in self.buckets if poi_type is not None)
+
+    def bucket(self, lat: float, lon: float) -> Tuple[int, int]:
+
+        return math.floor(lat / self.lat_step), math.floor(lon / self.lon_step)
+
+    def partitions(self, types: Optional[Iterable[str]]) -> List[Optional[str]]:
+        """ The types to look at for a request for the given types (None: all)
+
+        PoIs without a type (None) are part of every request for at least one
+        type, and of no request for none.
+        """
+
+        if types is None:
+            return list(self.buckets)
+
+        types = set(types)
+
+        if types:
+            types.add(None)
+
+        return [poi_type for poi_type in types if poi_type in self.buckets]
+
+    def _candidates(self, buckets: Dict[Tuple[int, int], List[PoIEntry]],
+                    lat: float, lon: float, radius: float) -> Iterable[PoIEntry]:
+        """ PoIs of the buckets overlapping the bounding box of a circle """
+
+        delta_lat = radius / METRES_PER_DEGREE
+
+        # degrees of longitude are shortest at the latitude furthest from the equator
+        widest_lat = min(abs(lat) + delta_lat, 89.9)
+
+        delta_lon = min(radius / (METRES_PER_DEGREE * math.cos(math.radians(widest_lat))), 180.0)
+
+        lat_low, lon_low = self.bucket(lat - delta_lat, lon - delta_lon)
+
+        lat_high, lon_high = self.bucket(lat + delta_lat, lon + delta_lon)
+
+        # a large circle covers more buckets than there are non-empty ones
+        if (lat_high - lat_low + 1) * (lon_high - lon_low + 1) > len(buckets):
+
+            for (lat_bucket, lon_bucket), entries in buckets.items():
+
+                if lat_low <= lat_bucket <= lat_high and lon_low <= lon_bucket <= lon_high:
+                    yield from entries
+
+            return
+
+        for lat_bucket in range(lat_low, lat_high + 1):
+
+            for lon_bucket in range(lon_low, lon_high + 1):
+                yield from buckets.get((lat_bucket, lon_bucket), ())
+
+    def within(self, lat: float, lon: float, radius: float,
+               types: Optional[Iterable[str]] = None) -> List[Tuple[float, PoIEntry]]:
+        """ PoIs (of the given types) within radius metres of a location, closest first
+
+        Returns:
+            [(distance in metres, PoI), ...]
+        Raises:
+            ValueError: if the location or radius is not finite
+        """
+
+        if not all(math.isfinite(value) for value in (lat, lon, radius)):
+            raise ValueError(f'Invalid radius query: {lat}, {lon}, {radius}')
+
+        found = []
+
+        for poi_type in self.partitions(types):
+
+            for entry in self._candidates(self.buckets[poi_type], lat, lon, radius):
+
+                distance = distance_metres(lat, lon, entry.lat, entry.lon)
+
+                if distance <= radius:
+                    found.append((distance, entry))
+
+        found.sort(key=lambda item: (item[0], item[1].poi_id))
+
+        return found
+
+    def nearest(self, lat: float, lon: float, k: int,
+                types: Optional[Iterable[str]] = None) -> List[Tuple[float, PoIEntry]]:
+        """ The k PoIs (of the given types) closest to a location, closest first
+
+        Returns:
+            [(distance in metres, PoI), ...]
+        Raises:
+            ValueError: if the location is not finite
+        """
+
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            raise ValueError(f'Invalid location: {lat}, {lon}')
+
+        if k <= 0 or not self.entries:
+            return []
+
+        types = self.partitions(types)
+
+        if not types:
+            return []
+
+        radius = self.lat_step * METRES_PER_DEGREE
+
+        while True:
+
+            found = self.within(lat, lon, radius, types)
+
+            # every PoI outside of the circle is further away than the k-th one inside
+            if len(found) >= k or radius >= math.pi * EARTH_RADIUS_METRES:
+                return found[:k]
+
+            radius *= 2
+
+    def in_cell(self, cell_id: int, types: Optional[Iterable[str]] = None) -> List[int]:
+        """ Sorted ids of the PoIs (of the given types) in a grid cell """
+
+        cell = self.postings.get(cell_id, {})
+
+        return list(heapq.merge(*(cell[poi_type] for poi_type in self.partitions(types) if poi_type in cell)))
+
+
+def load_entries(path: str, table: str, grid: Grid = DEFAULT_GRID) -> List[PoIEntry]:
+    """ Read the PoIs of a database (see the module docstring for missing columns) """
+
+    connection = connect_readonly(path)
+
+    try:
+        columns = {row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')}
+
+        has_location = {'lat', 'lon'} <= columns
+
+        has_type = 'poi_type' in columns
+
+        query = 'SELECT poi_id, grid_id, {}, {} FROM "{}"'.format(
+            'lat, lon' if has_location else 'NULL, NULL',
+            'poi_type' if has_type else 'NULL',
+            table)
+
+        entries = []
+
+        for poi_id, grid_id, lat, lon, poi_type in connection.execute(query):
+
+            if lat is None or lon is None:
+
+                if grid_id is None or not 1 <= grid_id <= grid.num_cells:
+                    continue
+
+                lat, lon = grid.center(grid_id)
+
+            entries.append(PoIEntry(poi_id, lat, lon, poi_type, grid_id))
+
+        return entries
+
+    finally:
+        connection.close()
@@ -0,0 +1,136 @@
+import pytest
+
+import random
+
+import sqlite3
+
+from grid import DEFAULT_GRID
+from poi_index import PoIEntry, PoIIndex, distance_metres, load_entries
+
+""" Test the spatial PoI index in poi_index.py """
+
+TYPES = ['restaurant', 'bar', 'club', 'gym']
+
+
+def random_entries(count: int) -> list:
+
+    rng = random.Random(0)
+
+    entries = []
+
+    for poi_id in range(count):
+
+        lat, lon = rng.uniform(46.5, 46.57), rng.uniform(6.55, 6.65)
+
+        entries.append(PoIEntry(poi_id, lat, lon, rng.choice(TYPES), DEFAULT_GRID.cell_id(lat, lon)))
+
+    return entries
+
+
+def brute_force(entries: list, lat: float, lon: float, types: set) -> list:
+
+    found = [(distance_metres(lat, lon, entry.lat, entry.lon), entry) for entry in entries if entry.poi_type in types]
+
+    return sorted(found, key=lambda item: (item[0], item[1].poi_id))
+
+
+def test_distance() -> None:
+
+    # one degree of latitude
+    assert distance_metres(46.0, 6.0, 47.0, 6.0) == pytest.approx(111195, rel=1e-4)
+
+    assert distance_metres(46.5, 6.6, 46.5, 6.6) == 0.0
+
+
+def test_radius_queries_match_brute_force() -> None:
+
+    entries = random_entries(2000)
+
+    index = PoIIndex(entries)
+
+    for lat, lon, radius in [(46.52, 6.6, 300), (46.5, 6.55, 1000), (46.55, 6.62, 5), (46.53, 6.6, 20000)]:
+
+        expected = [item for item in brute_force(entries, lat, lon, {'bar', 'gym'}) if item[0] <= radius]
+
+        assert index.within(lat, lon, radius, ['bar', 'gym']) == expected
+
+
+def test_nearest_neighbours_match_brute_force() -> None:
+
+    entries = random_entries(2000)
+
+    index = PoIIndex(entries)
+
+    for lat, lon in [(46.52, 6.6), (46.4, 6.3), (46.569, 6.649)]:
+
+        assert index.nearest(lat, lon, 7, ['restaurant']) == brute_force(entries, lat, lon, {'restaurant'})[:7]
+
+    assert len(index.nearest(46.52, 6.6, 10 ** 6)) == len(entries)
+
+    assert PoIIndex([]).nearest(46.52, 6.6, 3) == []
+
+
+def test_queries_reject_non_finite_values() -> None:
+
+    index = PoIIndex(random_entries(100))
+
+    for lat, lon, radius in [(46.52, 6.6, float('inf')), (46.52, 6.6, float('nan')), (float('nan'), 6.6, 300)]:
+
+        with pytest.raises(ValueError):
+            index.within(lat, lon, radius)
+
+    with pytest.raises(ValueError):
+        index.nearest(46.52, float('inf'), 3)
+
+
+def test_cell_posting_lists() -> None:
+
+    entries = random_entries(2000)
+
+    index = PoIIndex(entries)
+
+    for cell_id in (1, 24, 100):
+
+        expected = sorted(entry.poi_id for entry in entries
+                          if entry.grid_id == cell_id and entry.poi_type in ('bar', 'club'))
+
+        assert index.in_cell(cell_id, ['bar', 'club', 'unknown']) == expected
+
+    assert len(index.in_cell(24)) == sum(entry.grid_id == 24 for entry in entries)
+
+    assert index.in_cell(24, []) == []
+    assert index.in_cell(101, ['bar']) == []
+
+
+def test_untyped_pois_need_a_type() -> None:
+
+    index = PoIIndex([PoIEntry(1, 46.52, 6.6, None, 24), PoIEntry(2, 46.52, 6.6, 'bar', 24)])
+
+    assert index.in_cell(24, ['gym']) == [1]
+    assert index.in_cell(24, ['bar']) == [1, 2]
+    assert index.in_cell(24, []) == []
+
+    assert index.types == ['bar']
+    assert PoIIndex([PoIEntry(1, 46.52, 6.6, None, 24)]).types == []
+
+    assert index.within(46.52, 6.6, 10, []) == []
+    assert index.nearest(46.52, 6.6, 1, []) == []
+
+
+def test_load_entries_without_coordinates(tmp_path) -> None:
+
+    path = str(tmp_path / 'pois.db')
+
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE po_i (poi_id INTEGER PRIMARY KEY, poi_name TEXT, poi_address TEXT, '
+                       'grid_id INTEGER, poi_ratings TEXT)')
+    connection.execute("INSERT INTO po_i VALUES (1, 'a', 'b', 24, '[]')")
+    connection.commit()
+    connection.close()
+
+    entries = load_entries(path, 'po_i')
+
+    assert entries == [PoIEntry(1, *DEFAULT_GRID.center(24), None, 24)]
+
+    # PoIs without a type match every type
+    assert PoIIndex(entries).nearest(46.52, 6.57, 1, ['bar'])[0][1].poi_id == 1
@@ -0,0 +1,88 @@
+import pytest
+
+import json
+
+import sqlite3
+
+from poi_index import load_entries
+from poi_loader import TABLE, load, main, read_pois, to_row
+
+""" Test the bulk PoI loader in poi_loader.py """
+
+
+def test_load_csv_and_jsonl(tmp_path) -> None:
+
+    csv_path = tmp_path / 'pois.csv'
+    csv_path.write_text('poi_id,poi_name,poi_address,lat,lon,poi_type,poi_ratings\n'
+                        '1,Pizza,Rue 1,46.52345,6.5789,restaurant,"[4, 5]"\n'
+                        '2,Pub,Rue 2,46.569,6.649,bar,[]\n')
+
+    jsonl_path = tmp_path / 'pois.jsonl'
+    jsonl_path.write_text(json.dumps({'poi_id': 3, 'poi_name': 'Gym', 'grid_id': 7,
+                                      'poi_type': 'gym', 'poi_ratings': [1]}) + '\n')
+
+    database = str(tmp_path / 'fingerprint.db')
+
+    main([str(csv_path), str(jsonl_path), '-d', database, '--batch-size', '2'])
+
+    connection = sqlite3.connect(database)
+
+    rows = connection.execute(f'SELECT poi_id, grid_id, poi_ratings, poi_type FROM {TABLE} ORDER BY poi_id').fetchall()
+
+    assert rows == [(1, 24, '[4, 5]', 'restaurant'), (2, 100, '[]', 'bar'), (3, 7, '[1]', 'gym')]
+
+    indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    assert {f'ix_{TABLE}_grid_id', f'ix_{TABLE}_poi_type'} <= indexes
+
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    connection.close()
+
+    # the server's index reads the loaded PoIs
+    assert [entry.poi_type for entry in load_entries(database, TABLE)] == ['restaurant', 'bar', 'gym']
+
+
+def test_type_from_category_columns() -> None:
+
+    assert to_row({'poi_id': 1, 'category': 'bar'})[-1] == 'bar'
+    assert to_row({'poi_id': 1, 'poi_type': 'gym', 'category': 'bar'})[-1] == 'gym'
+    assert to_row({'poi_id': 1, 'poi_type': '', 'poi_category': 'club'})[-1] == 'club'
+    assert to_row({'poi_id': 1})[-1] is None
+
+
+def test_failed_load_is_rolled_back(tmp_path) -> None:
+
+    database = str(tmp_path / 'fingerprint.db')
+
+    load(database, [to_row({'poi_id': 1, 'lat': 46.52, 'lon': 6.6})])
+
+    # duplicate poi_id in the middle of the load
+    rows = [to_row({'poi_id': 2}), to_row({'poi_id': 1})]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        load(database, rows)
+
+    connection = sqlite3.connect(database)
+
+    assert connection.execute(f'SELECT poi_id FROM {TABLE}').fetchall() == [(1,)]
+
+    connection.close()
+
+    assert load(database, [to_row({'poi_id': 5})], replace=True) == 1
+
+
+def test_existing_server_table_gets_new_columns(tmp_path) -> None:
+
+    database = str(tmp_path / 'fingerprint.db')
+
+    connection = sqlite3.connect(database)
+    connection.execute(f'CREATE TABLE {TABLE} (poi_id INTEGER PRIMARY KEY, poi_name VARCHAR, '
+                       'poi_address VARCHAR, grid_id INTEGER, poi_ratings VARCHAR)')
+    connection.execute(f"INSERT INTO {TABLE} VALUES (1, 'a', 'b', 3, '[]')")
+    connection.commit()
+    connection.close()
+
+    assert load(database, [to_row({'poi_id': 2, 'lat': 46.52, 'lon': 6.6, 'poi_type': 'bar'})]) == 1
+
+    assert [entry.poi_id for entry in load_entries(database, TABLE)] == [1, 2]
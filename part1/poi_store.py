@@ -0,0 +1,123 @@
+"""
+Read-only access to the PoI database.
+
+The server never writes PoIs, so instead of going through a Flask-SQLAlchemy
+session (set up and rolled back for every request), PoIs are read with plain
+sqlite3 connections opened read-only:
+
+    * `mode=ro&immutable=1`: no locking and no change detection; the database
+      must not be modified while the server runs (restart the server after
+      running poi_loader.py)
+    * PRAGMA mmap_size: pages are read through a memory map of the file
+      instead of read() calls into the page cache
+    * PRAGMA cache_size: a page cache large enough to keep the whole PoI table
+
+Every thread (worker) keeps its own connection, and with it sqlite3's cache of
+prepared statements, so the queries below are only compiled once per worker.
+"""
+
+import os
+
+import sqlite3
+
+import threading
+
+from typing import Any, Dict, Optional
+
+from urllib.parse import quote
+
+# Table of server.PoI (Flask-SQLAlchemy's name for the model)
+TABLE = 'po_i'
+
+MMAP_SIZE = 256 * 1024 * 1024
+
+CACHE_KIB = 64 * 1024
+
+COLUMNS = ('poi_id', 'poi_name', 'poi_address', 'grid_id', 'poi_ratings')
+
+
+def connect_readonly(path: str, immutable: bool = True, mmap_size: int = MMAP_SIZE,
+                     cache_kib: int = CACHE_KIB) -> sqlite3.Connection:
+    """ Open a SQLite database read-only, tuned for reading
+
+    Args:
+        path: the database file
+        immutable: promise that nobody modifies the database while it is open
+        mmap_size: bytes of the file to memory-map
+        cache_kib: size of the page cache in KiB
+    """
+
+    uri = f'file:{quote(os.path.abspath(path))}?mode=ro'
+
+    if immutable:
+        uri += '&immutable=1'
+
+    connection = sqlite3.connect(uri, uri=True)
+
+    connection.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+
+    # negative sizes are in KiB instead of pages
+    connection.execute(f'PRAGMA cache_size={-int(cache_kib)}')
+
+    connection.execute('PRAGMA temp_store=MEMORY')
+
+    return connection
+
+
+class PoIStore:
+
+    'Class for reading PoIs, with one read-only connection per thread'
+
+    def __init__(self, path: str, table: str = TABLE, immutable: bool = True,
+                 mmap_size: int = MMAP_SIZE, cache_kib: int = CACHE_KIB):
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No PoI database at {path}')
+
+        self.path: str = path
+
+        self.immutable: bool = immutable
+
+        self.mmap_size: int = mmap_size
+
+        self.cache_kib: int = cache_kib
+
+        # the same text for every call, so that the statement cache hits
+        self.get_query: str = f'SELECT {", ".join(COLUMNS)} FROM "{table}" WHERE poi_id = ?'
+
+        self.local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ The connection of the calling thread """
+
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None:
+
+            connection = connect_readonly(self.path, self.immutable, self.mmap_size, self.cache_kib)
+
+            self.local.connection = connection
+
+        return connection
+
+    def get(self, poi_id: int) -> Optional[Dict[str, Any]]:
+        """ The columns of a PoI (as server.PoI.to_dict), None if there is no such PoI """
+
+        row = self.connection.execute(self.get_query, (poi_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(zip(COLUMNS, row))
+
+    def close(self) -> None:
+        """ Close the connection of the calling thread """
+
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is not None:
+
+            connection.close()
+
+            self.local.connection = None
@@ -0,0 +1,77 @@
+import pytest
+
+import sqlite3
+
+import threading
+
+from grid import DEFAULT_GRID
+from poi_loader import load, to_row
+from poi_store import PoIStore, connect_readonly
+
+""" Test the read-only PoI access in poi_store.py """
+
+
+@pytest.fixture
+def database(tmp_path) -> str:
+
+    path = str(tmp_path / 'fingerprint.db')
+
+    load(path, [to_row({'poi_id': poi_id, 'poi_name': f'PoI {poi_id}', 'poi_address': 'Rue 1',
+                        'lat': 46.52, 'lon': 6.6, 'poi_type': 'bar', 'poi_ratings': [poi_id]})
+                for poi_id in range(1, 11)])
+
+    return path
+
+
+def test_get(database: str) -> None:
+
+    store = PoIStore(database)
+
+    assert store.get(3) == {'poi_id': 3, 'poi_name': 'PoI 3', 'poi_address': 'Rue 1',
+                            'grid_id': DEFAULT_GRID.cell_id(46.52, 6.6), 'poi_ratings': '[3]'}
+
+    assert store.get(11) is None
+
+    store.close()
+
+
+def test_connection_is_read_only_and_tuned(database: str) -> None:
+
+    connection = connect_readonly(database, mmap_size=1 << 20, cache_kib=1024)
+
+    assert connection.execute('PRAGMA mmap_size').fetchone()[0] == 1 << 20
+
+    assert connection.execute('PRAGMA cache_size').fetchone()[0] == -1024
+
+    with pytest.raises(sqlite3.OperationalError):
+        connection.execute("DELETE FROM po_i")
+
+    connection.close()
+
+
+def test_connection_per_thread(database: str) -> None:
+
+    store = PoIStore(database)
+
+    # the connection (and its prepared statements) is reused by a thread
+    assert store.connection is store.connection
+
+    others = []
+
+    def query() -> None:
+
+        others.append((store.connection, store.get(1)))
+
+    thread = threading.Thread(target=query)
+    thread.start()
+    thread.join()
+
+    assert others[0][0] is not store.connection
+
+    assert others[0][1]['poi_id'] == 1
+
+
+def test_missing_database(tmp_path) -> None:
+
+    with pytest.raises(FileNotFoundError):
+        PoIStore(str(tmp_path / 'missing.db'))
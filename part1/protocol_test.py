@@ -16,6 +16,14 @@ from user import User
 
 from service_provider import ServiceProvider
 
+from cache import ReplayCache
+
+from stroll import Client, Server, restore_public_key
+
+from transcript import disclosure_proof_digest
+
+from validation import parse_disclosure_proof
+
 # ---------------------------------------------------
 # Type aliases
 
@@ -260,3 +268,181 @@ def test_ABC_protocol_disclosure_fail() -> None:
         disclosure_proof, wrong_message)
 
     assert disclosure_res == False
+
+
+'''
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+(4) Replayed disclosure proofs are answered from the replay cache
+'''
+
+
+def test_ABC_protocol_replay() -> None:
+
+    available_subscriptions: List[str] = ['restaurants', 'gyms',
+                                          'bars', 'cafés', 'zendos', 'libraries']
+
+    username: str = 'zoé'
+
+    attributes: List[str] = available_subscriptions + [username]
+
+    provider_pk, provider_sk = generate_key(attributes)
+
+    chosen_subscriptions = ['restaurants', 'gyms', 'cafés']
+
+    user = User(provider_pk, chosen_subscriptions, 'zoé')
+
+    replay_cache = ReplayCache()
+
+    provider = ServiceProvider(
+        provider_pk, provider_sk, chosen_subscriptions, username,
+        replay_cache=replay_cache)
+
+    credential = user.obtain_credential(
+        provider.sign_issue_request(user.create_issue_request()))
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    wrong_message: bytes = (f"{46.62345},{6.47890}").encode("utf-8")
+
+    disclosure_proof: DisclosureProof = user.create_disclosure_proof(
+        credential, message)
+
+    assert provider.verify_disclosure_proof(disclosure_proof, message) == True
+
+    assert provider.verify_disclosure_proof(
+        disclosure_proof, wrong_message) == False
+
+    assert replay_cache.replays == 0
+
+    # replays get the previous verdicts
+    assert provider.verify_disclosure_proof(disclosure_proof, message) == True
+
+    assert provider.verify_disclosure_proof(
+        disclosure_proof, wrong_message) == False
+
+    assert replay_cache.replays == 2
+
+    # ... unless replays are rejected altogether
+    replay_cache.reject_replays = True
+
+    assert provider.verify_disclosure_proof(disclosure_proof, message) == False
+
+
+def register(subscriptions: List[str], chosen_subscriptions: List[str]) -> Tuple[Server, Client, bytes, bytes]:
+    """ A server and a client holding a credential for the chosen subscriptions """
+
+    username: str = 'zoé'
+
+    secret_key, public_key = Server.generate_ca(subscriptions + ['username'])
+
+    server = Server()
+
+    client = Client()
+
+    issuance_request, state = client.prepare_registration(
+        public_key, username, chosen_subscriptions)
+
+    response = server.process_registration(
+        secret_key, public_key, issuance_request, username, chosen_subscriptions)
+
+    return server, client, public_key, client.process_registration_response(public_key, response, state)
+
+
+def test_server_replays() -> None:
+
+    server, client, public_key, credential = register(
+        ['restaurants', 'gyms', 'bars'], ['restaurants', 'bars'])
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    signature = client.sign_request(public_key, credential, message, ['bars'])
+
+    proof_digest = disclosure_proof_digest(
+        parse_disclosure_proof(restore_public_key(public_key), signature), message)
+
+    assert server.check_request_signature(public_key, message, ['bars'], signature) == ['bars']
+
+    assert server.replay_cache.replay_count(proof_digest) == 0
+
+    # byte-identical retries are answered from the caches, but still count as replays (once each)
+    assert server.check_request_signature(public_key, message, ['bars'], signature) == ['bars']
+
+    assert server.replay_cache.replays == 1
+    assert server.replay_cache.replay_count(proof_digest) == 1
+
+    server.replay_cache.reject_replays = True
+
+    assert not server.check_request_signature(public_key, message, ['bars'], signature)
+
+    assert server.replay_cache.replays == 2
+
+    # a valid proof that was rejected as a replay is granted again from the cache
+    server.replay_cache.reject_replays = False
+
+    assert server.check_request_signature(public_key, message, ['bars'], signature) == ['bars']
+
+    assert server.replay_cache.replays == 3
+    assert server.replay_cache.replay_count(proof_digest) == 3
+
+
+def test_server_verifies_expired_replays_once() -> None:
+
+    server, client, public_key, credential = register(
+        ['restaurants', 'gyms', 'bars'], ['restaurants', 'bars'])
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    signature = client.sign_request(public_key, credential, message, ['bars'])
+
+    proof_digest = disclosure_proof_digest(
+        parse_disclosure_proof(restore_public_key(public_key), signature), message)
+
+    assert server.check_request_signature(public_key, message, ['bars'], signature) == ['bars']
+
+    # the proof expires from the replay cache, but not the request from the verification cache
+    server.replay_cache.cache.clear()
+
+    misses = server.replay_cache.cache.misses
+
+    assert server.check_request_signature(public_key, message, ['bars'], signature) == ['bars']
+
+    # a single lookup, then the proof is verified and recorded anew
+    assert server.replay_cache.cache.misses == misses + 1
+    assert server.replay_cache.replays == 0
+    assert server.replay_cache.replay_count(proof_digest) == 0
+
+
+def test_server_grants_disclosed_subscriptions_only() -> None:
+
+    server, client, public_key, credential = register(
+        ['restaurants', 'gyms', 'bars'], ['restaurants', 'bars'])
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    signature = client.sign_request(public_key, credential, message, ['bars', 'restaurants'])
+
+    assert server.check_request_signature(
+        public_key, message, ['restaurants', 'bars'], signature) == ['bars', 'restaurants']
+
+    # types that the proof does not disclose
+    assert server.check_request_signature(public_key, message, ['bars', 'restaurants', 'gyms'], signature) is None
+
+    assert server.check_request_signature(public_key, message, ['bars', 'clubs', 'restaurants'], signature) is None
+
+    # ... or disclosed types that are left out of the request
+    assert server.check_request_signature(public_key, message, ['bars'], signature) is None
+
+    # a subscription the credential does not hold is disclosed with value 0
+    signature = client.sign_request(public_key, credential, message, ['gyms'])
+
+    assert server.check_request_signature(public_key, message, ['gyms'], signature) is None
+
+
+def test_server_rejects_malformed_types() -> None:
+
+    server = Server()
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    for types in ([1, 'bars'], [['bars']], [1.5], 'bars', {'bars': 1}, None):
+        assert not server.check_request_signature(b'', message, types, b'{}')
@@ -7,6 +7,8 @@ Server entrypoint.
 
 import argparse
 import json
+import math
+import os
 import random
 import sys
 from typing import Dict, List, Union
@@ -14,6 +16,9 @@ from typing import Dict, List, Union
 from flask import Flask, jsonify, make_response, request
 from flask_sqlalchemy import SQLAlchemy
 
+from grid import DEFAULT_GRID
+from poi_index import MAX_NEAREST, MAX_RADIUS_METRES, PoIIndex, load_entries
+from poi_store import PoIStore
 from stroll import Server
 
 
@@ -108,6 +113,8 @@ def server_run(args: argparse.Namespace) -> None:
     global PUBLIC_KEY
     global SECRET_KEY
     global SERVER
+    global POI_INDEX
+    global POI_STORE
 
     try:
         PUBLIC_KEY = args.pub.read()
@@ -119,6 +126,15 @@ def server_run(args: argparse.Namespace) -> None:
 
     SERVER = Server()
 
+    POI_INDEX = PoIIndex(load_entries(POI_DATABASE, PoI.__tablename__))
+
+    if len(POI_INDEX) and not POI_INDEX.types:
+        print("Warning: no PoI has a type, so subscriptions only filter out requests "
+              "without any (load the PoIs with their types, see poi_loader.py)")
+
+    # PoI details are read through read-only connections instead of the ORM
+    POI_STORE = PoIStore(POI_DATABASE, PoI.__tablename__)
+
     host = "0.0.0.0"
     port = 8080
 
@@ -163,6 +179,8 @@ class PoI(DB.Model):
 
 
 APP.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///fingerprint.db"
+# Flask-SQLAlchemy resolves the relative path against the app's root
+POI_DATABASE = os.path.join(APP.root_path, "fingerprint.db")
 APP.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 DB.app = APP
 DB.init_app(APP)
@@ -171,6 +189,8 @@ DB.init_app(APP)
 PUBLIC_KEY = None
 SECRET_KEY = None
 SERVER = None
+POI_INDEX = None
+POI_STORE = None
 
 
 @APP.route("/public-key", methods=["GET"])
@@ -198,9 +218,9 @@ def register():
     return server_res
 
 
-def convert_loc_to_gridval(loc):
-    """Placeholder function. Final function would convert the location to a grid value."""
-    return int(loc)
+def convert_loc_to_gridval(lat, lon):
+    """Convert a location to the id of its grid cell (None if it is outside of the grid)."""
+    return DEFAULT_GRID.cell_id(lat, lon)
 
 
 @APP.route("/poi-loc", methods=["POST"])
@@ -213,32 +233,96 @@ def get_poi_loc():
     signature = request.files.get("signature").read()
     message = (f"{lat},{lon}").encode("utf-8")
 
-    valid = SERVER.check_request_signature(
+    # only the subscriptions shown by the proof (None if it is invalid)
+    types = SERVER.check_request_signature(
         PUBLIC_KEY, message, types, signature
     )
 
-    if not valid:
+    if types is None:
         return "Invalid signature", 401
 
     # PoIs are within coordinates (46.5, 6.55) and (46.57, 6.65)
-    # mapped to a 10 x 10 grid
-    if 46.5 <= lat <= 46.57 and 6.55 <= lon <= 6.65:
-        cell_x = ((lat - 46.5) / 0.07) * 10
-        cell_y = ((lon - 6.55) / 0.1) * 10
-        cell_id = int(cell_x + (cell_y * 10))
-        records = PoI.query.filter_by(grid_id=cell_id).all()
-
-        if records:
-            poi_list = [record.to_dict()["poi_id"] for record in records]
-            poi_list_res = {"poi_list": poi_list}
-        else:
-            poi_list_res = {"poi_list": []}
+    # mapped to a 10 x 10 grid (see grid.py)
+    # only the PoIs of the disclosed types, from the per-type posting lists of the cell
+    cell_id = convert_loc_to_gridval(lat, lon)
+    if cell_id is not None:
+        poi_list_res = {"poi_list": POI_INDEX.in_cell(cell_id, types)}
     else:
         poi_list_res = {"poi_list": []}
 
     return jsonify(poi_list_res)
 
 
+def valid_location(lat, lon):
+    """Whether a latitude and longitude (in degrees) are finite and in range."""
+    return math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+@APP.route("/poi-radius", methods=["POST"])
+def get_poi_radius():
+    """Takes in a latitude, longitude and radius (metres) as input, returns the POIs
+    of the disclosed types within the radius, closest first."""
+
+    try:
+        lat = float(request.files.get("lat").read().decode("utf-8"))
+        lon = float(request.files.get("lon").read().decode("utf-8"))
+        radius = float(request.files.get("radius").read().decode("utf-8"))
+    except ValueError:
+        return "Invalid query", 400
+
+    # nan fails both comparisons
+    if not valid_location(lat, lon) or not 0 < radius <= MAX_RADIUS_METRES:
+        return "Invalid query", 400
+
+    types = json.loads(request.files.get("types").read().decode("utf-8"))
+    signature = request.files.get("signature").read()
+    message = (f"{lat},{lon},{radius}").encode("utf-8")
+
+    # only the subscriptions shown by the proof (None if it is invalid)
+    types = SERVER.check_request_signature(
+        PUBLIC_KEY, message, types, signature
+    )
+
+    if types is None:
+        return "Invalid signature", 401
+
+    found = POI_INDEX.within(lat, lon, radius, types)
+
+    return jsonify({"poi_list": [poi.poi_id for _, poi in found]})
+
+
+@APP.route("/poi-nearest", methods=["POST"])
+def get_poi_nearest():
+    """Takes in a latitude, longitude and a number k as input, returns the k POIs
+    of the disclosed types closest to the location, closest first."""
+
+    try:
+        lat = float(request.files.get("lat").read().decode("utf-8"))
+        lon = float(request.files.get("lon").read().decode("utf-8"))
+        k = int(request.files.get("k").read().decode("utf-8"))
+    except ValueError:
+        return "Invalid query", 400
+
+    if not valid_location(lat, lon) or not 0 < k <= MAX_NEAREST:
+        return "Invalid query", 400
+
+    types = json.loads(request.files.get("types").read().decode("utf-8"))
+    signature = request.files.get("signature").read()
+    message = (f"{lat},{lon},{k}").encode("utf-8")
+
+    # only the subscriptions shown by the proof (None if it is invalid)
+    types = SERVER.check_request_signature(
+        PUBLIC_KEY, message, types, signature
+    )
+
+    if types is None:
+        return "Invalid signature", 401
+
+    found = POI_INDEX.nearest(lat, lon, k, types)
+
+    return jsonify({"poi_list": [poi.poi_id for _, poi in found]})
+
+
 @APP.route("/poi-grid", methods=["POST"])
 def get_poi_list():
     """Takes in a cell ID as input, returns a list of associated POIs."""
@@ -248,17 +332,18 @@ def get_poi_list():
     signature = request.files.get("signature").read()
     message = (f"{cell_id}").encode("utf-8")
 
-    valid = SERVER.check_request_signature(
+    # only the subscriptions shown by the proof (None if it is invalid)
+    types = SERVER.check_request_signature(
         PUBLIC_KEY, message, types, signature
     )
 
-    if not valid:
+    if types is None:
         return "Invalid signature", 401
 
-    records = PoI.query.filter_by(grid_id=cell_id).all()
+    # only the PoIs of the disclosed types, from the per-type posting lists of the cell
+    poi_list = POI_INDEX.in_cell(cell_id, types)
 
-    if records:
-        poi_list = [record.to_dict()["poi_id"] for record in records]
+    if poi_list:
         poi_list_res = {"poi_list": poi_list}
 
     else:
@@ -279,9 +364,8 @@ def get_poi_info():
     poi_id = request.args.get('poi_id')
     noise_factor = 10
 
-    records = PoI.query.filter_by(poi_id=int(poi_id)).all()
-    if records:
-        poi_info = records[0].to_dict()
+    poi_info = POI_STORE.get(int(poi_id))
+    if poi_info is not None:
         poi_info["poi_ratings"] = json.loads(poi_info["poi_ratings"])
 
         random_length = random.randint(0, noise_factor)
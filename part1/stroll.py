@@ -4,9 +4,11 @@ Classes that you need to complete.
 
 from credential import generate_key
 
+import math
+
 import jsonpickle
 
-from typing import Any, Dict, List, Union, Tuple
+from typing import Any, Dict, List, Optional, Union, Tuple
 
 from keys import PublicKey, SecretKey
 
@@ -16,6 +18,12 @@ from petrelic.multiplicative.pairing import G1, G1Element
 from serialization import jsonpickle
 from service_provider import ServiceProvider
 
+from cache import ReplayCache, TTLCache
+
+from transcript import Transcript, disclosure_proof_digest
+
+from validation import MAX_DISCLOSURE_PROOF_BYTES, parse_disclosure_proof
+
 from user import User
 
 # Type aliases
@@ -46,16 +54,66 @@ def deserialize_object(serialized_object: bytes) -> Any:
     return jsonpickle.decode(serialized_object.decode('utf-8'))
 
 
+# Deserialized public keys by their serialization. The transcript prefixes of a
+# key are cached per key object (see transcript.py), so handing out the same
+# object for the same bytes is what makes them hit for callers that get the key
+# serialized on every call (such as Client.sign_request).
+_PUBLIC_KEYS: TTLCache = TTLCache(maxsize=16, ttl=math.inf)
+
+
+def restore_public_key(server_pk: bytes) -> PublicKey:
+    """ Deserialize a public key, the same object for the same bytes """
+
+    server_pk = bytes(server_pk)
+
+    pk = _PUBLIC_KEYS.get(server_pk)
+
+    if pk is None:
+
+        pk = deserialize_object(server_pk)
+
+        _PUBLIC_KEYS.put(server_pk, pk)
+
+    return pk
+
+
 class Server:
     """Server"""
 
     # public key
 
-    def __init__(self):
+    def __init__(self, cache_size: int = 4096, cache_ttl: float = 300.0):
         """
         Server constructor.
+
+        Args:
+            cache_size: maximum number of remembered verification results
+            cache_ttl: number of seconds a verification result is remembered
         """
 
+        # verdicts on recently verified disclosure proofs, so that replayed
+        # proofs don't cost any pairings
+        self.replay_cache: ReplayCache = ReplayCache(cache_size, cache_ttl)
+
+        # (proof digest, disclosed subscriptions) of recently checked requests, keyed by a
+        # digest of the raw (signature, message, types). Retried requests are
+        # answered before even deserializing anything; a retry of a valid proof
+        # still counts (and may be rejected) as a replay in the replay cache.
+        self.verification_cache: TTLCache = TTLCache(cache_size, cache_ttl)
+
+        # (serialized, deserialized) server public key, so that the key is
+        # only deserialized once and not on every request
+        self.public_key: Tuple[bytes, Optional[PublicKey]] = (b'', None)
+
+    def restore_public_key(self, server_pk: bytes) -> PublicKey:
+        """ Deserialize the server's public key (cached) """
+
+        if self.public_key[0] != server_pk:
+
+            self.public_key = (server_pk, restore_public_key(server_pk))
+
+        return self.public_key[1]
+
     @staticmethod
     def generate_ca(
         subscriptions: List[str]
@@ -108,8 +166,8 @@ class Server:
         """
 
         # Restore server_pk, server_sk, and issuance_request from
-        # bytes
-        server_pk_restored: PublicKey = deserialize_object(server_pk)
+        # bytes (the same public key object on every call)
+        server_pk_restored: PublicKey = self.restore_public_key(server_pk)
 
         server_sk_restored: SecretKey = deserialize_object(server_sk)
 
@@ -135,7 +193,7 @@ class Server:
         message: bytes,
         revealed_attributes: List[str],
         signature: bytes
-    ) -> bool:
+    ) -> Optional[List[str]]:
         """ Verify the signature on the location request
 
         Args:
@@ -145,20 +203,84 @@ class Server:
             signature: user's authorization (serialized)
 
         Returns:
-            whether a signature is valid
+            the subscriptions the request may be answered for (sorted), i.e. the
+            attributes disclosed by a valid proof, or None if the signature is
+            invalid. Requests whose revealed_attributes are not exactly the
+            disclosed attributes, or that disclose a subscription the credential
+            does not hold (value 0), are invalid.
         """
+        # oversized signatures are rejected before even hashing them
+        if len(signature) > MAX_DISCLOSURE_PROOF_BYTES:
+            return None
+
+        # the types are part of the cache key (and come straight from the request's JSON)
+        if not isinstance(revealed_attributes, list) or \
+                not all(isinstance(attribute, str) for attribute in revealed_attributes):
+            return None
+
+        # retries of the same request are answered from the cache
+        request_digest = Transcript(b'secretstroll/request').append(
+            signature, message, sorted(revealed_attributes)).digest()
+
+        cached = self.verification_cache.get(request_digest)
+
+        # whether the proof has been looked up in the replay cache already
+        looked_up = False
+
+        if cached is not None:
+
+            proof_digest, disclosed = cached
+
+            # invalid requests never made it to the replay cache
+            if proof_digest is None:
+                return None
+
+            verdict = self.replay_cache.lookup(proof_digest)
+
+            if verdict is not None:
+                return list(disclosed) if verdict else None
+
+            # otherwise the proof has expired from the replay cache and is verified again
+            looked_up = True
+
+        proof_digest = None
+
+        disclosed = None
+
+        granted = False
+
         # reconstruct the server pk from bytes
-        server_pk_reconstructed: PublicKey = deserialize_object(server_pk)
+        server_pk_reconstructed: PublicKey = self.restore_public_key(server_pk)
+
+        # deserialize the DisclosureProof; anything that is not exactly
+        # a well-formed disclosure proof is rejected without any pairing
+        disclosure_proof_reconstructed: DisclosureProof = parse_disclosure_proof(
+            server_pk_reconstructed, signature)
+
+        if disclosure_proof_reconstructed is not None:
+
+            disclosed_attributes = disclosure_proof_reconstructed[1]
+
+            # the request is only answered for what the proof actually shows
+            if sorted(disclosed_attributes) == sorted(set(revealed_attributes)) and \
+                    all(value == 1 for value in disclosed_attributes.values()):
 
-        # deserialize the DisclosureProof
-        disclosure_proof_reconstructed: DisclosureProof = deserialize_object(
-            signature)
+                disclosed = tuple(sorted(disclosed_attributes))
 
-        # create a service provider object
-        service_provider: ServiceProvider = ServiceProvider(
-            server_pk_reconstructed, None, revealed_attributes, 'ANON')
+                # create a service provider object
+                service_provider: ServiceProvider = ServiceProvider(
+                    server_pk_reconstructed, None, revealed_attributes, 'ANON',
+                    replay_cache=self.replay_cache)
 
-        return service_provider.verify_disclosure_proof(disclosure_proof_reconstructed, message)
+                granted = service_provider.verify_disclosure_proof(
+                    disclosure_proof_reconstructed, message, looked_up=looked_up)
+
+                proof_digest = disclosure_proof_digest(disclosure_proof_reconstructed, message)
+
+        # retries get the verdict from the replay cache, so that they count as replays
+        self.verification_cache.put(request_digest, (proof_digest, disclosed))
+
+        return list(disclosed) if granted else None
 
 
 class Client:
@@ -190,8 +312,8 @@ class Client:
                 You need to design the state yourself.
         """
 
-        # reconstruct the server pk from bytes
-        server_pk_reconstructed: PublicKey = deserialize_object(server_pk)
+        # reconstruct the server pk from bytes (the same object on every call)
+        server_pk_reconstructed: PublicKey = restore_public_key(server_pk)
 
         # Now we want to create an issuance request.
         # Firstly, we need to create a user object. To do this, we need
@@ -259,8 +381,8 @@ class Client:
             A message's signature (serialized)
         """
 
-        # reconstruct the server pk from bytes
-        server_pk_reconstructed: PublicKey = deserialize_object(server_pk)
+        # reconstruct the server pk from bytes (the same object on every call)
+        server_pk_reconstructed: PublicKey = restore_public_key(server_pk)
 
         # reconstruct the anonymous credential from bytes
         credentials_deserialized: AnonymousCredential = deserialize_object(
@@ -0,0 +1,168 @@
+"""
+Fiat-Shamir transcripts for the issuance and showing protocols.
+
+Instead of concatenating the str() representation of every group element into
+one large Python string, the challenge hash is computed by feeding canonical
+binary encodings of the public values into an incremental SHA-256 state.
+
+Everything that only depends on the issuer's public key (generators, Y_list,
+Y_snake_list) is absorbed once per key; every proof then starts from a
+`copy()` of that prefix state and only absorbs its own values.
+"""
+
+import hashlib
+
+import weakref
+
+from typing import Any
+
+from petrelic.bn import Bn
+
+from keys import PublicKey
+
+# Domain separation labels, so that an issuance challenge can never be
+# replayed as a disclosure challenge (and vice versa)
+ISSUANCE_LABEL = b'secretstroll/issuance'
+DISCLOSURE_LABEL = b'secretstroll/disclosure'
+REPLAY_LABEL = b'secretstroll/replay'
+
+# Prefix states, cached per public key object. Weak references make sure
+# we don't keep public keys alive that are not used anymore. Keys that arrive
+# serialized are deserialized through stroll.restore_public_key, which returns
+# the same object for the same bytes.
+_issuance_prefixes: 'weakref.WeakKeyDictionary[PublicKey, Transcript]' = weakref.WeakKeyDictionary()
+_disclosure_prefixes: 'weakref.WeakKeyDictionary[PublicKey, Transcript]' = weakref.WeakKeyDictionary()
+
+
+def encode(item: Any) -> bytes:
+    """ Canonical binary encoding of a value that is part of a transcript """
+
+    # group elements (G1, G2, GT)
+    if hasattr(item, 'to_binary'):
+
+        return item.to_binary()
+
+    if isinstance(item, Bn):
+
+        return (b'-' + (-item).binary()) if item < 0 else (b'+' + item.binary())
+
+    if isinstance(item, int):
+
+        magnitude = abs(item)
+
+        return (b'-' if item < 0 else b'+') + \
+            magnitude.to_bytes((magnitude.bit_length() + 7) // 8, 'big')
+
+    if isinstance(item, (bytes, bytearray)):
+
+        return bytes(item)
+
+    if isinstance(item, str):
+
+        return item.encode('utf-8')
+
+    raise TypeError(f'Cannot encode {type(item).__name__} in a transcript')
+
+
+class Transcript:
+
+    'Class for representing an incremental Fiat-Shamir transcript'
+
+    def __init__(self, label: bytes = b''):
+
+        self.state = hashlib.sha256()
+
+        if label:
+            self.append(label)
+
+    def append(self, *items: Any) -> 'Transcript':
+        """ Absorb values into the transcript
+
+        Every value is length-prefixed so that the encoding is unambiguous.
+        Lists and tuples are absorbed element-wise, prefixed with their length.
+        """
+
+        for item in items:
+
+            if isinstance(item, (list, tuple)):
+
+                self.state.update(len(item).to_bytes(4, 'big'))
+
+                self.append(*item)
+
+            else:
+
+                data = encode(item)
+
+                self.state.update(len(data).to_bytes(4, 'big'))
+
+                self.state.update(data)
+
+        return self
+
+    def copy(self) -> 'Transcript':
+        """ Fork the transcript (e.g. from a cached key-dependent prefix) """
+
+        forked = Transcript.__new__(Transcript)
+
+        forked.state = self.state.copy()
+
+        return forked
+
+    def digest(self) -> bytes:
+        """ The transcript's SHA-256 digest """
+
+        return self.state.digest()
+
+    def challenge(self) -> int:
+        """ The challenge, i.e. the transcript's digest as an integer """
+
+        return int.from_bytes(self.digest(), 'big')
+
+
+def hash_attribute(value: str) -> int:
+    """ Integer value of a string attribute (e.g. the username), for use in an exponent """
+
+    return int.from_bytes(hashlib.sha256(value.encode('utf-8')).digest(), 'big')
+
+
+def issuance_transcript(pk: PublicKey) -> Transcript:
+    """ Fresh transcript for the issuance proof, starting from the key prefix """
+
+    prefix = _issuance_prefixes.get(pk)
+
+    if prefix is None:
+
+        # the last element of Y_list corresponds to the username (issuer attribute)
+        prefix = Transcript(ISSUANCE_LABEL).append(pk.g, pk.Y_list[:-1])
+
+        _issuance_prefixes[pk] = prefix
+
+    return prefix.copy()
+
+
+def disclosure_transcript(pk: PublicKey) -> Transcript:
+    """ Fresh transcript for the disclosure proof, starting from the key prefix """
+
+    prefix = _disclosure_prefixes.get(pk)
+
+    if prefix is None:
+
+        prefix = Transcript(DISCLOSURE_LABEL).append(
+            pk.g_snake, pk.Y_snake_list)
+
+        _disclosure_prefixes[pk] = prefix
+
+    return prefix.copy()
+
+
+def disclosure_proof_digest(disclosure_proof: Any, message: bytes) -> bytes:
+    """ Digest identifying a (disclosure proof, message) pair, e.g. for replay detection """
+
+    sigma_prime, disclosed_attributes, proof = disclosure_proof
+
+    return Transcript(REPLAY_LABEL).append(
+        sigma_prime,
+        sorted(disclosed_attributes.items()),
+        proof,
+        message).digest()
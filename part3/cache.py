@@ -0,0 +1,138 @@
+"""
+Bounded caches used by the server.
+
+Verifying a disclosure proof costs a handful of pairings. Proofs (and requests)
+that have been seen before can be answered from memory in O(1) instead. All
+caches in here are bounded both in size (least recently used entries are
+evicted first) and in time (entries expire after `ttl` seconds), so memory
+stays constant even under a flood of replayed requests.
+"""
+
+import time
+
+from collections import OrderedDict
+
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class TTLCache:
+
+    'Class for representing a size-bounded LRU cache whose entries expire'
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 300.0,
+                 timer: Callable[[], float] = time.monotonic):
+
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+
+        self.maxsize: int = maxsize
+
+        self.ttl: float = ttl
+
+        self.timer = timer
+
+        # key -> (expiry time, value); ordered from least to most recently used
+        self.entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+
+        self.hits: int = 0
+
+        self.misses: int = 0
+
+    def _live_entry(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        """ The entry for `key` if present and not expired (expired entries are dropped) """
+
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[0] <= self.timer():
+
+            del self.entries[key]
+
+            return None
+
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Return the value stored for `key`, or `default` if absent or expired """
+
+        entry = self._live_entry(key)
+
+        if entry is None:
+
+            self.misses += 1
+
+            return default
+
+        self.hits += 1
+
+        self.entries.move_to_end(key)
+
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """ Store `value` for `key`, evicting the least recently used entry if full """
+
+        self.entries[key] = (self.timer() + self.ttl, value)
+
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+
+        return self._live_entry(key) is not None
+
+    def __len__(self) -> int:
+
+        return len(self.entries)
+
+    def clear(self) -> None:
+
+        self.entries.clear()
+
+
+class ReplayCache:
+
+    'Class for remembering the verdicts on recently verified disclosure proofs'
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 300.0,
+                 reject_replays: bool = False,
+                 timer: Callable[[], float] = time.monotonic):
+
+        # proof digest -> [verdict, number of times the proof has been replayed]
+        self.cache: TTLCache = TTLCache(maxsize, ttl, timer)
+
+        # If set, a replayed proof is always rejected (even if it was valid the
+        # first time). Otherwise, the previous verdict is returned.
+        self.reject_replays: bool = reject_replays
+
+        self.replays: int = 0
+
+    def lookup(self, digest: bytes) -> Optional[bool]:
+        """ Verdict for an already seen proof, None if the proof is new """
+
+        entry = self.cache.get(digest)
+
+        if entry is None:
+            return None
+
+        entry[1] += 1
+
+        self.replays += 1
+
+        if self.reject_replays:
+            return False
+
+        return entry[0]
+
+    def record(self, digest: bytes, verdict: bool) -> None:
+        """ Remember the verdict on a freshly verified proof """
+
+        self.cache.put(digest, [verdict, 0])
+
+    def replay_count(self, digest: bytes) -> int:
+        """ How many times a proof has been replayed (hook for rate limiting) """
+
+        entry = self.cache._live_entry(digest)
+
+        return 0 if entry is None else entry[1][1]
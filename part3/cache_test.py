@@ -0,0 +1,80 @@
+import pytest
+
+from cache import TTLCache, ReplayCache
+
+""" Test the bounded caches in cache.py """
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_evicts_least_recently_used() -> None:
+
+    cache = TTLCache(maxsize=2, ttl=10.0)
+
+    cache.put('a', 1)
+    cache.put('b', 2)
+
+    # touch 'a' so that 'b' becomes the least recently used entry
+    assert cache.get('a') == 1
+
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_ttl_cache_expires_entries() -> None:
+
+    timer = FakeTimer()
+
+    cache = TTLCache(maxsize=8, ttl=10.0, timer=timer)
+
+    cache.put('a', 1)
+
+    timer.now = 9.9
+    assert cache.get('a') == 1
+
+    timer.now = 10.0
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_counts_hits_and_misses() -> None:
+
+    cache = TTLCache(maxsize=8)
+
+    assert cache.get('a') is None
+
+    cache.put('a', False)
+
+    assert cache.get('a') == False
+    assert 'a' in cache
+
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_replay_cache() -> None:
+
+    replay_cache = ReplayCache(maxsize=8)
+
+    assert replay_cache.lookup(b'proof') is None
+
+    replay_cache.record(b'proof', True)
+
+    assert replay_cache.lookup(b'proof') == True
+    assert replay_cache.lookup(b'proof') == True
+    assert replay_cache.replay_count(b'proof') == 2
+
+    replay_cache.reject_replays = True
+
+    assert replay_cache.lookup(b'proof') == False
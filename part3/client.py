@@ -182,6 +182,77 @@ def main(args: List[str]) -> None:
     )
     parser_grid.set_defaults(callback=client_grid)
 
+    # Parsers for the radius and nearest neighbour queries
+    parser_radius = subparsers.add_parser(
+        "radius", help="Request the PoIs within a radius of a location."
+    )
+    parser_radius.add_argument(
+        "lat",
+        help="Latitude.",
+        type=float
+    )
+    parser_radius.add_argument(
+        "lon",
+        help="Longitude.",
+        type=float
+    )
+    parser_radius.add_argument(
+        "radius",
+        help="Radius in metres.",
+        type=float
+    )
+    parser_nearest = subparsers.add_parser(
+        "nearest", help="Request the k PoIs closest to a location."
+    )
+    parser_nearest.add_argument(
+        "lat",
+        help="Latitude.",
+        type=float
+    )
+    parser_nearest.add_argument(
+        "lon",
+        help="Longitude.",
+        type=float
+    )
+    parser_nearest.add_argument(
+        "k",
+        help="Number of PoIs.",
+        type=int
+    )
+
+    for parser_query in (parser_radius, parser_nearest):
+        parser_query.add_argument(
+            "-p",
+            "--pub",
+            help="Name of the file from which to read the public key.",
+            type=argparse.FileType("rb"),
+            default="key-client.pub"
+        )
+        parser_query.add_argument(
+            "-c",
+            "--credential",
+            help="Name of the file from which to read the attribute-based credential.",
+            type=argparse.FileType("rb"),
+            default="anon.cred"
+        )
+        parser_query.add_argument(
+            "-T",
+            "--types",
+            help="Types of services to request.",
+            type=str,
+            required=True,
+            action="append"
+        )
+        parser_query.add_argument(
+            "-t",
+            "--tor",
+            help="Use Tor to connect to the server.",
+            action="store_true"
+        )
+
+    parser_radius.set_defaults(callback=client_radius)
+    parser_nearest.set_defaults(callback=client_nearest)
+
     namespace = parser.parse_args(args)
 
     if "callback" in namespace:
@@ -409,5 +480,73 @@ def client_grid(args: argparse.Namespace) -> None:
         print(f'You are near "{poi["poi_name"]}".')
 
 
+def request_pois(args: argparse.Namespace, route: str, query: List[Tuple[str, str]]) -> None:
+    """Sign the comma-separated values of a query, send it to a PoI route and print
+    the PoIs found."""
+
+    try:
+        types = args.types
+        public_key = args.pub.read()
+        credential = args.credential.read()
+
+    finally:
+        args.pub.close()
+        args.credential.close()
+
+    client = Client()
+    message = ",".join(value for _, value in query).encode("utf-8")
+    signature = client.sign_request(public_key, credential, message, types)
+
+    host, proxy = get_conn_params(args.tor)
+
+    url = f"http://{host}/{route}"
+    files = dict(query)
+    files["types"] = json.dumps(types)
+    files["signature"] = signature
+
+    # Done in a proper way, we would use HTTPS instead of HTTP.
+    session = create_session(proxy)
+    res = session.post(url=url, files=files)
+
+    if res.status_code != 200:
+        raise ClientHTTPError(f"Invalid return code {res.status_code}!")
+
+    poi_ids = res.json()["poi_list"]
+
+    if not poi_ids:
+        print("Sigh... nothing interesting nearby.")
+
+    # No signature, etc... for retrieving the info about the PoIs themselves.
+    for poi_id in poi_ids:
+        url = f"http://{host}/poi"
+        params = {"poi_id": poi_id}
+        res = session.get(url=url, params=params)
+        if res.status_code != 200:
+            raise ClientHTTPError(f"Invalid return code {res.status_code}!")
+
+        poi = res.json()
+        print(f'You are near "{poi["poi_name"]}".')
+
+
+def client_radius(args: argparse.Namespace) -> None:
+    """Handle `radius` subcommand (signed message "{lat},{lon},{radius}")."""
+
+    request_pois(args, "poi-radius", [
+        ("lat", str(args.lat)),
+        ("lon", str(args.lon)),
+        ("radius", str(args.radius)),
+    ])
+
+
+def client_nearest(args: argparse.Namespace) -> None:
+    """Handle `nearest` subcommand (signed message "{lat},{lon},{k}")."""
+
+    request_pois(args, "poi-nearest", [
+        ("lat", str(args.lat)),
+        ("lon", str(args.lon)),
+        ("k", str(args.k)),
+    ])
+
+
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,398 @@
+"""
+Parallel trace collection.
+
+Queries that go through the same Tor client are multiplexed over the same TLS
+connections to the guard relays, so their packets cannot be told apart on the
+wire. To run several queries concurrently, every worker gets its own Tor
+instance (own SOCKS port, own data directory, hence own guard connections).
+A single tshark then captures the traffic of all workers, and every packet is
+attributed to the query of the worker whose Tor process owns the local TCP
+port of the packet.
+
+Collection runs are driven by a manifest of (cell, run) tasks. Every completed
+record is appended to a JSON Lines file right away, and tasks that already
+have a record there are skipped, so that a crashed run can simply be restarted.
+"""
+
+import json
+
+import os
+
+import subprocess
+
+import threading
+
+import time
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from grid import DEFAULT_GRID
+
+from pcap import LiveCapture, TraceAccumulator
+
+# SOCKS ports of the per-worker Tor instances are TOR_SOCKS_PORT_BASE + worker
+TOR_SOCKS_PORT_BASE = 9060
+
+# client.py has the SOCKS proxy hard-coded; run it with the worker's proxy instead
+CLIENT_WITH_PROXY = 'import sys, client; client.TOR_PROXY = sys.argv[1]; client.main(sys.argv[2:])'
+
+
+def socket_inodes(pid: int) -> Set[int]:
+    """ Inodes of the sockets opened by a process """
+
+    inodes = set()
+
+    fd_path = f'/proc/{pid}/fd'
+
+    try:
+        fds = os.listdir(fd_path)
+
+    except OSError:
+        return inodes
+
+    for fd in fds:
+
+        try:
+            target = os.readlink(os.path.join(fd_path, fd))
+
+        except OSError:
+            continue
+
+        if target.startswith('socket:['):
+            inodes.add(int(target[8:-1]))
+
+    return inodes
+
+
+def local_ports(pids: Dict[int, int]) -> Dict[int, int]:
+    """ Map the local TCP ports of the given processes to their owners
+
+    Args:
+        pids: owner -> process id
+    Returns:
+        local port -> owner
+    """
+
+    owners = {}
+
+    for owner, pid in pids.items():
+
+        for inode in socket_inodes(pid):
+            owners[inode] = owner
+
+    ports = {}
+
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+
+        try:
+            with open(table) as f:
+                lines = f.readlines()[1:]
+
+        except OSError:
+            continue
+
+        for line in lines:
+
+            fields = line.split()
+
+            inode = int(fields[9])
+
+            if inode in owners:
+                ports[int(fields[1].rsplit(':', 1)[1], 16)] = owners[inode]
+
+    return ports
+
+
+class TorInstance:
+
+    'Class for representing a Tor client dedicated to one collection worker'
+
+    def __init__(self, worker: int, data_directory: str):
+
+        self.socks_port: int = TOR_SOCKS_PORT_BASE + worker
+
+        self.data_directory: str = data_directory
+
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def proxy(self) -> str:
+
+        return f'socks5h://localhost:{self.socks_port}'
+
+    def start(self) -> 'TorInstance':
+        """ Start Tor and wait until it has bootstrapped """
+
+        os.makedirs(self.data_directory, mode=0o700, exist_ok=True)
+
+        self.process = subprocess.Popen(
+            ['tor', '--SocksPort', str(self.socks_port),
+             '--DataDirectory', self.data_directory,
+             '--Log', 'notice stdout'],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, close_fds=True)
+
+        for line in self.process.stdout:
+
+            if 'Bootstrapped 100%' in line:
+
+                # keep draining the log so that tor never blocks on a full pipe
+                threading.Thread(target=self.process.stdout.read,
+                                 daemon=True).start()
+
+                return self
+
+        raise RuntimeError(
+            f'Tor on port {self.socks_port} exited before bootstrapping')
+
+    def stop(self) -> None:
+
+        if self.process is not None and self.process.poll() is None:
+
+            self.process.terminate()
+
+            self.process.wait()
+
+
+class FlowCapture(LiveCapture):
+
+    'Class for capturing the traces of several concurrent workers with one tshark'
+
+    FIELDS = LiveCapture.FIELDS + ('tcp.srcport', 'tcp.dstport')
+
+    # don't rescan /proc more often than this when seeing packets of unknown ports
+    REFRESH_INTERVAL = 0.5
+
+    # longest wait for tshark to print the last packets of a query (see end())
+    FLUSH_TIMEOUT = 2.0
+
+    def __init__(self, host_ip: str, tor_instances: Dict[int, TorInstance], interface: str = 'eth0',
+                 keep_packets: bool = False, flush_timeout: float = FLUSH_TIMEOUT):
+
+        super().__init__(host_ip, interface, keep_packets=keep_packets)
+
+        self.flush_timeout: float = flush_timeout
+
+        self.pids: Dict[int, int] = {
+            worker: tor.process.pid for worker, tor in tor_instances.items()}
+
+        # worker -> accumulator of the query the worker is currently running
+        self.active: Dict[int, TraceAccumulator] = {}
+
+        # local port -> worker (ports of the workers' Tor instances at the last refresh)
+        self.port_owners: Dict[int, Optional[int]] = {}
+
+        self.last_refresh: float = 0.0
+
+        # capture time of the latest packet tshark has printed
+        self.latest: float = 0.0
+
+        self.lock = threading.Lock()
+
+        # notified whenever the capture advances
+        self.progress = threading.Condition(self.lock)
+
+    def owner(self, port: int) -> Optional[int]:
+        """ The worker whose Tor instance uses the local port """
+
+        owner = self.port_owners.get(port)
+
+        # unknown ports are looked up again once the refresh interval has passed: a
+        # port can show up in packets before it shows up in /proc/net/tcp
+        if owner is None and time.monotonic() - self.last_refresh > self.REFRESH_INTERVAL:
+
+            self.port_owners = local_ports(self.pids)
+
+            self.last_refresh = time.monotonic()
+
+            owner = self.port_owners.get(port)
+
+        return owner
+
+    def add_line(self, line: str) -> None:
+
+        fields = line.rstrip('\n').split('\t')
+
+        try:
+            timestamp = float(fields[0])
+
+        except ValueError:
+            return
+
+        worker = None
+
+        # packets without ports (not TCP) only advance the capture
+        if len(fields) >= 5 and fields[3]:
+
+            try:
+                length = int(fields[1])
+                src_port = int(fields[3].split(',')[0])
+                dst_port = int(fields[4].split(',')[0])
+
+            except ValueError:
+                return
+
+            outgoing = fields[2].split(',')[0] == self.host_ip
+
+            worker = self.owner(src_port if outgoing else dst_port)
+
+        with self.lock:
+
+            accumulator = self.active.get(worker) if worker is not None else None
+
+            if accumulator is not None:
+                accumulator.add(timestamp, length, outgoing)
+
+            self.latest = max(self.latest, timestamp)
+
+            self.progress.notify_all()
+
+    def begin(self, worker: int) -> None:
+        """ Start attributing the worker's packets to a new trace """
+
+        with self.lock:
+            self.active[worker] = TraceAccumulator(self.keep_packets)
+
+    def end(self, worker: int, until: Optional[float] = None) -> TraceAccumulator:
+        """ Stop attributing the worker's packets, return the accumulator of its trace
+
+        Packets arrive in capture order, so once tshark has printed a packet
+        captured at or after `until` (default: now), all packets of the query
+        have been read. Without further traffic, this waits flush_timeout.
+        """
+
+        if until is None:
+            until = time.time()
+
+        with self.progress:
+
+            # nothing is printed anymore once the capture has stopped
+            if self.reader is not None and self.reader.is_alive():
+                self.progress.wait_for(lambda: self.latest >= until, self.flush_timeout)
+
+            return self.active.pop(worker)
+
+
+def query_command(cell_id: int, proxy: Optional[str] = None, by_location: bool = False) -> List[str]:
+    """ Command line of a query for the PoIs of a cell, through the given Tor SOCKS proxy
+
+    With by_location, the cell is queried by the location of its center (/poi-loc)
+    instead of by its id (/poi-grid).
+    """
+
+    if by_location:
+        lat, lon = DEFAULT_GRID.center(cell_id)
+        query = ['loc', str(lat), str(lon), '-T', 'restaurant', '-t']
+
+    else:
+        query = ['grid', str(cell_id), '-T', 'restaurant', '-t']
+
+    if proxy is None:
+        return ['python3', 'client.py'] + query
+
+    return ['python3', '-c', CLIENT_WITH_PROXY, proxy] + query
+
+
+# (cell id, run)
+Task = Tuple[int, int]
+
+
+def make_manifest(first_cell: int, last_cell: int, runs: int) -> List[Task]:
+    """ All (cell, run) tasks for the cells first_cell, ..., last_cell """
+
+    return [(cell, run) for cell in range(first_cell, last_cell + 1) for run in range(runs)]
+
+
+def read_manifest(path: str) -> List[Task]:
+    """ Tasks from a JSON Lines manifest ({"cell": 1, "run": 0} per line) """
+
+    tasks = []
+
+    with open(path) as f:
+
+        for line in f:
+
+            if line.strip():
+
+                task = json.loads(line)
+
+                tasks.append((int(task['cell']), int(task['run'])))
+
+    return tasks
+
+
+def read_records(path: str) -> Iterable[Dict[str, Any]]:
+    """ Records of a JSON Lines results file
+
+    A partially written last line (e.g. after a crash) is ignored.
+    """
+
+    if not os.path.exists(path):
+        return
+
+    with open(path) as f:
+
+        for line in f:
+
+            try:
+                yield json.loads(line)
+
+            except ValueError:
+                continue
+
+
+def completed_tasks(path: str) -> Set[Task]:
+    """ Tasks that already have a record in the results file """
+
+    return {(int(record['cell']), int(record['run'])) for record in read_records(path)}
+
+
+class ResultsWriter:
+
+    'Class for appending records to a JSON Lines results file as soon as they are complete'
+
+    def __init__(self, path: str):
+
+        self.path: str = path
+
+        self.lock = threading.Lock()
+
+        # a record that was cut off by a crash must not swallow the next one
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+
+            with open(path, 'rb') as f:
+
+                f.seek(-1, os.SEEK_END)
+
+                needs_newline = f.read(1) != b'\n'
+
+            if needs_newline:
+
+                with open(path, 'a') as f:
+                    f.write('\n')
+
+        self.file = open(path, 'a')
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """ Append one record and make sure it is on disk """
+
+        line = json.dumps(record) + '\n'
+
+        with self.lock:
+
+            self.file.write(line)
+
+            self.file.flush()
+
+            os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+
+        self.file.close()
+
+    def __enter__(self) -> 'ResultsWriter':
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+
+        self.close()
@@ -27,6 +27,8 @@ import hashlib
 
 from keys import SecretKey, PublicKey
 
+from petrelic.bn import Bn
+
 from petrelic.multiplicative.pairing import G1, G2, G1Element
 
 # Type hint aliases
@@ -97,23 +99,69 @@ def generate_key(
     return (pk, sk)
 
 
+def sign_exponent(
+    sk: SecretKey,
+    msgs: List[int]
+) -> Bn:
+    """ Compute x + sum(m_i * y_i) mod p
+
+    All factors h^x, h^(m_1*y_1), ... , h^(m_L*y_L) of a signature share the
+    base h, so their product is h raised to the sum of the exponents.
+    """
+    p = G1.order()
+
+    exponent = sk.x
+
+    for i in range(len(msgs)):
+        exponent = (exponent + msgs[i] * sk.y_list[i]) % p
+
+    return exponent
+
+
+def _random_base_signature(exponent: Bn) -> Signature:
+    """ (h, h^exponent) for a fresh random h = g^r (r != 0, so h != 1)
+
+    h^exponent is computed as g^(r * exponent), i.e. both elements are powers
+    of the fixed generator g.
+    """
+    p = G1.order()
+
+    g = G1.generator()
+
+    r = p.random()
+
+    while r == 0:
+        r = p.random()
+
+    return (g ** r, g ** ((r * exponent) % p))
+
+
 def sign(
     sk: SecretKey,
     msgs: List[int]
 ) -> Signature:
-    """ Sign the vector of messages `msgs` """
-    p = G1.order()
-    h = G1.generator()
+    """ Sign the vector of messages `msgs`
 
-    while (h == G1.neutral_element()):
-        h = G1.generator()
+    Two exponentiations are performed, independently of len(msgs).
+    """
 
-    prod_ = h ** sk.x
+    return _random_base_signature(sign_exponent(sk, msgs))
 
-    for i in range(len(msgs)):
-        prod_ = prod_ * (h ** (msgs[i]*sk.y_list[i]))
 
-    return (h, prod_)
+def sign_many(
+    sk: SecretKey,
+    msgs_list: List[List[int]]
+) -> List[Signature]:
+    """ Sign many vectors of messages
+
+    Equivalent to [sign(sk, msgs) for msgs in msgs_list]. Every signature gets
+    its own random h: signatures sharing h could be combined into signatures
+    on messages that were never signed. Only the exponents are batched.
+    """
+
+    exponents = [sign_exponent(sk, msgs) for msgs in msgs_list]
+
+    return [_random_base_signature(exponent) for exponent in exponents]
 
 
 def verify(
@@ -0,0 +1,284 @@
+"""
+Columnar on-disk format for trace datasets.
+
+A dataset is a directory containing
+    * features.npy: float32 matrix, one row per trace, one column per feature
+    * labels.npy:   int32 vector, the queried cell of every trace
+    * schema.json:  format version, feature names, dtypes and number of traces
+
+`.npy` files can be memory-mapped, so loading even a large dataset is near
+instant and the classifier gets contiguous NumPy arrays without any detour
+through pandas or Python lists.
+
+The dataset can be built from the JSON Lines files written by experiment.py,
+as well as from the legacy capinfos-style `results_*.json` files and pickled
+DataFrames (replacing the merging and cleaning steps of data_prep.ipynb):
+
+    python3 dataset.py results/results_*.json -o dataset
+
+Records collected with `experiment.py --sequences` carry their packet
+sequence; `--kfp` adds the k-fingerprinting features of features.py for them.
+"""
+
+import argparse
+
+import json
+
+import os
+
+import sys
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from features import KFP_FEATURE_NAMES, PacketSequences, extract_batch
+
+SCHEMA_VERSION = 1
+
+LABEL = 'cell'
+
+FEATURES_DTYPE = np.float32
+
+LABELS_DTYPE = np.int32
+
+DIRECTIONS = ('overall', 'incoming', 'outgoing')
+
+STATISTICS = ('number_of_packets', 'data_byte_rate', 'data_bit_rate',
+              'avg_packet_size', 'avg_packet_rate')
+
+# The features of data_2604.pkl (produced by data_prep.ipynb)
+FEATURE_NAMES = [f'{direction}_{statistic}' for statistic in STATISTICS for direction in DIRECTIONS] + \
+    ['outgoing_packets_fraction', 'incoming_packets_fraction']
+
+# capinfos key of each statistic in the legacy results files
+LEGACY_KEYS = {
+    'number_of_packets': 'Number of packets',
+    'data_byte_rate': 'Data byte rate',
+    'data_bit_rate': 'Data bit rate',
+    'avg_packet_size': 'Average packet size',
+    'avg_packet_rate': 'Average packet rate',
+}
+
+
+def derive_features(record: Dict[str, Any]) -> Dict[str, Any]:
+    """ Add the features that are computed from the collected statistics """
+
+    overall = record.get('overall_number_of_packets')
+
+    if overall:
+
+        record['outgoing_packets_fraction'] = record['outgoing_number_of_packets'] / overall
+
+        record['incoming_packets_fraction'] = record['incoming_number_of_packets'] / overall
+
+    return record
+
+
+def add_kfp_features(records: List[Dict[str, Any]]) -> None:
+    """ Add the k-fingerprinting features to the records that carry a packet sequence
+
+    The features of all sequences are extracted in one batch.
+    """
+
+    with_sequences = [record for record in records if 'timestamps' in record]
+
+    features = extract_batch(PacketSequences.from_records(with_sequences))
+
+    for record, row in zip(with_sequences, features.tolist()):
+        record.update(zip(KFP_FEATURE_NAMES, row))
+
+
+def from_legacy_record(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """ Convert a record with capinfos strings ('1234.56 bytes/sec') to numbers
+
+    Returns None if a statistic is missing or not a number (these rows were
+    dropped by data_prep.ipynb as well).
+    """
+
+    converted = {LABEL: int(record[LABEL])}
+
+    for direction in DIRECTIONS:
+
+        for statistic, key in LEGACY_KEYS.items():
+
+            value = record.get(f'{direction}_{key}')
+
+            if value is None:
+                return None
+
+            try:
+                converted[f'{direction}_{statistic}'] = float(
+                    str(value).split()[0])
+
+            except (ValueError, IndexError):
+                return None
+
+    return converted
+
+
+def records_to_arrays(records: Iterable[Dict[str, Any]],
+                      feature_names: List[str] = FEATURE_NAMES) -> Tuple[np.ndarray, np.ndarray]:
+    """ Feature matrix and label vector of a collection of records
+
+    Records lacking any of the features are skipped.
+    """
+
+    rows = []
+
+    labels = []
+
+    records = [derive_features(dict(record)) for record in records]
+
+    if set(KFP_FEATURE_NAMES) & set(feature_names):
+        add_kfp_features(records)
+
+    for record in records:
+
+        try:
+            row = [float(record[name]) for name in feature_names]
+
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if any(np.isnan(row)):
+            continue
+
+        rows.append(row)
+
+        labels.append(int(record[LABEL]))
+
+    features = np.array(rows, dtype=FEATURES_DTYPE).reshape(
+        len(rows), len(feature_names))
+
+    return features, np.array(labels, dtype=LABELS_DTYPE)
+
+
+def write_dataset(path: str, features: np.ndarray, labels: np.ndarray,
+                  feature_names: List[str] = FEATURE_NAMES) -> None:
+    """ Write a dataset directory """
+
+    if features.shape != (len(labels), len(feature_names)):
+        raise ValueError(
+            f'features of shape {features.shape} do not match {len(labels)} labels and {len(feature_names)} features')
+
+    os.makedirs(path, exist_ok=True)
+
+    np.save(os.path.join(path, 'features.npy'),
+            np.ascontiguousarray(features, dtype=FEATURES_DTYPE))
+
+    np.save(os.path.join(path, 'labels.npy'),
+            np.ascontiguousarray(labels, dtype=LABELS_DTYPE))
+
+    schema = {
+        'version': SCHEMA_VERSION,
+        'label': LABEL,
+        'feature_names': list(feature_names),
+        'features_dtype': np.dtype(FEATURES_DTYPE).name,
+        'labels_dtype': np.dtype(LABELS_DTYPE).name,
+        'num_traces': int(len(labels)),
+    }
+
+    # the schema is written last, so a dataset with a schema is complete
+    with open(os.path.join(path, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent=2)
+
+
+def read_schema(path: str) -> Dict[str, Any]:
+
+    with open(os.path.join(path, 'schema.json')) as f:
+        schema = json.load(f)
+
+    if schema.get('version') != SCHEMA_VERSION:
+        raise ValueError(
+            f'Unsupported dataset version {schema.get("version")} in {path}')
+
+    return schema
+
+
+def load_dataset(path: str, mmap: bool = True) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """ Load a dataset directory
+
+    Args:
+        path: the dataset directory
+        mmap: memory-map the arrays instead of reading them into memory
+    Returns:
+        features (num_traces x num_features float32), labels (int32), feature names
+    """
+
+    schema = read_schema(path)
+
+    mmap_mode = 'r' if mmap else None
+
+    features = np.load(os.path.join(path, 'features.npy'), mmap_mode=mmap_mode)
+
+    labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode=mmap_mode)
+
+    if features.shape != (schema['num_traces'], len(schema['feature_names'])) or len(labels) != schema['num_traces']:
+        raise ValueError(f'Dataset in {path} does not match its schema')
+
+    return features, labels, schema['feature_names']
+
+
+def read_records(path: str) -> List[Dict[str, Any]]:
+    """ Records of a results file of any of the supported formats """
+
+    if path.endswith('.jsonl'):
+
+        # the reader of the collection also copes with a cut-off last line
+        from collection import read_records as read_jsonl
+
+        return list(read_jsonl(path))
+
+    if path.endswith('.pkl'):
+
+        import pandas as pd
+
+        return pd.read_pickle(path).to_dict('records')
+
+    with open(path) as f:
+        records = json.load(f)
+
+    # legacy capinfos-style results
+    return [converted for converted in map(from_legacy_record, records) if converted is not None]
+
+
+def main(args: List[str]) -> None:
+
+    parser = argparse.ArgumentParser(
+        description="Build a columnar trace dataset from results files.")
+    parser.add_argument(
+        "results",
+        help="Results files (.jsonl from experiment.py, legacy .json, or pickled DataFrames .pkl).",
+        nargs="+"
+    )
+    parser.add_argument(
+        "-o",
+        "--out",
+        help="Dataset directory to write.",
+        default="dataset",
+        type=str
+    )
+    parser.add_argument(
+        "--kfp",
+        help="Add the k-fingerprinting features (records without packet sequences are dropped).",
+        action="store_true"
+    )
+    namespace = parser.parse_args(args)
+
+    records = []
+
+    for path in namespace.results:
+        records.extend(read_records(path))
+
+    feature_names = FEATURE_NAMES + KFP_FEATURE_NAMES if namespace.kfp else FEATURE_NAMES
+
+    features, labels = records_to_arrays(records, feature_names)
+
+    write_dataset(namespace.out, features, labels, feature_names)
+
+    print(f'Wrote {len(labels)} traces ({len(records) - len(labels)} incomplete records dropped) to {namespace.out}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,91 @@
+import pytest
+
+import json
+
+import numpy as np
+
+from dataset import (FEATURE_NAMES, KFP_FEATURE_NAMES, from_legacy_record, load_dataset, read_records,
+                     records_to_arrays, write_dataset)
+
+""" Test the columnar trace dataset format in dataset.py """
+
+
+def make_record(cell: int, run: int) -> dict:
+
+    record = {'cell': cell, 'run': run}
+
+    for direction in ('overall', 'incoming', 'outgoing'):
+
+        for statistic in ('number_of_packets', 'data_byte_rate', 'data_bit_rate',
+                          'avg_packet_size', 'avg_packet_rate', 'data_size', 'capture_duration'):
+
+            record[f'{direction}_{statistic}'] = float(cell + run + 1)
+
+    return record
+
+
+def test_dataset_roundtrip(tmp_path) -> None:
+
+    records = [make_record(cell, run) for cell in range(1, 4) for run in range(5)]
+
+    # incomplete records are dropped
+    records.append({'cell': 4, 'run': 0})
+
+    features, labels = records_to_arrays(records)
+
+    assert features.shape == (15, len(FEATURE_NAMES))
+    assert features.dtype == np.float32
+    assert labels.dtype == np.int32
+
+    write_dataset(str(tmp_path), features, labels)
+
+    loaded_features, loaded_labels, feature_names = load_dataset(str(tmp_path))
+
+    assert isinstance(loaded_features, np.memmap)
+    assert feature_names == FEATURE_NAMES
+    assert np.array_equal(loaded_features, features)
+    assert np.array_equal(loaded_labels, labels)
+
+    # the derived fractions are computed on the fly
+    assert loaded_features[0, FEATURE_NAMES.index('outgoing_packets_fraction')] == pytest.approx(1.0)
+
+
+def test_legacy_results(tmp_path) -> None:
+
+    legacy = {'cell': '7'}
+
+    for direction in ('overall', 'incoming', 'outgoing'):
+        legacy.update({
+            f'{direction}_Number of packets': '42',
+            f'{direction}_Data byte rate': '1234.50 bytes/sec',
+            f'{direction}_Data bit rate': '9876.00 bits/sec',
+            f'{direction}_Average packet size': '120.25 bytes',
+            f'{direction}_Average packet rate': '3.50 packets/sec',
+        })
+
+    converted = from_legacy_record(legacy)
+
+    assert converted['cell'] == 7
+    assert converted['overall_data_byte_rate'] == pytest.approx(1234.5)
+    assert converted['incoming_avg_packet_size'] == pytest.approx(120.25)
+
+    assert from_legacy_record({'cell': '7', 'overall_Number of packets': 'n/a'}) is None
+
+    path = tmp_path / 'results_1_20.json'
+
+    path.write_text(json.dumps([legacy, {'cell': '8'}]))
+
+    assert len(read_records(str(path))) == 1
+
+
+def test_kfp_features_of_sequence_records() -> None:
+
+    record = make_record(1, 0)
+
+    record.update({'timestamps': [0.0, 0.5, 1.0], 'sizes': [100, 500, 500], 'directions': [1, -1, -1]})
+
+    features, labels = records_to_arrays([record, make_record(2, 0)], FEATURE_NAMES + KFP_FEATURE_NAMES)
+
+    # the record without a packet sequence is dropped
+    assert features.shape == (1, len(FEATURE_NAMES) + len(KFP_FEATURE_NAMES))
+    assert features[0, len(FEATURE_NAMES)] == 3
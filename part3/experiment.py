@@ -1,10 +1,15 @@
-from ipaddress import ip_address
 import socket
 import subprocess
-import re
 import os
-import signal
-import json
+
+import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pcap import DIRECTIONS, LiveCapture
+from collection import (FlowCapture, ResultsWriter, TorInstance, completed_tasks,
+                        make_manifest, query_command, read_manifest)
 
 '''
 IMPORTANT NOTE-s!!!!!!!
@@ -32,26 +37,93 @@ https://www.linuxquestions.org/questions/linux-networking-3/tshark-gives-permiss
 
 '''
 CURRENT PLAN:
-- for each query (e.g. one request for POIs in one of the 100 grid cells 1-100), record a pcap and store that + the same data separated in to
-  incoming and outgoing.
-- I.e., for run 0, cell 1 we will store:
-    * capture/cell_1/traffic_cell1_run0.pcap,
-    * capture/cell_1/traffic_cell1_run0_incoming.pcap,
-    * capture/cell_1/traffic_cell1_run0_outgoing.pcap
-- But also, compute statistics using wireshark's capinfos utility, because we will need meta-data for the 100 different queries in order to be
-    able to fingerprint the different queries.
-- I.e., we will get a jsonarray with individual queries as datapoints, their meta-data as features. Ideally, we can use that already to run the
+- for each query (e.g. one request for POIs in one of the 100 grid cells 1-100), compute statistics on the traffic while it is
+    being captured (see pcap.py; used to be wireshark's capinfos utility on pcap files), for all packets and for incoming and
+    outgoing packets separately, because we will need meta-data for the 100 different queries in order to be able to
+    fingerprint the different queries.
+- Nothing is written to disk per query, unless --keep-pcap is given. Then, for run 0, cell 1 we will store:
+    * capture/cell_1/traffic_cell1_run0.pcap
+- With --parallel N, N queries run at the same time, each through its own Tor instance; packets are attributed to
+    queries by the local ports of the Tor instances (see collection.py). --keep-pcap is not available then.
+- I.e., we will get a JSON Lines file with individual queries as datapoints, their meta-data as features. Ideally, we can use that already to run the
     classifier.
+- Every record is appended to the results file as soon as its query is done. The (cell, run) tasks come from --cells/--runs or from
+    a --manifest file; tasks that already have a record in the results file are skipped, so a crashed run can simply be restarted.
 - If we need to change that plan, fall back to the pcap files.
 '''
 
 
+parser = argparse.ArgumentParser(description="Collect traces of grid queries.")
+parser.add_argument(
+    "--keep-pcap",
+    help="Also write a pcap file per query (to capture/cell_i/).",
+    action="store_true"
+)
+parser.add_argument(
+    "-i",
+    "--interface",
+    help="Interface to capture on.",
+    default="eth0",
+    type=str
+)
+parser.add_argument(
+    "-P",
+    "--parallel",
+    help="Number of queries to run concurrently (each one through its own Tor instance).",
+    default=1,
+    type=int
+)
+parser.add_argument(
+    "--cells",
+    help="First and last cell to query (default: 1 100).",
+    nargs=2,
+    default=[1, 100],
+    type=int
+)
+parser.add_argument(
+    "--runs",
+    help="Number of runs per cell.",
+    default=100,
+    type=int
+)
+parser.add_argument(
+    "--manifest",
+    help="JSON Lines file of the (cell, run) tasks to collect ({\"cell\": 1, \"run\": 0} per line); overrides --cells/--runs.",
+    type=str
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    help="JSON Lines file the records are appended to.",
+    default="results.jsonl",
+    type=str
+)
+parser.add_argument(
+    "--by-location",
+    help="Query the cells by the location of their center (client.py loc) instead of by their id (client.py grid).",
+    action="store_true"
+)
+parser.add_argument(
+    "--sequences",
+    help="Also store the packet sequence (timestamps, sizes, directions) of every trace in its record, for the k-fingerprinting features of features.py.",
+    action="store_true"
+)
+parser.add_argument(
+    "--dataset",
+    help="Also write all records of the results file to this dataset directory at the end (requires numpy, see dataset.py).",
+    type=str
+)
+args = parser.parse_args()
+
+if args.parallel > 1 and args.keep_pcap:
+    parser.error("--keep-pcap can only be used with --parallel 1")
+
 # Create directories for storing pcap files (if it doesn't alredy exist)
 curr_dir = os.path.abspath(os.path.dirname(__file__))
 
 capture_path = os.path.join(curr_dir, 'capture')
 
-if not os.path.exists(capture_path):
+if args.keep_pcap and not os.path.exists(capture_path):
 
     os.makedirs(capture_path)
 
@@ -61,192 +133,154 @@ h_name = socket.gethostname()
 ip_address = socket.gethostbyname(h_name)
 print(f'Host IP Address: {ip_address}')
 
-# below function is for getting the output of capinfos (tshark utility for computing statistics of a pcap file) as dict
-# For info about capinfos please refer to https://www.wireshark.org/docs/man-pages/capinfos.html
-# Code of below function is from https://gist.github.com/pocc/2c89dd92d6a64abca3db2a29a11f1404
-# I don't really understand it, but it seems to do the job
-
-
-def get_capinfos(filenames):
-    """Get a dict from a packet using Wireshark's capinfos.
-        Args:
-            filenames (list): List of full filepaths to get info for
-        Returns:
-            (dict) of info about files
-                {
-                    "/path/to/file1": {"key": "value", ...},
-                    ...
-                }
-        """
-    cmd_list = ["capinfos", "-M"] + filenames
 
-    try:
-        output = subprocess.check_output(cmd_list).decode('utf-8')
+def unnest(cell_id, run, accumulator):
+    """ Un-nest data dict so it will be easier to process later on when we will most likely transform it into a numpy array or something """
 
-    except:
-        print('pcap file damaged!')
+    unnested_data_dict = {'cell': cell_id, 'run': run}
 
-        # Try to repair damaged file
+    statistics = accumulator.statistics()
 
-        cmd_list_ = ["pcapfix", "-d"] + filenames
+    for direction in DIRECTIONS:
 
-        ex1 = subprocess.Popen(
-            cmd_list_, close_fds=True
-        ).wait()
+        for key, value in statistics[direction].items():
 
-        if ex1 < 0:
+            unnested_data_dict.update({direction + '_' + key: value})
 
-            print('Repair of pcap unsuccessful!')
+    if args.sequences:
+        unnested_data_dict.update(accumulator.packets())
 
-            return dict()
+    return unnested_data_dict
 
-        else:
 
-            try:
+def collect_sequential(i, j):
+    """ Query cell i (run j) through the system's Tor, capturing everything on the interface """
 
-                # filenames is a list for some reason atm, but it only has one element
-                # according to documentation of pcapfix, the output file will be 'input file prepended by "fixed_".'
-                fixed_filename = "fixed_" + filenames[0]
+    overall_capture_path = None
 
-                cmd_list__ = ["capinfos", "-M"] + [fixed_filename]
+    if args.keep_pcap:
 
-                output = subprocess.check_output(cmd_list__).decode('utf-8')
+        cell_capture_path = os.path.join(capture_path, f'cell_{i}')
 
-            except:
+        os.makedirs(cell_capture_path, exist_ok=True)
 
-                print(
-                    'Error occurred when attempting to calculate infos on repaired file!')
+        overall_capture_path = os.path.join(
+            cell_capture_path, f'traffic_cell{i}_run{j}.pcap')
 
-                return dict()
+    # Start recording; statistics for all packets as well as for incoming (ip.src != own_ip) and
+    # outgoing (ip.src == own_ip) packets are updated while the packets come in
+    capture = LiveCapture(ip_address, args.interface,
+                          overall_capture_path, args.sequences).start()
 
-    data = re.findall(r'(.+?):\s*([\s\S]+?)(?=\n[\S]|$)', output)
-    infos_dict = {i[0]: i[1] for i in data}
-    for key in infos_dict:
-        if 'Interface #' in key:
-            iface_infos = re.findall(r'\s*(.+?) = (.+)\n', infos_dict[key])
-            infos_dict[key] = {i[0]: i[1] for i in iface_infos}
+    # Make query
+    subprocess.Popen(query_command(i, by_location=args.by_location), close_fds=True).wait()
 
-    return infos_dict
+    # Stop the recording
+    capture.stop()
 
+    return capture.accumulator
 
-# Jsonarray which will store our data
-# (not yet, experiment is currently just set up for one query to test)
-data = []
 
-fail_count = 0
+def collect_parallel(i, j):
+    """ Query cell i (run j) through the Tor instance of a free worker """
 
-for i in range(1, 101):
-    cell_capture_path = os.path.join(capture_path, f'cell_{i}')
+    worker = free_workers.get()
 
-    if not os.path.exists(cell_capture_path):
+    try:
+        flow_capture.begin(worker)
 
-        os.makedirs(cell_capture_path)
+        subprocess.Popen(query_command(
+            i, tor_instances[worker].proxy, args.by_location), close_fds=True).wait()
 
-    # 200 runs per cell
-    for j in range(100):
+        return flow_capture.end(worker)
 
-        overall_capture_path = os.path.join(
-            cell_capture_path, f'traffic_cell{i}_run{j}.pcap')
+    finally:
+        free_workers.put(worker)
 
-        incoming_capture_path = os.path.join(
-            cell_capture_path, f'traffic_cell{i}_run{j}_incoming.pcap')
 
-        outgoing_capture_path = os.path.join(
-            cell_capture_path, f'traffic_cell{i}_run{j}_outgoing.pcap')
+fail_count = 0
 
-        # Start recording using tcpdump
-        # subprocess.Popen
-        p1 = subprocess.Popen(
-            ['tshark', '-i', 'eth0', '-w', overall_capture_path],  preexec_fn=os.setsid, close_fds=True)
+fail_lock = threading.Lock()
 
-        # Make query
-        p2 = subprocess.Popen(
-            ['python3', 'client.py', 'grid', str(i), '-T', 'restaurant', '-t'], close_fds=True
-        ).wait()
 
-        # Kill the recording
-        os.killpg(os.getpgid(p1.pid), signal.SIGTERM)
+def collect(i, j):
 
-        # Write the ingoing- and outgoing-only files (so statistics can be computed for those separately)
-        status_in = subprocess.call(
-            ["tshark", "-r", overall_capture_path, "-w", incoming_capture_path, "-Y", f"!(ip.src == {ip_address})"])
+    global fail_count
 
-        status_out = subprocess.call(
-            ["tshark", "-r", overall_capture_path, "-w", outgoing_capture_path, "-Y", f"ip.src == {ip_address}"])
+    if args.parallel > 1:
+        accumulator = collect_parallel(i, j)
 
-        # Make dictionary for storing data
-        # add nr. of queried cell
-        data_dict = {'cell': i}
+    else:
+        accumulator = collect_sequential(i, j)
 
-        # get statistics for complete packet capture (incoming & outgoing)
-        total = get_capinfos([
-            overall_capture_path])
+    if not accumulator.directions['overall'].number_of_packets:
 
-        if not total:
+        with fail_lock:
 
-            print('Repair of overall pcap unsuccessful!')
+            print('No packets captured!')
 
             fail_count += 1
 
             print(f'Fail count: {fail_count}')
 
-            continue
+        return
 
-        data_dict.update({'overall': total})
+    results.write(unnest(i, j, accumulator))
 
-        # get statistics for incoming packets only
-        incoming = get_capinfos([
-            incoming_capture_path])
 
-        if not incoming:
+if args.manifest:
+    tasks = read_manifest(args.manifest)
 
-            print('Repair of incoming pcap unsuccessful!')
+else:
+    tasks = make_manifest(args.cells[0], args.cells[1], args.runs)
 
-            fail_count += 1
+# Skip what has already been collected by a previous (e.g. crashed) run
+done = completed_tasks(args.output)
 
-            print(f'Fail count: {fail_count}')
+tasks = [task for task in tasks if task not in done]
 
-            continue
+print(f'{len(tasks)} tasks to collect, {len(done)} already done')
 
-        # print(incoming)
+if args.parallel > 1:
 
-        data_dict.update({'incoming': incoming})
+    tor_instances = {}
 
-        # get statistics for outgoing packets only
-        outgoing = get_capinfos([
-            outgoing_capture_path])
+    for worker in range(args.parallel):
 
-        if not outgoing:
+        tor_instances[worker] = TorInstance(
+            worker, os.path.join(curr_dir, 'tor_workers', f'worker_{worker}')).start()
 
-            print('Repair of outgoing pcap unsuccessful!')
+    free_workers = queue.Queue()
 
-            fail_count += 1
+    for worker in tor_instances:
+        free_workers.put(worker)
 
-            print(f'Fail count: {fail_count}')
+    flow_capture = FlowCapture(ip_address, tor_instances, args.interface, args.sequences).start()
 
-            continue
+try:
+    with ResultsWriter(args.output) as results, ThreadPoolExecutor(max_workers=args.parallel) as executor:
 
-        data_dict.update({'outgoing': outgoing})
+        for _ in executor.map(lambda task: collect(*task), tasks):
+            pass
 
-        unnested_data_dict = dict()
+finally:
+    if args.parallel > 1:
 
-        # Un-nest data dict so it will be easier to process later on when we will most likely transform it into a numpy array or something
-        for key, value in data_dict.items():
+        flow_capture.stop()
 
-            if key == 'cell':
+        for tor in tor_instances.values():
+            tor.stop()
 
-                unnested_data_dict.update({key: value})
+print(f'Fails: {fail_count} / {len(tasks)}')
 
-            else:
+if args.dataset:
 
-                for nested_key, nested_value in value.items():
+    from dataset import FEATURE_NAMES, KFP_FEATURE_NAMES, read_records, records_to_arrays, write_dataset
 
-                    unnested_data_dict.update(
-                        {key + '_' + nested_key: nested_value})
+    feature_names = FEATURE_NAMES + KFP_FEATURE_NAMES if args.sequences else FEATURE_NAMES
 
-        data.append(unnested_data_dict)
+    features, labels = records_to_arrays(read_records(args.output), feature_names)
 
-with open("results.json", "w") as outfile:
-    json.dump(data, outfile)
+    write_dataset(args.dataset, features, labels, feature_names)
 
-print(f'Fails: {fail_count} / 250')
+    print(f'Wrote {len(labels)} traces to {args.dataset}')
@@ -0,0 +1,511 @@
+"""
+Packet-sequence features, following k-fingerprinting.
+
+Reference: Hayes & Danezis, "k-fingerprinting: a Robust Scalable Website
+Fingerprinting Technique", USENIX Security 2016.
+
+The capinfos-style aggregates of a trace (number of packets, rates and average
+sizes per direction) are complemented with features that depend on the order
+and timing of the packets: packet ordering, concentration of outgoing packets,
+bursts, inter-arrival times, transmission time percentiles, packets per
+second and the directions of the first and last 30 packets.
+
+A trace is given by three equally long arrays:
+    * timestamps: arrival times in seconds
+    * sizes:      packet lengths in bytes
+    * directions: +1 for outgoing, -1 for incoming packets
+
+Many traces are stored as one concatenation of these arrays plus an offsets
+index (PacketSequences, like the CSR format of sparse matrices). extract_batch
+computes the features of all of them at once with segment reductions
+(np.add.reduceat, np.bincount over trace ids, ...), so the cost does not grow
+with the number of Python calls. extract_features computes the features of a
+single trace and serves as reference.
+"""
+
+import os
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+OUTGOING = 1
+
+INCOMING = -1
+
+# Size of the chunks for the concentration of outgoing packets
+CHUNK_SIZE = 20
+
+# Number of packets at the start and end of a trace whose directions are counted
+FIRST_LAST = 30
+
+BURST_THRESHOLDS = (2, 5, 10)
+
+SUMMARY = ('mean', 'std', 'median', 'min', 'max')
+
+IAT_SUMMARY = ('max', 'mean', 'std', 'p75')
+
+PERCENTILES = (25, 50, 75, 100)
+
+DIRECTION_NAMES = ('total', 'incoming', 'outgoing')
+
+KFP_FEATURE_NAMES: List[str] = (
+    ['kfp_num_packets', 'kfp_num_incoming', 'kfp_num_outgoing',
+     'kfp_fraction_incoming', 'kfp_fraction_outgoing',
+     'kfp_bytes_incoming', 'kfp_bytes_outgoing',
+     'kfp_mean_size_incoming', 'kfp_mean_size_outgoing']
+    + [f'kfp_order_{name}_{stat}' for name in ('incoming', 'outgoing') for stat in ('mean', 'std')]
+    + [f'kfp_concentration_outgoing_{stat}' for stat in SUMMARY]
+    + [f'kfp_packets_per_second_{stat}' for stat in SUMMARY]
+    + [f'kfp_iat_{name}_{stat}' for name in DIRECTION_NAMES for stat in IAT_SUMMARY]
+    + [f'kfp_transmission_time_{name}_p{p}' for name in DIRECTION_NAMES for p in PERCENTILES]
+    + ['kfp_first30_incoming', 'kfp_first30_outgoing',
+       'kfp_last30_incoming', 'kfp_last30_outgoing']
+    + ['kfp_num_bursts', 'kfp_burst_mean', 'kfp_burst_max']
+    + [f'kfp_bursts_over_{threshold}' for threshold in BURST_THRESHOLDS]
+)
+
+
+def _summary(values: np.ndarray) -> List[float]:
+    """ mean, std, median, min, max (all 0 for no values) """
+
+    if not len(values):
+        return [0.0] * len(SUMMARY)
+
+    return [values.mean(), values.std(), np.median(values), values.min(), values.max()]
+
+
+def _iat_summary(timestamps: np.ndarray) -> List[float]:
+    """ max, mean, std and 75th percentile of the inter-arrival times """
+
+    if len(timestamps) < 2:
+        return [0.0] * len(IAT_SUMMARY)
+
+    iat = np.diff(timestamps)
+
+    return [iat.max(), iat.mean(), iat.std(), np.percentile(iat, 75)]
+
+
+def _transmission_time(timestamps: np.ndarray, start: float) -> List[float]:
+    """ Percentiles of the packets' times since the start of the trace """
+
+    if not len(timestamps):
+        return [0.0] * len(PERCENTILES)
+
+    return list(np.percentile(timestamps - start, PERCENTILES))
+
+
+def bursts(directions: np.ndarray) -> np.ndarray:
+    """ Lengths of the runs of consecutive outgoing packets """
+
+    outgoing = np.concatenate(([0], directions == OUTGOING, [0])).astype(np.int8)
+
+    edges = np.flatnonzero(np.diff(outgoing))
+
+    # runs start at even edges and end at odd ones
+    return edges[1::2] - edges[0::2]
+
+
+def extract_features(timestamps: np.ndarray, sizes: np.ndarray, directions: np.ndarray) -> np.ndarray:
+    """ The k-fingerprinting features of one trace, in the order of KFP_FEATURE_NAMES """
+
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+
+    sizes = np.asarray(sizes, dtype=np.float64)
+
+    directions = np.asarray(directions)
+
+    n = len(directions)
+
+    # the packets in order of arrival
+    order = np.argsort(timestamps, kind='stable')
+
+    timestamps, sizes, directions = timestamps[order], sizes[order], directions[order]
+
+    is_in = directions == INCOMING
+
+    is_out = directions == OUTGOING
+
+    n_in = int(is_in.sum())
+
+    n_out = int(is_out.sum())
+
+    bytes_in = sizes[is_in].sum()
+
+    bytes_out = sizes[is_out].sum()
+
+    features = [
+        n, n_in, n_out,
+        n_in / n if n else 0.0, n_out / n if n else 0.0,
+        bytes_in, bytes_out,
+        bytes_in / n_in if n_in else 0.0, bytes_out / n_out if n_out else 0.0,
+    ]
+
+    # packet ordering: positions of the incoming and outgoing packets in the sequence
+    positions = np.arange(n)
+
+    for mask in (is_in, is_out):
+
+        features += [positions[mask].mean(), positions[mask].std()] if mask.any() else [0.0, 0.0]
+
+    # concentration of outgoing packets in chunks of CHUNK_SIZE packets
+    chunk_starts = np.arange(0, n, CHUNK_SIZE)
+
+    features += _summary(np.add.reduceat(is_out.astype(np.int64), chunk_starts) if n else np.empty(0))
+
+    # number of packets per second
+    start = timestamps[0] if n else 0.0
+
+    if n:
+        per_second = np.bincount((timestamps - start).astype(np.int64))
+    else:
+        per_second = np.empty(0)
+
+    features += _summary(per_second)
+
+    # inter-arrival times and transmission times, for all, incoming and outgoing packets
+    for mask in (slice(None), is_in, is_out):
+        features += _iat_summary(timestamps[mask])
+
+    for mask in (slice(None), is_in, is_out):
+        features += _transmission_time(timestamps[mask], start)
+
+    # directions of the first and last packets
+    first, last = directions[:FIRST_LAST], directions[-FIRST_LAST:]
+
+    features += [(first == INCOMING).sum(), (first == OUTGOING).sum(),
+                 (last == INCOMING).sum(), (last == OUTGOING).sum()]
+
+    # bursts of outgoing packets
+    burst_lengths = bursts(directions)
+
+    features += [len(burst_lengths),
+                 burst_lengths.mean() if len(burst_lengths) else 0.0,
+                 burst_lengths.max() if len(burst_lengths) else 0.0]
+
+    features += [(burst_lengths > threshold).sum() for threshold in BURST_THRESHOLDS]
+
+    return np.array(features, dtype=np.float32)
+
+
+class PacketSequences:
+
+    'Class for storing many packet sequences as concatenated arrays with an offsets index (CSR)'
+
+    ARRAYS = ('timestamps', 'sizes', 'directions', 'offsets')
+
+    def __init__(self, timestamps: np.ndarray, sizes: np.ndarray, directions: np.ndarray,
+                 offsets: np.ndarray, presorted: bool = False):
+        """
+        Args:
+            timestamps, sizes, directions: the packets of all traces, one trace after the other
+            offsets: trace i consists of the packets offsets[i]:offsets[i + 1]
+            presorted: the packets of every trace are already in order of arrival
+        """
+
+        self.offsets: np.ndarray = np.asanyarray(offsets, dtype=np.int64)
+
+        if self.offsets[0] != 0 or self.offsets[-1] != len(timestamps) or np.any(np.diff(self.offsets) < 0):
+            raise ValueError('offsets do not index the packet arrays')
+
+        self.timestamps: np.ndarray = np.asanyarray(timestamps, dtype=np.float64)
+
+        self.sizes: np.ndarray = np.asanyarray(sizes, dtype=np.float64)
+
+        self.directions: np.ndarray = np.asanyarray(directions, dtype=np.int8)
+
+        if not presorted:
+
+            # sort by time within every trace (lexsort is stable, like extract_features)
+            order = np.lexsort((self.timestamps, self.trace_ids()))
+
+            self.timestamps = self.timestamps[order]
+
+            self.sizes = self.sizes[order]
+
+            self.directions = self.directions[order]
+
+    @classmethod
+    def from_traces(cls, traces: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> 'PacketSequences':
+        """ Concatenate (timestamps, sizes, directions) traces """
+
+        traces = list(traces)
+
+        lengths = [len(trace[2]) for trace in traces]
+
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+        def column(i: int) -> np.ndarray:
+
+            return np.concatenate([np.asarray(trace[i], dtype=np.float64) for trace in traces]) if traces else np.empty(0)
+
+        return cls(column(0), column(1), column(2), offsets)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> 'PacketSequences':
+        """ Concatenate the packet sequences of records collected with experiment.py --sequences """
+
+        return cls.from_traces((record['timestamps'], record['sizes'], record['directions']) for record in records)
+
+    def __len__(self) -> int:
+
+        return len(self.offsets) - 1
+
+    def lengths(self) -> np.ndarray:
+
+        return np.diff(self.offsets)
+
+    def trace_ids(self) -> np.ndarray:
+        """ Index of the trace of every packet """
+
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def trace(self, i: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+
+        packets = slice(self.offsets[i], self.offsets[i + 1])
+
+        return self.timestamps[packets], self.sizes[packets], self.directions[packets]
+
+    def save(self, path: str) -> None:
+        """ Write the arrays to .npy files in the directory path """
+
+        os.makedirs(path, exist_ok=True)
+
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'PacketSequences':
+        """ Read the arrays written by save, memory-mapped by default """
+
+        arrays = [np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+                  for name in cls.ARRAYS]
+
+        return cls(*arrays, presorted=True)
+
+
+def _offsets(counts: np.ndarray) -> np.ndarray:
+
+    return np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+
+
+def _segment_sum(values: np.ndarray, ids: np.ndarray, n: int) -> np.ndarray:
+
+    return np.bincount(ids, weights=values, minlength=n)
+
+
+def _segment_reduce(ufunc: np.ufunc, values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """ ufunc.reduceat over every segment (0 for empty segments) """
+
+    lengths = np.diff(offsets)
+
+    result = np.zeros(len(lengths))
+
+    nonempty = lengths > 0
+
+    if nonempty.any():
+        # empty segments contribute no elements, so skipping their starts is safe
+        result[nonempty] = ufunc.reduceat(values, offsets[:-1][nonempty])
+
+    return result
+
+
+def _segment_mean_std(values: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Mean and (two-pass) standard deviation of every segment """
+
+    counts = np.diff(offsets)
+
+    ids = np.repeat(np.arange(len(counts)), counts)
+
+    divisor = np.maximum(counts, 1)
+
+    mean = _segment_reduce(np.add, values, offsets) / divisor
+
+    deviations = values - mean[ids]
+
+    std = np.sqrt(_segment_sum(deviations * deviations, ids, len(counts)) / divisor)
+
+    return mean, std
+
+
+def _segment_percentiles(sorted_values: np.ndarray, offsets: np.ndarray, percentiles: Iterable[float]) -> np.ndarray:
+    """ Percentiles (linear interpolation, as np.percentile) of segments sorted in ascending order """
+
+    counts = np.diff(offsets)
+
+    nonempty = counts > 0
+
+    starts, counts = offsets[:-1][nonempty], counts[nonempty]
+
+    percentiles = list(percentiles)
+
+    result = np.zeros((len(nonempty), len(percentiles)))
+
+    for column, percentile in enumerate(percentiles):
+
+        position = (counts - 1) * (percentile / 100)
+
+        low = np.floor(position).astype(np.int64)
+
+        high = np.minimum(low + 1, counts - 1)
+
+        below, above = sorted_values[starts + low], sorted_values[starts + high]
+
+        result[nonempty, column] = below + (above - below) * (position - low)
+
+    return result
+
+
+def _sort_segments(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+
+    ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    return values[np.lexsort((values, ids))]
+
+
+def _segment_summary(values: np.ndarray, offsets: np.ndarray) -> List[np.ndarray]:
+    """ mean, std, median, min, max of every segment """
+
+    mean, std = _segment_mean_std(values, offsets)
+
+    median, minimum, maximum = _segment_percentiles(
+        _sort_segments(values, offsets), offsets, (50, 0, 100)).T
+
+    return [mean, std, median, minimum, maximum]
+
+
+def _subset(values: np.ndarray, mask: np.ndarray, ids: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """ The masked values of every segment, with their offsets """
+
+    return values[mask], _offsets(np.bincount(ids[mask], minlength=n))
+
+
+def _iat_summary_batch(timestamps: np.ndarray, offsets: np.ndarray) -> List[np.ndarray]:
+    """ max, mean, std and 75th percentile of the inter-arrival times of every segment """
+
+    counts = np.diff(offsets)
+
+    # the first packet of a segment has no inter-arrival time
+    follows = np.ones(len(timestamps), dtype=bool)
+
+    follows[offsets[:-1][counts > 0]] = False
+
+    iat = np.diff(timestamps)[follows[1:]]
+
+    iat_offsets = _offsets(np.maximum(counts - 1, 0))
+
+    mean, std = _segment_mean_std(iat, iat_offsets)
+
+    maximum, p75 = _segment_percentiles(_sort_segments(iat, iat_offsets), iat_offsets, (100, 75)).T
+
+    return [maximum, mean, std, p75]
+
+
+def extract_batch(sequences: PacketSequences) -> np.ndarray:
+    """ Feature matrix of all traces, computed with segment reductions over the packet arrays
+
+    Gives the same features as extract_features on every trace.
+    """
+
+    n = len(sequences)
+
+    offsets = sequences.offsets
+
+    lengths = sequences.lengths()
+
+    ids = sequences.trace_ids()
+
+    timestamps, sizes, directions = sequences.timestamps, sequences.sizes, sequences.directions
+
+    is_in = directions == INCOMING
+
+    is_out = directions == OUTGOING
+
+    def count(mask: np.ndarray) -> np.ndarray:
+
+        return _segment_sum(mask.astype(np.float64), ids, n)
+
+    def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+
+        return np.divide(numerator, denominator, out=np.zeros(n), where=denominator > 0)
+
+    n_in, n_out = count(is_in), count(is_out)
+
+    bytes_in, bytes_out = _segment_sum(sizes * is_in, ids, n), _segment_sum(sizes * is_out, ids, n)
+
+    columns = [lengths, n_in, n_out, ratio(n_in, lengths), ratio(n_out, lengths),
+               bytes_in, bytes_out, ratio(bytes_in, n_in), ratio(bytes_out, n_out)]
+
+    # packet ordering
+    positions = np.arange(len(ids)) - offsets[ids]
+
+    for mask in (is_in, is_out):
+        columns += _segment_mean_std(*_subset(positions.astype(np.float64), mask, ids, n))
+
+    # concentration of outgoing packets in chunks of CHUNK_SIZE packets
+    chunk_offsets = _offsets((lengths + CHUNK_SIZE - 1) // CHUNK_SIZE)
+
+    chunks = np.bincount(chunk_offsets[ids] + positions // CHUNK_SIZE,
+                         weights=is_out, minlength=chunk_offsets[-1])
+
+    columns += _segment_summary(chunks, chunk_offsets)
+
+    # number of packets per second
+    starts = np.zeros(n)
+
+    starts[lengths > 0] = timestamps[offsets[:-1][lengths > 0]]
+
+    elapsed = timestamps - starts[ids]
+
+    seconds = elapsed.astype(np.int64)
+
+    second_offsets = _offsets(_segment_reduce(np.maximum, seconds, offsets).astype(np.int64) + (lengths > 0))
+
+    per_second = np.bincount(second_offsets[ids] + seconds, minlength=second_offsets[-1])
+
+    columns += _segment_summary(per_second.astype(np.float64), second_offsets)
+
+    # inter-arrival times and transmission times, for all, incoming and outgoing packets
+    every = np.ones(len(ids), dtype=bool)
+
+    for mask in (every, is_in, is_out):
+        columns += _iat_summary_batch(*_subset(timestamps, mask, ids, n))
+
+    for mask in (every, is_in, is_out):
+
+        # still sorted within every trace
+        columns += list(_segment_percentiles(*_subset(elapsed, mask, ids, n), PERCENTILES).T)
+
+    # directions of the first and last packets
+    first = positions < FIRST_LAST
+
+    last = positions >= (lengths - FIRST_LAST)[ids]
+
+    columns += [count(first & is_in), count(first & is_out), count(last & is_in), count(last & is_out)]
+
+    # bursts of outgoing packets (runs never cross traces, as they start and end within one)
+    previous_out = np.concatenate(([False], is_out[:-1])) & (positions > 0)
+
+    next_out = np.concatenate((is_out[1:], [False])) & (positions < (lengths - 1)[ids])
+
+    burst_starts = np.flatnonzero(is_out & ~previous_out)
+
+    burst_lengths = np.flatnonzero(is_out & ~next_out) - burst_starts + 1
+
+    burst_ids = ids[burst_starts]
+
+    num_bursts = np.bincount(burst_ids, minlength=n).astype(np.float64)
+
+    columns += [num_bursts, ratio(_segment_sum(burst_lengths, burst_ids, n), num_bursts),
+                _segment_reduce(np.maximum, burst_lengths, _offsets(num_bursts.astype(np.int64)))]
+
+    columns += [_segment_sum((burst_lengths > threshold).astype(np.float64), burst_ids, n)
+                for threshold in BURST_THRESHOLDS]
+
+    return np.column_stack(columns).astype(np.float32).reshape(n, len(KFP_FEATURE_NAMES))
+
+
+def extract_many(traces: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> np.ndarray:
+    """ Feature matrix (one row per trace) of many (timestamps, sizes, directions) traces """
+
+    return extract_batch(PacketSequences.from_traces(traces))
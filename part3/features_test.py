@@ -0,0 +1,125 @@
+import pytest
+
+import numpy as np
+
+from features import (KFP_FEATURE_NAMES, PacketSequences, bursts, extract_batch,
+                      extract_features, extract_many)
+
+""" Test the k-fingerprinting features in features.py """
+
+
+def feature(values: np.ndarray, name: str) -> float:
+
+    return values[KFP_FEATURE_NAMES.index(name)]
+
+
+def test_bursts() -> None:
+
+    directions = np.array([1, 1, -1, 1, -1, -1, 1, 1, 1])
+
+    assert bursts(directions).tolist() == [2, 1, 3]
+
+    assert bursts(np.array([-1, -1])).tolist() == []
+
+
+def test_extract_features() -> None:
+
+    # out, out, in, in, in, out at 0.0, 0.1, ..., 2.5 s (given out of order)
+    timestamps = np.array([0.0, 0.1, 0.2, 1.3, 2.5, 1.4])
+    sizes = np.array([100, 100, 500, 500, 100, 500])
+    directions = np.array([1, 1, -1, -1, 1, -1])
+
+    values = extract_features(timestamps, sizes, directions)
+
+    assert values.shape == (len(KFP_FEATURE_NAMES),)
+    assert values.dtype == np.float32
+
+    assert feature(values, 'kfp_num_packets') == 6
+    assert feature(values, 'kfp_num_outgoing') == 3
+    assert feature(values, 'kfp_fraction_incoming') == pytest.approx(0.5)
+    assert feature(values, 'kfp_bytes_incoming') == 1500
+    assert feature(values, 'kfp_mean_size_outgoing') == pytest.approx(100)
+
+    # sorted by time: out, out, in, in, in, out
+    assert feature(values, 'kfp_order_outgoing_mean') == pytest.approx((0 + 1 + 5) / 3)
+    assert feature(values, 'kfp_num_bursts') == 2
+    assert feature(values, 'kfp_burst_max') == 2
+    assert feature(values, 'kfp_first30_incoming') == 3
+
+    # 3 packets in the first second, 2 in the second, 1 in the third
+    assert feature(values, 'kfp_packets_per_second_max') == 3
+    assert feature(values, 'kfp_packets_per_second_min') == 1
+
+    assert feature(values, 'kfp_iat_total_max') == pytest.approx(1.1)
+    assert feature(values, 'kfp_transmission_time_total_p100') == pytest.approx(2.5)
+    assert feature(values, 'kfp_transmission_time_outgoing_p50') == pytest.approx(0.1)
+
+
+def test_empty_trace() -> None:
+
+    values = extract_features([], [], [])
+
+    assert not values.any()
+
+
+def test_extract_many() -> None:
+
+    trace = (np.arange(50) / 10, np.full(50, 586), np.where(np.arange(50) % 3, -1, 1))
+
+    matrix = extract_many([trace, trace])
+
+    assert matrix.shape == (2, len(KFP_FEATURE_NAMES))
+    assert np.allclose(matrix[0], extract_features(*trace), rtol=1e-5)
+    assert np.isfinite(matrix).all()
+
+    assert extract_many([]).shape == (0, len(KFP_FEATURE_NAMES))
+
+
+def random_trace(rng: np.random.Generator, length: int) -> tuple:
+
+    timestamps = rng.uniform(0, 5, length)
+    sizes = rng.choice([66, 586, 1514], length)
+    directions = rng.choice([-1, 1], length)
+
+    return timestamps, sizes, directions
+
+
+def test_extract_batch_matches_extract_features() -> None:
+
+    rng = np.random.default_rng(0)
+
+    # including empty, single packet and multi-chunk traces
+    traces = [random_trace(rng, length) for length in (0, 1, 2, 19, 20, 21, 0, 75, 300, 3)]
+
+    sequences = PacketSequences.from_traces(traces)
+
+    assert len(sequences) == len(traces)
+
+    matrix = extract_batch(sequences)
+
+    for row, trace in zip(matrix, traces):
+        assert np.allclose(row, extract_features(*trace), rtol=1e-5, atol=1e-6)
+
+
+def test_packet_sequences_save_load(tmp_path) -> None:
+
+    rng = np.random.default_rng(1)
+
+    sequences = PacketSequences.from_traces([random_trace(rng, length) for length in (5, 0, 12)])
+
+    # packets are sorted by time within every trace
+    assert np.all(np.diff(sequences.trace(2)[0]) >= 0)
+
+    sequences.save(str(tmp_path))
+
+    loaded = PacketSequences.load(str(tmp_path))
+
+    assert isinstance(loaded.timestamps, np.memmap)
+    assert np.array_equal(loaded.offsets, [0, 5, 5, 17])
+    assert np.array_equal(extract_batch(loaded), extract_batch(sequences))
+
+
+def test_invalid_offsets() -> None:
+
+    with pytest.raises(ValueError):
+        PacketSequences(np.zeros(3), np.zeros(3), np.ones(3), [0, 2])
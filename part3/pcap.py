@@ -0,0 +1,518 @@
+"""
+Native reader for packet captures and per-trace statistics.
+
+Replaces the chain of `tshark -r ... -Y` (to split a capture into incoming and
+outgoing packets) and `capinfos -M` (to compute statistics on each of the three
+files) that used to run for every single query. The capture is read once,
+packets are classified by direction against the host's IP address, and the
+statistics for all three directions are accumulated in a single pass.
+
+Both the classic libpcap format and pcapng (which is what `tshark -w` writes
+by default) are supported. Truncated captures (e.g. because tshark was killed
+while writing) are read up to the last complete packet, which is what
+`pcapfix` used to do for us.
+
+Alternatively, `LiveCapture` consumes the packets straight from a running
+`tshark -T fields` and updates the statistics on the fly, so that nothing has
+to be written to (and read back from) disk at all.
+"""
+
+import ipaddress
+
+import os
+
+import signal
+
+import struct
+
+import subprocess
+
+import threading
+
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+# (timestamp in seconds, original packet length, captured bytes, link type)
+Packet = Tuple[float, int, bytes, int]
+
+# Link-layer header types, see https://www.tcpdump.org/linktypes.html
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_RAW_ALT = 12
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+
+# Magic numbers of the classic format (microsecond and nanosecond resolution)
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+
+# pcapng block types
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_PACKET = 0x00000002
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPTION_TSRESOL = 9
+
+DIRECTIONS = ('overall', 'incoming', 'outgoing')
+
+
+def _read_classic(f: BinaryIO, header: bytes) -> Iterator[Packet]:
+    """ Packets of a classic libpcap file (the 4 magic bytes are already read) """
+
+    header += f.read(20)
+
+    if len(header) < 24:
+        return
+
+    for endian in ('<', '>'):
+
+        magic = struct.unpack(endian + 'I', header[:4])[0]
+
+        if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            break
+
+    resolution = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+
+    linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF
+
+    record_header = struct.Struct(endian + 'IIII')
+
+    while True:
+
+        record = f.read(16)
+
+        if len(record) < 16:
+            return
+
+        ts_sec, ts_frac, incl_len, orig_len = record_header.unpack(record)
+
+        data = f.read(incl_len)
+
+        if len(data) < incl_len:
+            return
+
+        yield (ts_sec + ts_frac * resolution, orig_len, data, linktype)
+
+
+def _tsresol(options: bytes, endian: str) -> float:
+    """ Timestamp resolution from the options of an interface description block """
+
+    offset = 0
+
+    while offset + 4 <= len(options):
+
+        code, length = struct.unpack(endian + 'HH', options[offset:offset + 4])
+
+        if code == 0:
+            break
+
+        if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+
+            value = options[offset + 4]
+
+            # MSB set: negative power of 2, otherwise negative power of 10
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+
+        offset += 4 + ((length + 3) & ~3)
+
+    return 1e-6
+
+
+def _read_pcapng(f: BinaryIO, block_type: bytes) -> Iterator[Packet]:
+    """ Packets of a pcapng file (the first block type is already read) """
+
+    endian = '<'
+
+    # (link type, timestamp resolution, snap length) per interface of the current section
+    interfaces = []
+
+    while len(block_type) == 4:
+
+        length_bytes = f.read(4)
+
+        if len(length_bytes) < 4:
+            return
+
+        if block_type == struct.pack('<I', PCAPNG_SECTION_HEADER):
+
+            # the byte order magic decides the endianness of the whole section
+            body_start = f.read(4)
+
+            if len(body_start) < 4:
+                return
+
+            endian = '<' if struct.unpack('<I', body_start)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+
+            total_length = struct.unpack(endian + 'I', length_bytes)[0]
+
+            body = body_start + f.read(total_length - 12)
+
+            interfaces = []
+
+        else:
+
+            total_length = struct.unpack(endian + 'I', length_bytes)[0]
+
+            body = f.read(total_length - 8)
+
+        if total_length < 12 or len(body) < total_length - 8:
+            return
+
+        kind = struct.unpack(endian + 'I', block_type)[0]
+
+        if kind == PCAPNG_INTERFACE_DESCRIPTION:
+
+            linktype, _, snaplen = struct.unpack(endian + 'HHI', body[:8])
+
+            interfaces.append(
+                (linktype, _tsresol(body[8:-4], endian), snaplen))
+
+        elif kind == PCAPNG_ENHANCED_PACKET:
+
+            interface_id, ts_high, ts_low, cap_len, orig_len = struct.unpack(
+                endian + 'IIIII', body[:20])
+
+            if interface_id >= len(interfaces):
+                return
+
+            linktype, resolution, _ = interfaces[interface_id]
+
+            yield (((ts_high << 32) | ts_low) * resolution, orig_len, body[20:20 + cap_len], linktype)
+
+        elif kind == PCAPNG_PACKET:
+
+            interface_id, _, ts_high, ts_low, cap_len, orig_len = struct.unpack(
+                endian + 'HHIIII', body[:20])
+
+            if interface_id >= len(interfaces):
+                return
+
+            linktype, resolution, _ = interfaces[interface_id]
+
+            yield (((ts_high << 32) | ts_low) * resolution, orig_len, body[20:20 + cap_len], linktype)
+
+        # all other blocks (simple packet blocks carry no timestamp and are
+        # not written by tshark, statistics, name resolution, ...) are skipped
+
+        block_type = f.read(4)
+
+
+def read_packets(path: str) -> Iterator[Packet]:
+    """ Iterate over the packets of a pcap or pcapng file
+
+    Raises:
+        ValueError: if the file is neither a pcap nor a pcapng file
+    """
+
+    with open(path, 'rb') as f:
+
+        magic = f.read(4)
+
+        if magic == struct.pack('<I', PCAPNG_SECTION_HEADER):
+
+            yield from _read_pcapng(f, magic)
+
+        elif len(magic) == 4 and (struct.unpack('<I', magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS)
+                                  or struct.unpack('>I', magic)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS)):
+
+            yield from _read_classic(f, magic)
+
+        else:
+
+            raise ValueError(f'{path} is not a pcap or pcapng file')
+
+
+def source_address(data: bytes, linktype: int) -> Optional[bytes]:
+    """ Packed source IP address of a captured frame, None if it isn't IP """
+
+    if linktype == LINKTYPE_ETHERNET:
+
+        offset = 14
+
+        ethertype = int.from_bytes(data[12:14], 'big')
+
+        while ethertype in ETHERTYPE_VLAN:
+
+            ethertype = int.from_bytes(data[offset + 2:offset + 4], 'big')
+
+            offset += 4
+
+    elif linktype == LINKTYPE_LINUX_SLL:
+
+        offset = 16
+
+        ethertype = int.from_bytes(data[14:16], 'big')
+
+    elif linktype == LINKTYPE_LINUX_SLL2:
+
+        offset = 20
+
+        ethertype = int.from_bytes(data[0:2], 'big')
+
+    elif linktype == LINKTYPE_NULL:
+
+        offset = 4
+
+        ethertype = None
+
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_RAW_ALT, LINKTYPE_IPV4, LINKTYPE_IPV6):
+
+        offset = 0
+
+        ethertype = None
+
+    else:
+
+        return None
+
+    if len(data) <= offset:
+        return None
+
+    version = data[offset] >> 4
+
+    if version == 4 and ethertype in (None, ETHERTYPE_IPV4):
+
+        return data[offset + 12:offset + 16]
+
+    if version == 6 and ethertype in (None, ETHERTYPE_IPV6):
+
+        return data[offset + 8:offset + 24]
+
+    return None
+
+
+class TraceStatistics:
+
+    'Class for accumulating the capinfos-style statistics of one direction of a trace'
+
+    def __init__(self):
+
+        self.number_of_packets: int = 0
+
+        self.data_size: int = 0
+
+        self.first_packet_time: Optional[float] = None
+
+        self.last_packet_time: Optional[float] = None
+
+    def add(self, timestamp: float, length: int) -> None:
+        """ Account for one packet """
+
+        self.number_of_packets += 1
+
+        self.data_size += length
+
+        if self.first_packet_time is None or timestamp < self.first_packet_time:
+            self.first_packet_time = timestamp
+
+        if self.last_packet_time is None or timestamp > self.last_packet_time:
+            self.last_packet_time = timestamp
+
+    def as_dict(self) -> Dict[str, float]:
+        """ The statistics; rates are 0 if the capture has no duration """
+
+        duration = 0.0
+
+        if self.number_of_packets:
+            duration = self.last_packet_time - self.first_packet_time
+
+        return {
+            'number_of_packets': self.number_of_packets,
+            'data_size': self.data_size,
+            'capture_duration': duration,
+            'data_byte_rate': self.data_size / duration if duration else 0.0,
+            'data_bit_rate': 8 * self.data_size / duration if duration else 0.0,
+            'avg_packet_size': self.data_size / self.number_of_packets if self.number_of_packets else 0.0,
+            'avg_packet_rate': self.number_of_packets / duration if duration else 0.0,
+        }
+
+
+class TraceAccumulator:
+
+    'Class for accumulating the statistics of a trace, split by direction'
+
+    def __init__(self, keep_packets: bool = False):
+        """
+        Args:
+            keep_packets: also record the packet sequence (for features.py)
+        """
+
+        self.directions: Dict[str, TraceStatistics] = {
+            direction: TraceStatistics() for direction in DIRECTIONS}
+
+        self.keep_packets: bool = keep_packets
+
+        # packet sequence: arrival times, lengths, +1 for outgoing / -1 for incoming
+        self.timestamps: List[float] = []
+
+        self.sizes: List[int] = []
+
+        self.packet_directions: List[int] = []
+
+    def add(self, timestamp: float, length: int, outgoing: bool) -> None:
+        """ Account for one packet """
+
+        self.directions['overall'].add(timestamp, length)
+
+        self.directions['outgoing' if outgoing else 'incoming'].add(
+            timestamp, length)
+
+        if self.keep_packets:
+
+            self.timestamps.append(timestamp)
+
+            self.sizes.append(length)
+
+            self.packet_directions.append(1 if outgoing else -1)
+
+    def statistics(self) -> Dict[str, Dict[str, float]]:
+        """ {'overall': {...}, 'incoming': {...}, 'outgoing': {...}} """
+
+        return {direction: self.directions[direction].as_dict() for direction in DIRECTIONS}
+
+    def packets(self) -> Dict[str, List[float]]:
+        """ {'timestamps': [...], 'sizes': [...], 'directions': [...]} (empty unless keep_packets) """
+
+        return {'timestamps': self.timestamps, 'sizes': self.sizes, 'directions': self.packet_directions}
+
+
+def is_outgoing(data: bytes, linktype: int, host_address: bytes) -> bool:
+    """ Same rule as the tshark filter `ip.src == host_ip` """
+
+    return source_address(data, linktype) == host_address
+
+
+def get_trace_statistics(path: str, host_ip: str) -> Dict[str, Dict[str, float]]:
+    """ Statistics for all, incoming and outgoing packets of a capture, in one pass
+
+    Returns:
+        {'overall': {...}, 'incoming': {...}, 'outgoing': {...}}
+    """
+
+    host_address = ipaddress.ip_address(host_ip).packed
+
+    accumulator = TraceAccumulator()
+
+    for timestamp, length, data, linktype in read_packets(path):
+
+        accumulator.add(timestamp, length,
+                        is_outgoing(data, linktype, host_address))
+
+    return accumulator.statistics()
+
+
+class LiveCapture:
+
+    'Class for computing trace statistics on the fly, while tshark is capturing'
+
+    # one line per packet: arrival time, length on the wire, source IP (empty if not IP)
+    FIELDS = ('frame.time_epoch', 'frame.len', 'ip.src')
+
+    def __init__(self, host_ip: str, interface: str = 'eth0', pcap_path: Optional[str] = None,
+                 keep_packets: bool = False):
+        """
+        Args:
+            host_ip: IP address of this host (packets from it are outgoing)
+            interface: interface to capture on
+            pcap_path: if set, the capture is also written to this file
+            keep_packets: also record the packet sequence of the trace
+        """
+
+        self.host_ip: str = host_ip
+
+        self.interface: str = interface
+
+        self.pcap_path: Optional[str] = pcap_path
+
+        self.keep_packets: bool = keep_packets
+
+        self.accumulator: TraceAccumulator = TraceAccumulator(keep_packets)
+
+        self.process: Optional[subprocess.Popen] = None
+
+        self.reader: Optional[threading.Thread] = None
+
+    def command(self) -> List[str]:
+        """ The tshark command line """
+
+        cmd = ['tshark', '-i', self.interface, '-l', '-n', '-T', 'fields']
+
+        for field in self.FIELDS:
+            cmd += ['-e', field]
+
+        if self.pcap_path is not None:
+            # -P keeps printing the fields while writing the capture file
+            cmd += ['-w', self.pcap_path, '-P']
+
+        return cmd
+
+    def add_line(self, line: str) -> None:
+        """ Account for one line of tshark output """
+
+        fields = line.rstrip('\n').split('\t')
+
+        if len(fields) < 2:
+            return
+
+        try:
+            timestamp = float(fields[0])
+            length = int(fields[1])
+
+        except ValueError:
+            return
+
+        # tunnelled packets have several (comma separated) source addresses; the outer one comes first
+        source = fields[2].split(',')[0] if len(fields) > 2 else ''
+
+        self.accumulator.add(timestamp, length, source == self.host_ip)
+
+    def _read(self) -> None:
+
+        for line in self.process.stdout:
+            self.add_line(line)
+
+    def start(self) -> 'LiveCapture':
+        """ Start capturing """
+
+        self.process = subprocess.Popen(
+            self.command(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1, preexec_fn=os.setsid, close_fds=True)
+
+        self.reader = threading.Thread(target=self._read, daemon=True)
+
+        self.reader.start()
+
+        return self
+
+    def stop(self) -> Dict[str, Dict[str, float]]:
+        """ Stop capturing and return the statistics of the trace """
+
+        try:
+            os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+
+        except ProcessLookupError:
+            pass
+
+        self.process.wait()
+
+        # drain whatever tshark printed before exiting
+        self.reader.join()
+
+        return self.accumulator.statistics()
+
+    def __enter__(self) -> 'LiveCapture':
+
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+
+        if self.process is not None and self.process.poll() is None:
+            self.stop()
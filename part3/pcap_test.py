@@ -0,0 +1,135 @@
+import pytest
+
+import struct
+
+from pcap import LiveCapture, read_packets, get_trace_statistics
+
+""" Test the native capture reader and statistics in pcap.py """
+
+HOST_IP = '172.18.0.3'
+
+HOST = bytes([172, 18, 0, 3])
+
+PEER = bytes([172, 18, 0, 2])
+
+
+def ethernet_frame(src: bytes, dst: bytes, length: int) -> bytes:
+
+    ip_header = bytes([0x45, 0]) + struct.pack('>H', length - 14) + bytes(8) + src + dst
+
+    frame = bytes(12) + struct.pack('>H', 0x0800) + ip_header
+
+    return frame + bytes(length - len(frame))
+
+
+# (timestamp, source, destination, length)
+PACKETS = [(1.0, HOST, PEER, 100), (1.5, PEER, HOST, 300), (3.0, PEER, HOST, 200)]
+
+
+def write_pcap(path, packets, truncate: int = 0) -> None:
+
+    content = struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1)
+
+    for timestamp, src, dst, length in packets:
+
+        frame = ethernet_frame(src, dst, length)
+
+        content += struct.pack('<IIII', int(timestamp), int(round(timestamp % 1 * 1e6)),
+                               len(frame), len(frame)) + frame
+
+    with open(path, 'wb') as f:
+        f.write(content[:len(content) - truncate])
+
+
+def pcapng_block(block_type: int, body: bytes) -> bytes:
+
+    body += bytes(-len(body) % 4)
+
+    return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+
+def write_pcapng(path, packets) -> None:
+
+    content = pcapng_block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+
+    # nanosecond timestamp resolution (if_tsresol = 9)
+    content += pcapng_block(1, struct.pack('<HHI', 1, 0, 65535) +
+                            struct.pack('<HH', 9, 1) + bytes([9, 0, 0, 0]) + struct.pack('<HH', 0, 0))
+
+    for timestamp, src, dst, length in packets:
+
+        frame = ethernet_frame(src, dst, length)
+
+        ticks = int(round(timestamp * 1e9))
+
+        content += pcapng_block(6, struct.pack('<IIIII', 0, ticks >> 32, ticks & 0xFFFFFFFF,
+                                               len(frame), len(frame)) + frame)
+
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+@pytest.mark.parametrize('writer', [write_pcap, write_pcapng])
+def test_get_trace_statistics(tmp_path, writer) -> None:
+
+    path = str(tmp_path / 'trace.pcap')
+
+    writer(path, PACKETS)
+
+    statistics = get_trace_statistics(path, HOST_IP)
+
+    assert statistics['overall']['number_of_packets'] == 3
+    assert statistics['overall']['data_size'] == 600
+    assert statistics['overall']['capture_duration'] == pytest.approx(2.0)
+    assert statistics['overall']['data_byte_rate'] == pytest.approx(300.0)
+    assert statistics['overall']['data_bit_rate'] == pytest.approx(2400.0)
+    assert statistics['overall']['avg_packet_size'] == pytest.approx(200.0)
+    assert statistics['overall']['avg_packet_rate'] == pytest.approx(1.5)
+
+    assert statistics['outgoing']['number_of_packets'] == 1
+    assert statistics['outgoing']['data_size'] == 100
+    # a single packet has no duration
+    assert statistics['outgoing']['data_byte_rate'] == 0.0
+
+    assert statistics['incoming']['number_of_packets'] == 2
+    assert statistics['incoming']['avg_packet_size'] == pytest.approx(250.0)
+    assert statistics['incoming']['capture_duration'] == pytest.approx(1.5)
+
+
+def test_truncated_capture_is_read_up_to_last_complete_packet(tmp_path) -> None:
+
+    path = str(tmp_path / 'trace.pcap')
+
+    write_pcap(path, PACKETS, truncate=10)
+
+    assert len(list(read_packets(path))) == 2
+
+
+def test_not_a_capture(tmp_path) -> None:
+
+    path = tmp_path / 'trace.pcap'
+
+    path.write_bytes(b'capinfos')
+
+    with pytest.raises(ValueError):
+        list(read_packets(str(path)))
+
+
+def test_live_capture_accumulates_tshark_fields() -> None:
+
+    capture = LiveCapture(HOST_IP, pcap_path=None)
+
+    assert '-w' not in capture.command()
+
+    capture.add_line(f'1.000000000\t100\t{HOST_IP}\n')
+    capture.add_line('1.500000000\t300\t172.18.0.2\n')
+    # non-IP packets (e.g. ARP) count as incoming, like with the tshark filter
+    capture.add_line('3.000000000\t200\t\n')
+    capture.add_line('garbage\n')
+
+    statistics = capture.accumulator.statistics()
+
+    assert statistics['overall']['number_of_packets'] == 3
+    assert statistics['overall']['data_byte_rate'] == pytest.approx(300.0)
+    assert statistics['outgoing']['number_of_packets'] == 1
+    assert statistics['incoming']['data_size'] == 500
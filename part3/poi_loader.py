@@ -0,0 +1,234 @@
+"""
+Bulk loader for the PoI database of the server.
+
+Builds (or extends) fingerprint.db from CSV or JSON Lines files of PoIs:
+
+    python3 poi_loader.py pois.csv more_pois.jsonl -d fingerprint.db --replace
+
+Every PoI has the columns of `server.PoI` (poi_id, poi_name, poi_address,
+grid_id, poi_ratings) plus its location (lat, lon) and type (poi_type), which
+poi_index.py uses for radius queries and type filtering. A missing grid_id is
+computed from the location, a missing poi_id is assigned by SQLite, and
+poi_ratings may be a JSON list or its string. The type may also come from a
+category column of the input (see TYPE_COLUMNS). The original fingerprint.db
+has no type column, so its PoIs are not filtered by subscription until they
+are loaded with their types.
+
+Instead of adding and committing PoIs one by one through the ORM, the rows are
+inserted with `executemany` in batches, all in a single transaction with the
+secondary indexes dropped; the indexes are (re)built once at the end. The
+database is switched to WAL mode, so readers that do not open it as immutable
+can keep reading while a load is running (the server opens it as immutable,
+see poi_store.py, so restart it after a load).
+"""
+
+import argparse
+
+import csv
+
+import itertools
+
+import json
+
+import sqlite3
+
+import sys
+
+import time
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from grid import DEFAULT_GRID, Grid
+
+# Table of server.PoI (Flask-SQLAlchemy's name for the model)
+TABLE = 'po_i'
+
+COLUMNS = ('poi_id', 'poi_name', 'poi_address', 'grid_id', 'poi_ratings', 'lat', 'lon', 'poi_type')
+
+SCHEMA = f'''CREATE TABLE IF NOT EXISTS {TABLE} (
+    poi_id INTEGER NOT NULL PRIMARY KEY,
+    poi_name VARCHAR,
+    poi_address VARCHAR,
+    grid_id INTEGER,
+    poi_ratings VARCHAR,
+    lat FLOAT,
+    lon FLOAT,
+    poi_type VARCHAR
+)'''
+
+# Secondary indexes, created after the rows are in
+INDEXES = {
+    f'ix_{TABLE}_grid_id': 'grid_id',
+    f'ix_{TABLE}_poi_type': 'poi_type',
+}
+
+BATCH_SIZE = 10000
+
+# Columns of the input the type of a PoI is read from, the first that is set
+TYPE_COLUMNS = ('poi_type', 'poi_category', 'category', 'type')
+
+Row = Tuple[Any, ...]
+
+
+def read_pois(path: str) -> Iterator[Dict[str, Any]]:
+    """ PoIs of a CSV (with a header line) or JSON Lines file """
+
+    with open(path, newline='') as f:
+
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _number(value: Any, kind: type) -> Optional[Any]:
+
+    if value is None or value == '':
+        return None
+
+    return kind(value)
+
+
+def to_row(poi: Dict[str, Any], grid: Grid = DEFAULT_GRID) -> Row:
+    """ Values of a PoI in the order of COLUMNS """
+
+    lat = _number(poi.get('lat'), float)
+    lon = _number(poi.get('lon'), float)
+
+    grid_id = _number(poi.get('grid_id'), int)
+
+    if grid_id is None and lat is not None and lon is not None:
+        grid_id = grid.cell_id(lat, lon)
+
+    ratings = poi.get('poi_ratings', [])
+
+    if not isinstance(ratings, str):
+        ratings = json.dumps(ratings)
+
+    poi_type = next((poi[column] for column in TYPE_COLUMNS if poi.get(column)), None)
+
+    return (_number(poi.get('poi_id'), int), poi.get('poi_name'), poi.get('poi_address'),
+            grid_id, ratings, lat, lon, poi_type)
+
+
+def prepare(connection: sqlite3.Connection, replace: bool) -> None:
+    """ Create the table and make sure it has all COLUMNS """
+
+    if replace:
+        connection.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    connection.execute(SCHEMA)
+
+    # databases created by the server lack the location and type
+    existing = {row[1] for row in connection.execute(f'PRAGMA table_info({TABLE})')}
+
+    for column, kind in (('lat', 'FLOAT'), ('lon', 'FLOAT'), ('poi_type', 'VARCHAR')):
+
+        if column not in existing:
+            connection.execute(f'ALTER TABLE {TABLE} ADD COLUMN {column} {kind}')
+
+
+def load(path: str, rows: Iterable[Row], replace: bool = False, batch_size: int = BATCH_SIZE) -> int:
+    """ Insert rows into the PoI table of the database at path
+
+    Returns:
+        the number of inserted rows
+    """
+
+    # autocommit mode: the transaction is managed explicitly below
+    connection = sqlite3.connect(path, isolation_level=None)
+
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+
+        # a crash in the middle of the load leaves the old database (the transaction is rolled back)
+        connection.execute('PRAGMA synchronous=OFF')
+
+        connection.execute('BEGIN IMMEDIATE')
+
+        prepare(connection, replace)
+
+        for name in INDEXES:
+            connection.execute(f'DROP INDEX IF EXISTS {name}')
+
+        insert = f'INSERT INTO {TABLE} ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})'
+
+        rows = iter(rows)
+
+        count = 0
+
+        while True:
+
+            batch = list(itertools.islice(rows, batch_size))
+
+            if not batch:
+                break
+
+            connection.executemany(insert, batch)
+
+            count += len(batch)
+
+        for name, column in INDEXES.items():
+            connection.execute(f'CREATE INDEX {name} ON {TABLE} ({column})')
+
+        connection.execute('COMMIT')
+
+        connection.execute('PRAGMA synchronous=NORMAL')
+
+        connection.execute('ANALYZE')
+
+        return count
+
+    except BaseException:
+
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+
+        raise
+
+    finally:
+        connection.close()
+
+
+def main(args: List[str]) -> None:
+
+    parser = argparse.ArgumentParser(description="Load PoIs into the server's database.")
+    parser.add_argument(
+        "pois",
+        help="CSV (with a header) or JSON Lines files of PoIs.",
+        nargs="+"
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        help="SQLite database to load into.",
+        default="fingerprint.db",
+        type=str
+    )
+    parser.add_argument(
+        "--replace",
+        help="Replace all PoIs of the database instead of adding to them.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="Number of rows per executemany call.",
+        default=BATCH_SIZE,
+        type=int
+    )
+    namespace = parser.parse_args(args)
+
+    rows = (to_row(poi) for path in namespace.pois for poi in read_pois(path))
+
+    start = time.perf_counter()
+
+    count = load(namespace.database, rows, namespace.replace, namespace.batch_size)
+
+    print(f'Loaded {count} PoIs into {namespace.database} in {time.perf_counter() - start:.2f} s')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,5 +1,5 @@
 
-from typing import Any, List, Tuple, Dict
+from typing import Any, List, Optional, Tuple, Dict
 
 from petrelic.multiplicative.pairing import G1, G1Element
 
@@ -7,12 +7,16 @@ from keys import SecretKey, PublicKey
 
 import pickle
 
-import hashlib
-
 from functools import reduce
 
 from credential import sign, verify
 
+from transcript import hash_attribute, issuance_transcript, disclosure_transcript, disclosure_proof_digest
+
+from cache import ReplayCache
+
+from validation import is_well_formed
+
 # ***********************************************************************************
 # Set type aliases
 
@@ -38,10 +42,14 @@ class ServiceProvider:
 
     'Class for representing a service provider in SecretStroll'
 
-    def __init__(self, pk: PublicKey, sk: SecretKey, subscriptions: List[str], username: str):
+    def __init__(self, pk: PublicKey, sk: SecretKey, subscriptions: List[str], username: str,
+                 replay_cache: Optional[ReplayCache] = None):
 
         self.pk: PublicKey = pk
 
+        # verdicts on recently seen disclosure proofs (shared between requests by the server)
+        self.replay_cache: Optional[ReplayCache] = replay_cache
+
         self.sk: SecretKey = sk
 
         self.issuer_attributes: AttributeMap = {'username': username}
@@ -104,11 +112,8 @@ class ServiceProvider:
 
         # Reconstruct c (c')
 
-        hash_input = str(self.pk.g) + str(Y_list) + str(request[2]) + \
-            str(R_prime)
-
-        c_prime = int(hashlib.sha256(hash_input.encode('utf-8')
-                                     ).hexdigest(), 16)
+        c_prime = issuance_transcript(self.pk).append(
+            request[2], R_prime).challenge()
 
         # Verify that c == c'
 
@@ -136,8 +141,7 @@ class ServiceProvider:
         # It has turned out that the server has just a single attribute, which is the user name.
         # We want to use its value in an exponent, hence we hash it to transform it into an integer.
 
-        username_hashed = int(hashlib.sha256(
-            self.issuer_attributes['username'].encode('utf-8')).hexdigest(), 16)
+        username_hashed = hash_attribute(self.issuer_attributes['username'])
 
         # Grab ALL attributes
         all_attributes_values = list(self.user_attributes.values()) + [
@@ -173,8 +177,7 @@ class ServiceProvider:
 
         Y_issuer = self.pk.Y_list[L-1]
 
-        username_hashed = int(hashlib.sha256(
-            self.issuer_attributes['username'].encode('utf-8')).hexdigest(), 16)
+        username_hashed = hash_attribute(self.issuer_attributes['username'])
 
         Y_msg_pow = Y_issuer ** username_hashed
 
@@ -192,18 +195,49 @@ class ServiceProvider:
     def verify_disclosure_proof(
         self,
         disclosure_proof: DisclosureProof,
-        message: bytes
+        message: bytes,
+        looked_up: bool = False
     ) -> bool:
         """ Verify the disclosure proof
 
         Hint: The verifier may also want to retrieve the disclosed attributes
+
+        If a replay cache is set, proofs that have been seen before are answered
+        from the cache without computing any pairings. If looked_up is set, the
+        caller has just looked the proof up in the replay cache and missed, so
+        it is verified and recorded without looking it up again.
         """
 
-        sigma_prime = disclosure_proof[0]
+        # reject malformed proofs before computing any pairing
+        if not is_well_formed(self.pk, disclosure_proof):
+
+            return False
+
+        if self.replay_cache is None:
+
+            return self._verify_disclosure_proof(disclosure_proof, message)
 
-        if sigma_prime[0] == G1.neutral_element():
+        digest = disclosure_proof_digest(disclosure_proof, message)
 
-            return 
+        verdict = None if looked_up else self.replay_cache.lookup(digest)
+
+        if verdict is None:
+
+            verdict = bool(self._verify_disclosure_proof(
+                disclosure_proof, message))
+
+            self.replay_cache.record(digest, verdict)
+
+        return verdict
+
+    def _verify_disclosure_proof(
+        self,
+        disclosure_proof: DisclosureProof,
+        message: bytes
+    ) -> bool:
+        """ Verify the disclosure proof (always computes the pairings) """
+
+        sigma_prime = disclosure_proof[0]
 
         disclosed_attributes = disclosure_proof[1]
 
@@ -232,11 +266,8 @@ class ServiceProvider:
 
                 rhs = rhs * pair_pow
 
-        hash_input = str(self.pk.g_snake) + str(rhs) + \
-            str(self.pk.Y_snake_list) + str(message)
-
-        c_prime = int(hashlib.sha256(
-            hash_input.encode('utf-8')).hexdigest(), 16)
+        c_prime = disclosure_transcript(self.pk).append(
+            rhs, message).challenge()
 
         # print(f'c_prime server side: {c_prime}')
 
@@ -0,0 +1,130 @@
+import pytest
+
+import hashlib
+
+import weakref
+
+from typing import List
+
+from petrelic.multiplicative.pairing import G1
+
+from credential import generate_key
+
+import transcript
+
+from stroll import Client, Server, restore_public_key, serialize_object
+
+from transcript import (Transcript, _disclosure_prefixes, disclosure_transcript, hash_attribute,
+                        issuance_transcript)
+
+""" Test the Fiat-Shamir transcripts in transcript.py """
+
+
+def test_transcript_prefix_is_not_mutated() -> None:
+
+    available_subscriptions: List[str] = ['restaurants', 'bars', 'gyms']
+
+    attributes: List[str] = available_subscriptions + ['zoé']
+
+    pk, sk = generate_key(attributes)
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    c_1 = disclosure_transcript(pk).append(G1.generator(), message).challenge()
+
+    # a second proof forks from the same cached prefix and must not see the first proof's values
+    c_2 = disclosure_transcript(pk).append(G1.generator(), message).challenge()
+
+    assert c_1 == c_2
+
+    assert c_1 != disclosure_transcript(pk).append(
+        G1.generator(), b'another message').challenge()
+
+    # issuance and disclosure challenges are domain separated
+    assert c_1 != issuance_transcript(pk).append(
+        G1.generator(), message).challenge()
+
+
+def test_transcript_encoding_is_unambiguous() -> None:
+
+    assert Transcript().append(b'ab', b'c').challenge() != \
+        Transcript().append(b'a', b'bc').challenge()
+
+    assert Transcript().append([b'a'], b'b').challenge() != \
+        Transcript().append([b'a', b'b']).challenge()
+
+    with pytest.raises(TypeError):
+        Transcript().append(1.5)
+
+
+def test_hash_attribute() -> None:
+
+    # the values credentials issued so far were signed on
+    assert hash_attribute('zoé') == int(hashlib.sha256('zoé'.encode('utf-8')).hexdigest(), 16)
+
+
+def test_transcript_prefix_is_reused_for_serialized_keys() -> None:
+
+    pk, sk = generate_key(['restaurants', 'bars', 'zoé'])
+
+    serialized = serialize_object(pk)
+
+    restored = restore_public_key(serialized)
+
+    # a fresh copy of the same bytes (as received by every sign_request call)
+    assert restore_public_key(bytes(bytearray(serialized))) is restored
+
+    disclosure_transcript(restored)
+
+    assert restored in _disclosure_prefixes
+
+
+class CountingPrefixes(weakref.WeakKeyDictionary):
+
+    'Prefix cache that counts its hits and misses'
+
+    def __init__(self):
+
+        super().__init__()
+
+        self.hits = 0
+
+        self.misses = 0
+
+    def get(self, key, default=None):
+
+        prefix = super().get(key, default)
+
+        if prefix is None:
+            self.misses += 1
+
+        else:
+            self.hits += 1
+
+        return prefix
+
+
+def test_transcript_prefix_is_reused_across_registrations(monkeypatch) -> None:
+
+    prefixes = CountingPrefixes()
+
+    monkeypatch.setattr(transcript, '_issuance_prefixes', prefixes)
+
+    secret_key, public_key = Server.generate_ca(['restaurants', 'bars', 'username'])
+
+    server = Server()
+
+    for username in ('zoé', 'yann'):
+
+        client = Client()
+
+        # every registration receives the serialized key anew
+        issuance_request, state = client.prepare_registration(
+            bytes(bytearray(public_key)), username, ['bars'])
+
+        server.process_registration(
+            secret_key, bytes(bytearray(public_key)), issuance_request, username, ['bars'])
+
+    # the client's and the server's transcripts of both registrations share one prefix
+    assert prefixes.misses == 1
+    assert prefixes.hits == 3
@@ -8,12 +8,12 @@ from petrelic.multiplicative.pairing import G1, G1Element
 
 from keys import SecretKey, PublicKey
 
-import hashlib
-
 from functools import reduce
 
 from credential import generate_key, verify
 
+from transcript import hash_attribute, issuance_transcript, disclosure_transcript
+
 # importing operator for operator functions
 import operator
 
@@ -78,8 +78,7 @@ class User:
                 self.user_attributes.update({elem: 0})
 
         # add the hashed sk to the user_attributes
-        sk_hashed = int(hashlib.sha256(str(self.user_sk).encode('utf-8')
-                                       ).hexdigest(), 16)
+        sk_hashed = hash_attribute(str(self.user_sk))
         self.user_attributes.update({'user_sk': sk_hashed})
 
         self.hidden_attributes: AttributeMap = {}
@@ -167,14 +166,9 @@ class User:
 
         # (c) Compute a hash of all publicly known information (generator of G1, the commitment, Y_1, ... , Y_L, R, and the username (= m here)).
         #     This hash will replace the challenge from the interactive sigma protocol.
+        #     g_1 and Y_1, ... , Y_L are already absorbed in the (cached) key prefix of the transcript.
 
-        hash_input = str(g_1) + str(Y_list) + str(com) + \
-            str(R)
-
-        # print(f"hash client: {hash_input}")
-
-        c = int(hashlib.sha256(hash_input.encode('utf-8')
-                               ).hexdigest(), 16)
+        c = issuance_transcript(self.issuer_pk).append(com, R).challenge()
 
         # (d) Generate L + 1 responses
 
@@ -226,8 +220,7 @@ class User:
         # Check validity of signature
         # Grab ALL attributes
 
-        username_hashed = int(hashlib.sha256(
-            issuer_attributes['username'].encode('utf-8')).hexdigest(), 16)
+        username_hashed = hash_attribute(issuer_attributes['username'])
 
         user_attributes_values = list(self.user_attributes.values())
 
@@ -294,8 +287,7 @@ class User:
 
             if key == 'username':
 
-                username_hashed = int(hashlib.sha256(
-                    value.encode('utf-8')).hexdigest(), 16)
+                username_hashed = hash_attribute(value)
 
                 pair = sigma_prime[0].pair(self.issuer_pk.Y_snake_list[ind])
 
@@ -324,11 +316,9 @@ class User:
 
             ind += 1
 
-        hash_input = str(self.issuer_pk.g_snake) + str(com) + \
-            str(self.issuer_pk.Y_snake_list) + str(message)
-
-        proof = int(hashlib.sha256(hash_input.encode('utf-8')
-                                   ).hexdigest(), 16)
+        # g_snake and the Y_snake_list are already absorbed in the (cached) key prefix of the transcript
+        proof = disclosure_transcript(
+            self.issuer_pk).append(com, message).challenge()
 
         # print(f'proof client side: {proof}')
 
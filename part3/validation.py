@@ -0,0 +1,158 @@
+"""
+Cheap structural validation of disclosure proofs.
+
+`jsonpickle` happily instantiates whatever a request tells it to, and every
+proof that makes it to `verify_disclosure_proof` costs several pairings. The
+functions in here reject malformed requests up front: the raw bytes are size
+limited, parsed as plain JSON, matched against the exact shape a disclosure
+proof serializes to, and the group elements are decoded from their binary
+form directly (which checks the encoding and that the point is on the curve).
+"""
+
+import base64
+
+import binascii
+
+import json
+
+from typing import Any, Dict, Optional, Tuple
+
+from petrelic.multiplicative.pairing import G1, G1Element
+
+from keys import PublicKey
+
+AttributeMap = Dict[str, Any]
+
+Signature = Tuple[G1Element, G1Element]
+
+DisclosureProof = Tuple[Signature, AttributeMap, int]
+
+# A disclosure proof consists of two G1 elements, one disclosed value per
+# subscription and a 256 bit challenge; a few hundred bytes in practice.
+MAX_DISCLOSURE_PROOF_BYTES = 16 * 1024
+
+G1_ENCODING_LENGTH = len(G1.generator().to_binary())
+
+G1_PY_OBJECT = f'{G1Element.__module__}.{G1Element.__name__}'
+
+CHALLENGE_BOUND = 2 ** 256
+
+
+def _parse_g1_element(flattened: Any) -> Optional[G1Element]:
+    """ Decode a jsonpickle-flattened G1 element, None if it is malformed """
+
+    if not isinstance(flattened, dict) or set(flattened) != {'py/object', 'b64repr'}:
+        return None
+
+    if flattened['py/object'] != G1_PY_OBJECT or not isinstance(flattened['b64repr'], str):
+        return None
+
+    try:
+        binary = base64.b64decode(flattened['b64repr'], validate=True)
+
+    except (binascii.Error, ValueError):
+        return None
+
+    if len(binary) != G1_ENCODING_LENGTH:
+        return None
+
+    try:
+        element = G1Element.from_binary(binary)
+
+    except Exception:
+        return None
+
+    if element == G1.neutral_element():
+        return None
+
+    return element
+
+
+def is_well_formed(pk: PublicKey, disclosure_proof: Any) -> bool:
+    """ Check the shape of an (already deserialized) disclosure proof
+
+    Does not compute any pairings.
+    """
+
+    if not isinstance(disclosure_proof, tuple) or len(disclosure_proof) != 3:
+        return False
+
+    sigma_prime, disclosed_attributes, proof = disclosure_proof
+
+    if not isinstance(sigma_prime, tuple) or len(sigma_prime) != 2:
+        return False
+
+    for sigma in sigma_prime:
+
+        if not isinstance(sigma, G1Element) or sigma == G1.neutral_element():
+            return False
+
+    if not isinstance(disclosed_attributes, dict):
+        return False
+
+    for key, value in disclosed_attributes.items():
+
+        if key not in pk.available_subscriptions:
+            return False
+
+        if isinstance(value, bool) or not isinstance(value, int):
+            return False
+
+    if isinstance(proof, bool) or not isinstance(proof, int):
+        return False
+
+    return 0 <= proof < CHALLENGE_BOUND
+
+
+def parse_disclosure_proof(pk: PublicKey, serialized: bytes) -> Optional[DisclosureProof]:
+    """ Deserialize a disclosure proof without going through jsonpickle
+
+    Returns None for anything that is not exactly a serialized disclosure proof.
+    """
+
+    if len(serialized) > MAX_DISCLOSURE_PROOF_BYTES:
+        return None
+
+    try:
+        flattened = json.loads(serialized.decode('utf-8'))
+
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+    # (sigma_prime, disclosed_attributes, proof)
+    if not isinstance(flattened, dict) or set(flattened) != {'py/tuple'}:
+        return None
+
+    items = flattened['py/tuple']
+
+    if not isinstance(items, list) or len(items) != 3:
+        return None
+
+    flattened_sigma, disclosed_attributes, proof = items
+
+    # cheap checks on the attributes and the challenge before decoding any point
+    if not isinstance(flattened_sigma, dict) or set(flattened_sigma) != {'py/tuple'}:
+        return None
+
+    if not isinstance(flattened_sigma['py/tuple'], list) or len(flattened_sigma['py/tuple']) != 2:
+        return None
+
+    if not isinstance(disclosed_attributes, dict) or len(disclosed_attributes) > len(pk.available_subscriptions):
+        return None
+
+    sigma_1 = _parse_g1_element(flattened_sigma['py/tuple'][0])
+
+    if sigma_1 is None:
+        return None
+
+    sigma_2 = _parse_g1_element(flattened_sigma['py/tuple'][1])
+
+    if sigma_2 is None:
+        return None
+
+    disclosure_proof = ((sigma_1, sigma_2), disclosed_attributes, proof)
+
+    if not is_well_formed(pk, disclosure_proof):
+        return None
+
+    return disclosure_proof
@@ -0,0 +1,136 @@
+import pytest
+
+from typing import List
+
+from petrelic.multiplicative.pairing import G1
+
+from credential import generate_key
+
+from serialization import jsonpickle
+
+from stroll import Client, Server, deserialize_object
+
+from user import User
+
+from service_provider import ServiceProvider
+
+from validation import MAX_DISCLOSURE_PROOF_BYTES, is_well_formed, parse_disclosure_proof
+
+""" Test the structural validation of disclosure proofs in validation.py """
+
+
+def make_disclosure_proof():
+
+    available_subscriptions: List[str] = ['restaurants', 'gyms', 'bars']
+
+    username: str = 'zoé'
+
+    provider_pk, provider_sk = generate_key(available_subscriptions + [username])
+
+    chosen_subscriptions = ['restaurants', 'bars']
+
+    user = User(provider_pk, chosen_subscriptions, username)
+
+    provider = ServiceProvider(
+        provider_pk, provider_sk, chosen_subscriptions, username)
+
+    credential = user.obtain_credential(
+        provider.sign_issue_request(user.create_issue_request()))
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    return provider_pk, user.create_disclosure_proof(credential, message)
+
+
+def test_parse_disclosure_proof_roundtrip() -> None:
+
+    pk, disclosure_proof = make_disclosure_proof()
+
+    serialized = jsonpickle.encode(disclosure_proof).encode('utf-8')
+
+    parsed = parse_disclosure_proof(pk, serialized)
+
+    assert parsed == disclosure_proof
+
+
+def test_parse_signed_request() -> None:
+    """ What Client.sign_request sends is exactly what the parser expects
+
+    parse_disclosure_proof relies on the layout of jsonpickle's output; if that
+    changes, this fails instead of every request being rejected.
+    """
+
+    subscriptions: List[str] = ['restaurants', 'gyms', 'bars']
+
+    username: str = 'zoé'
+
+    secret_key, public_key = Server.generate_ca(subscriptions + ['username'])
+
+    server = Server()
+
+    client = Client()
+
+    issuance_request, state = client.prepare_registration(
+        public_key, username, ['restaurants', 'bars'])
+
+    response = server.process_registration(
+        secret_key, public_key, issuance_request, username, ['restaurants', 'bars'])
+
+    credential = client.process_registration_response(public_key, response, state)
+
+    message: bytes = (f"{46.52345},{6.57890}").encode("utf-8")
+
+    signature = client.sign_request(public_key, credential, message, ['bars'])
+
+    parsed = parse_disclosure_proof(deserialize_object(public_key), signature)
+
+    assert parsed is not None
+
+    assert parsed == jsonpickle.decode(signature.decode('utf-8'))
+
+    assert server.check_request_signature(public_key, message, ['bars'], signature)
+
+
+def test_parse_disclosure_proof_rejects_garbage() -> None:
+
+    pk, disclosure_proof = make_disclosure_proof()
+
+    assert parse_disclosure_proof(pk, b'') is None
+
+    assert parse_disclosure_proof(pk, b'\xff\xfe') is None
+
+    assert parse_disclosure_proof(pk, b'[1, 2, 3]') is None
+
+    assert parse_disclosure_proof(
+        pk, b' ' * (MAX_DISCLOSURE_PROOF_BYTES + 1)) is None
+
+    # arbitrary objects are never instantiated
+    assert parse_disclosure_proof(
+        pk, b'{"py/object": "os.system", "py/newargs": ["ls"]}') is None
+
+    # undisclosable attribute
+    sigma_prime, disclosed_attributes, proof = disclosure_proof
+
+    forged = (sigma_prime, {'username': 1}, proof)
+
+    assert parse_disclosure_proof(
+        pk, jsonpickle.encode(forged).encode('utf-8')) is None
+
+
+def test_is_well_formed() -> None:
+
+    pk, disclosure_proof = make_disclosure_proof()
+
+    sigma_prime, disclosed_attributes, proof = disclosure_proof
+
+    assert is_well_formed(pk, disclosure_proof)
+
+    assert not is_well_formed(pk, (sigma_prime, disclosed_attributes))
+
+    assert not is_well_formed(
+        pk, ((G1.neutral_element(), sigma_prime[1]), disclosed_attributes, proof))
+
+    assert not is_well_formed(pk, (sigma_prime, disclosed_attributes, -1))
+
+    assert not is_well_formed(
+        pk, (sigma_prime, {'restaurants': 'yes'}, proof))